@@ -0,0 +1,269 @@
+"""
+This module contains the running state behind the aggregate functions SUM,
+COUNT, AVERAGE, MIN and MAX. The first time a range is aggregated its cells are
+read once, and from then on its sum, count, smallest and largest number are
+kept up to date from the changes to the values of its cells which its sheet
+reports, so a change to one cell of a large range costs O(log n) rather than a
+read of every cell in the range.
+
+Sums are kept exactly and only rounded when they are read, so adding a value
+and later taking it away again never leaves a rounding error behind, and a
+running sum always equals the sum of the values the range holds.
+"""
+
+import heapq
+import math
+from decimal import Context, Decimal, MAX_EMAX, MAX_PREC, MIN_EMIN
+from typing import Iterable, Optional, Tuple
+
+from .error_types import CellError, CellErrorType
+from .spreadsheet import location_coords
+
+# A context in which Decimals are added without rounding
+_EXACT = Context(prec=MAX_PREC, Emax=MAX_EMAX, Emin=MIN_EMIN)
+
+# Floats are added exactly as integer multiples of the smallest subnormal float
+_FLOAT_SCALE = 1074
+
+
+def _negate(value):
+    """
+    Returns the negation of a number, without rounding it.
+    """
+    return value.copy_negate() if isinstance(value, Decimal) else -value
+
+
+class ExactSum():
+    """
+    A sum of finite numbers which is kept without rounding. Decimals are added
+    in a context with the largest precision, and floats are added as integers.
+    """
+
+    def __init__(self):
+        self._total = 0
+
+    def add(self, value, times: int = 1) -> None:
+        """
+        Adds a finite number to the sum the given number of times, which is -1
+        to take it away.
+        """
+        if isinstance(value, float):
+            numerator, denominator = value.as_integer_ratio()
+            self._total += times * (numerator << (_FLOAT_SCALE + 1 -
+                                                  denominator.bit_length()))
+        elif times == 1:
+            self._total = _EXACT.add(self._total, value)
+        elif times == -1:
+            self._total = _EXACT.subtract(self._total, value)
+        else:
+            self._total = _EXACT.add(self._total, _EXACT.multiply(value, times))
+
+    def add_sum(self, other: 'ExactSum') -> None:
+        """
+        Adds another sum of numbers of the same type to the sum.
+        """
+        if isinstance(self._total, int) and isinstance(other._total, int):
+            self._total += other._total
+        else:
+            self._total = _EXACT.add(self._total, other._total)
+
+    def value(self, number_type: type):
+        """
+        Returns the sum as a number of the given type, rounded once.
+        """
+        if number_type is float:
+            try:
+                return self._total / (1 << _FLOAT_SCALE)
+            except OverflowError:
+                return math.copysign(math.inf, self._total)
+        return +Decimal(self._total)
+
+
+class Summary():
+    """
+    The sum, count, smallest and largest of a collection of numbers of one
+    type. Infinities and NaNs are counted apart from the exact sum of the
+    finite numbers.
+
+    Attributes:
+        number_type (type): The type of the numbers.
+        count (int): The number of numbers.
+    """
+
+    def __init__(self, number_type: type):
+        self.number_type = number_type
+        self.count = 0
+        self._sum = ExactSum()
+        self._nans = 0
+        self._infinities = {True: 0, False: 0}
+        self._smallest = None
+        self._largest = None
+
+    def add(self, value, times: int = 1) -> None:
+        """
+        Adds a number to the collection the given number of times.
+        """
+        self.count += times
+        if value != value:
+            self._nans += times
+            return
+        if math.isfinite(value):
+            self._sum.add(value, times)
+        else:
+            self._infinities[value > 0] += times
+        if self._smallest is None or value < self._smallest:
+            self._smallest = value
+        if self._largest is None or value > self._largest:
+            self._largest = value
+
+    def merge(self, other: 'Summary') -> None:
+        """
+        Adds the numbers of another summary to the collection.
+        """
+        self.count += other.count
+        self._sum.add_sum(other._sum)
+        self._nans += other._nans
+        for sign in self._infinities:
+            self._infinities[sign] += other._infinities[sign]
+        for value in (other.smallest(), other.largest()):
+            if value is not None and value == value:
+                if self._smallest is None or value < self._smallest:
+                    self._smallest = value
+                if self._largest is None or value > self._largest:
+                    self._largest = value
+
+    def total(self):
+        """
+        Returns the sum of the numbers, which is zero if there are none.
+        """
+        positive, negative = self._infinities[True], self._infinities[False]
+        if self._nans or (positive and negative):
+            return self.number_type("nan")
+        if positive or negative:
+            return self.number_type("inf" if positive else "-inf")
+        return self._sum.value(self.number_type)
+
+    def smallest(self):
+        """
+        Returns the smallest of the numbers, a NaN if any of them is a NaN, or
+        None if there are none.
+        """
+        return self.number_type("nan") if self._nans else self._smallest
+
+    def largest(self):
+        """
+        Returns the largest of the numbers, a NaN if any of them is a NaN, or
+        None if there are none.
+        """
+        return self.number_type("nan") if self._nans else self._largest
+
+
+class RangeAggregate(Summary):
+    """
+    The summary of the numbers in a range, together with the errors in it,
+    which is updated as the values of its cells change. The smallest and
+    largest numbers are kept in heaps, from which the numbers taken out of the
+    range are only removed once they reach the top.
+    """
+
+    def __init__(self, number_type: type, items: Iterable[Tuple[str, object]]):
+        """
+        Initializes the aggregate of a range from the locations and values of
+        its populated cells.
+        """
+        super().__init__(number_type)
+        # The number of cells holding each number, and the errors by location
+        self._counts = {}
+        self._errors = {}
+        for location, value in items:
+            self._add(location, value)
+        self._low = list(self._counts)
+        self._high = [_negate(value) for value in self._counts]
+        heapq.heapify(self._low)
+        heapq.heapify(self._high)
+
+    def _add(self, location: str, value) -> None:
+        """
+        Adds the value of the cell at the given location, except to the heaps.
+        """
+        if isinstance(value, self.number_type):
+            self.count += 1
+            if value != value:
+                self._nans += 1
+                return
+            if math.isfinite(value):
+                self._sum.add(value)
+            else:
+                self._infinities[value > 0] += 1
+            self._counts[value] = self._counts.get(value, 0) + 1
+        elif isinstance(value, CellError):
+            self._errors[location] = value
+
+    def replace(self, location: str, old_value, new_value) -> None:
+        """
+        Updates the aggregate for the cell at the given location changing from
+        the old value to the new value, either of which may be None for an
+        empty cell.
+        """
+        if isinstance(old_value, self.number_type):
+            self.count -= 1
+            if old_value != old_value:
+                self._nans -= 1
+            else:
+                if math.isfinite(old_value):
+                    self._sum.add(old_value, -1)
+                else:
+                    self._infinities[old_value > 0] -= 1
+                remaining = self._counts[old_value] - 1
+                if remaining:
+                    self._counts[old_value] = remaining
+                else:
+                    del self._counts[old_value]
+        elif isinstance(old_value, CellError):
+            del self._errors[location]
+        self._add(location, new_value)
+        if isinstance(new_value, self.number_type) and new_value == new_value:
+            heapq.heappush(self._low, new_value)
+            heapq.heappush(self._high, _negate(new_value))
+        # Rebuild the heaps once most of their entries are stale
+        if len(self._low) > 2 * len(self._counts) + 32:
+            self._low = list(self._counts)
+            self._high = [_negate(value) for value in self._counts]
+            heapq.heapify(self._low)
+            heapq.heapify(self._high)
+
+    def smallest(self):
+        """
+        Returns the smallest number in the range, popping the numbers which
+        have been taken out of the range off the top of the heap.
+        """
+        if self._nans:
+            return self.number_type("nan")
+        while self._low and self._low[0] not in self._counts:
+            heapq.heappop(self._low)
+        return self._low[0] if self._low else None
+
+    def largest(self):
+        """
+        Returns the largest number in the range, popping the numbers which
+        have been taken out of the range off the top of the heap.
+        """
+        if self._nans:
+            return self.number_type("nan")
+        while self._high and _negate(self._high[0]) not in self._counts:
+            heapq.heappop(self._high)
+        return _negate(self._high[0]) if self._high else None
+
+    def error(self) -> Optional[CellError]:
+        """
+        Returns the error a function reading the range reports, which is the
+        first circular reference error in the range, or failing that its first
+        error, row by row, or None if the range holds no errors.
+        """
+        if not self._errors:
+            return None
+        def order(location):
+            col, row = location_coords(location)
+            return (self._errors[location].get_type() !=
+                    CellErrorType.CIRCULAR_REFERENCE, row, col)
+        return self._errors[min(self._errors, key=order)]
@@ -0,0 +1,329 @@
+"""
+This module contains the arrays formulas operate on when they use ranges as
+values. A range used as a value evaluates to an ArrayValue holding the values
+of its cells, and the arithmetic, concatenation and comparison operators apply
+elementwise to arrays, broadcasting them against each other and against single
+values as NumPy does, so one formula such as =A1:A1000 * B1:B1000 computes a
+whole block of results. A formula whose value is an array spills it into the
+block of cells below and to the right of the formula cell.
+
+The array operations on numbers are shared with the vectorized evaluator.
+Decimals are operated on as arrays of Python objects, while floats are
+operated on as native float arrays.
+"""
+
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from lark import Tree
+
+from .cell import FormulaTemplate
+from .error_types import CellError, CellErrorType
+from .evaluator import Evaluator, NumericMode
+from .regexp import CELL_TOKEN
+from .spreadsheet import location_coords
+
+# Elementwise forms of the evaluator helpers, for values which are not all
+# numbers
+is_error = np.frompyfunc(lambda value: isinstance(value, CellError), 1, 1)
+first_error = np.frompyfunc(
+    lambda val1, val2: Evaluator.values_error_helper((val1, val2)), 2, 1)
+
+# Array forms of the comparison operators, for arrays of numbers
+VECTOR_COMPARISONS = {
+    "=": np.equal,
+    "==": np.equal,
+    "<>": np.not_equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+
+class NumberArrays():
+    """
+    The array operations on the numbers of a numeric mode. Arrays of floats
+    are converted to native float arrays to be operated on, and arrays of any
+    other numbers are operated on as arrays of Python objects.
+    """
+
+    def __init__(self, numeric: NumericMode):
+        self.numeric = numeric
+        self.number_type = numeric.number_type
+        self.native = numeric.number_type is float
+        self.check_numeric = np.frompyfunc(numeric.check_numeric, 1, 1)
+        self.process_num = np.frompyfunc(numeric.process_num, 1, 1)
+
+    def all_numbers(self, values: np.ndarray) -> bool:
+        """
+        Returns whether every value in the array is a number.
+        """
+        return set(map(type, values)) <= {self.number_type}
+
+    def numbers(self, values: np.ndarray):
+        """
+        Converts an array of values to numbers, as check_numeric does for a
+        single value. Returns the numbers and a mask of the values which are
+        errors, or None if none are.
+        """
+        if self.all_numbers(values):
+            return values, None
+        values = self.check_numeric(values)
+        return values, is_error(values).astype(bool)
+
+    def apply(self, operation, val1: np.ndarray, val2: np.ndarray) -> np.ndarray:
+        """
+        Applies an arithmetic operation to two arrays of numbers, returning the
+        normalized results.
+        """
+        if self.native:
+            result = operation(val1.astype(float), val2.astype(float))
+            if result.dtype != object:
+                return (result + 0.0).astype(object)
+        else:
+            result = operation(val1, val2)
+        return self.process_num(result)
+
+    def compare(self, test, val1: np.ndarray, val2: np.ndarray) -> np.ndarray:
+        """
+        Applies an array comparison to two arrays of numbers.
+        """
+        if self.native:
+            val1, val2 = val1.astype(float), val2.astype(float)
+        return test(val1, val2).astype(bool).astype(object)
+
+
+# Array operations for each numeric mode, by name
+_NUMBER_ARRAYS = {}
+
+
+def number_arrays(numeric: NumericMode) -> NumberArrays:
+    """
+    Returns the array operations for the given numeric mode, which are only
+    created once for each mode.
+    """
+    arrays = _NUMBER_ARRAYS.get(numeric.name)
+    if arrays is None:
+        arrays = _NUMBER_ARRAYS[numeric.name] = NumberArrays(numeric)
+    return arrays
+
+
+def arithmetic(arrays: NumberArrays, operation, val1: np.ndarray,
+               val2: np.ndarray) -> np.ndarray:
+    """
+    Applies an arithmetic operation to two 1-D arrays of values of the same
+    length, giving the first error of the operands in the positions where
+    either operand is an error.
+    """
+    (val1, errors1), (val2, errors2) = arrays.numbers(val1), arrays.numbers(val2)
+    if errors1 is None and errors2 is None:
+        return arrays.apply(operation, val1, val2)
+    if errors1 is None or errors2 is None:
+        errors = errors1 if errors2 is None else errors2
+    else:
+        errors = errors1 | errors2
+    result = np.empty(len(val1), dtype=object)
+    valid = ~errors
+    result[valid] = arrays.apply(operation, val1[valid], val2[valid])
+    result[errors] = first_error(val1[errors], val2[errors])
+    return result
+
+
+def divide(val1: np.ndarray, val2: np.ndarray) -> np.ndarray:
+    """
+    Divides two 1-D arrays of numbers, giving an error in the positions
+    dividing by zero.
+    """
+    zero = (val2 == 0).astype(bool)
+    if not zero.any():
+        return val1 / val2
+    result = np.empty(len(val1), dtype=object)
+    result[~zero] = val1[~zero] / val2[~zero]
+    result[zero] = [CellError(CellErrorType.DIVIDE_BY_ZERO, "Divided by zero")
+                    for _ in range(zero.sum())]
+    return result
+
+
+def may_spill(template: FormulaTemplate) -> bool:
+    """
+    Returns whether the given formula template may evaluate to an array, which
+    is the case if it uses a range other than as an argument of a function.
+    """
+    if template.may_spill is None:
+        ranges = sum(1 for _ in template.tree.find_data("cell_range"))
+        arguments = sum(1 for node in template.tree.iter_subtrees()
+                        if node.data in ("function", "arg_list")
+                        for child in node.children
+                        if isinstance(child, Tree) and child.data == "cell_range")
+        template.may_spill = ranges > arguments
+    return template.may_spill
+
+
+def array_shape(template: FormulaTemplate, location: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns the number of rows and columns of the array the given formula
+    template evaluates to at the given location, which is (1, 1) for a single
+    value, without evaluating it. Returns None if the shapes of the operands of
+    an operator do not match.
+    """
+    offset = (0, 0)
+    if template.anchor is not None:
+        (col, row), (anchor_col, anchor_row) = (location_coords(location.upper()),
+                                                location_coords(template.anchor))
+        offset = (col - anchor_col, row - anchor_row)
+
+    def shape(tree) -> Optional[Tuple[int, int]]:
+        if tree.data == "cell_range":
+            corners = []
+            for token in tree.children[-2:]:
+                match = CELL_TOKEN.fullmatch(token.value.upper())
+                col, row = location_coords(token.value.upper().replace("$", ""))
+                corners.append((col + (0 if match.group(1) else offset[0]),
+                                row + (0 if match.group(3) else offset[1])))
+            return (abs(corners[1][1] - corners[0][1]) + 1,
+                    abs(corners[1][0] - corners[0][0]) + 1)
+        if tree.data not in ("parens", "unary_op", "add_expr", "mul_expr",
+                             "concat_expr", "comp_expr"):
+            return (1, 1)
+        shapes = [shape(child) for child in tree.children if isinstance(child, Tree)]
+        if None in shapes:
+            return None
+        try:
+            return np.broadcast_shapes(*shapes)
+        except ValueError:
+            return None
+    return shape(template.tree)
+
+
+class ArrayValue():
+    """
+    The value of a formula which evaluates to a block of values rather than a
+    single value. Empty cells read from a range are None.
+
+    Attributes:
+        values (np.ndarray): The values, as a 2-D array of Python objects
+            indexed by row and then column.
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.values = values
+
+    def __repr__(self) -> str:
+        return f"ArrayValue({self.values.tolist()!r})"
+
+    @classmethod
+    def full(cls, shape: Tuple[int, int], value) -> "ArrayValue":
+        """
+        Returns an array of the given shape holding the given value everywhere.
+        """
+        return cls(np.full(shape, value, dtype=object))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """
+        The number of rows and columns of the array.
+        """
+        return self.values.shape
+
+
+def range_array(range_value) -> ArrayValue:
+    """
+    Returns the array of the values of the cells in a range, only reading its
+    populated cells.
+    """
+    left, top, right, bottom = range_value.bounds
+    values = np.full((bottom - top + 1, right - left + 1), None, dtype=object)
+    for location, value in range_value.items():
+        col, row = location_coords(location)
+        values[row - top, col - left] = value
+    return ArrayValue(values)
+
+
+def _operands(val1, val2) -> Optional[tuple]:
+    """
+    Returns the values of two operands, either of which may be an array,
+    broadcast to their common shape and flattened, along with the shape, or
+    None if the shapes of the operands are incompatible.
+    """
+    operands = []
+    for value in (val1, val2):
+        if isinstance(value, ArrayValue):
+            operands.append(value.values)
+        else:
+            single = np.empty((1, 1), dtype=object)
+            single[0, 0] = value
+            operands.append(single)
+    try:
+        shape = np.broadcast_shapes(operands[0].shape, operands[1].shape)
+    except ValueError:
+        return None
+    return (np.broadcast_to(operands[0], shape).ravel(),
+            np.broadcast_to(operands[1], shape).ravel(), shape)
+
+
+def _size_error() -> CellError:
+    """
+    Returns the error of an operation on arrays whose sizes do not match.
+    """
+    return CellError(CellErrorType.TYPE_ERROR, "Array sizes do not match.")
+
+
+def array_arithmetic(numeric: NumericMode, operation, val1, val2):
+    """
+    Applies an arithmetic operation elementwise to two operands, at least one
+    of which is an array, returning an ArrayValue or an error.
+    """
+    operands = _operands(val1, val2)
+    if operands is None:
+        return _size_error()
+    val1, val2, shape = operands
+    return ArrayValue(arithmetic(number_arrays(numeric), operation,
+                                 val1, val2).reshape(shape))
+
+
+def array_negate(numeric: NumericMode, value: ArrayValue, negate: bool) -> ArrayValue:
+    """
+    Applies a unary minus, or a unary plus if negate is False, to every value
+    in an array.
+    """
+    arrays = number_arrays(numeric)
+    values, errors = arrays.numbers(value.values.ravel())
+    if negate:
+        values = values.copy()
+        valid = slice(None) if errors is None else ~errors
+        values[valid] = -values[valid]
+    return ArrayValue(arrays.process_num(values).reshape(value.shape))
+
+
+def array_apply(function: Callable, val1, val2):
+    """
+    Applies an elementwise function of two values, such as one made with
+    np.frompyfunc, to two operands, at least one of which is an array.
+    Returns an ArrayValue or an error.
+    """
+    operands = _operands(val1, val2)
+    if operands is None:
+        return _size_error()
+    val1, val2, shape = operands
+    return ArrayValue(function(val1, val2).reshape(shape))
+
+
+def array_compare(numeric: NumericMode, vector_test, compare: Callable, val1, val2):
+    """
+    Compares two operands elementwise, at least one of which is an array.
+    Arrays of numbers are compared with the array comparison vector_test, and
+    any other values one at a time with the elementwise function compare.
+    Returns an ArrayValue or an error.
+    """
+    operands = _operands(val1, val2)
+    if operands is None:
+        return _size_error()
+    val1, val2, shape = operands
+    arrays = number_arrays(numeric)
+    if arrays.all_numbers(val1) and arrays.all_numbers(val2):
+        result = arrays.compare(vector_test, val1, val2)
+    else:
+        result = compare(val1, val2)
+    return ArrayValue(result.reshape(shape))
@@ -9,23 +9,210 @@ enumeration.
 from decimal import Decimal, InvalidOperation
 import enum
 import re
-from functools import lru_cache
+from collections import namedtuple, OrderedDict
+import threading
 
 import lark
 
 from .error_types import CellError, CellErrorType, error_dict
+from .regexp import FORMULA_TOKEN, CELL_TOKEN, NOT_REF_SUFFIX
+from . import spreadsheet
 
-# Preallocate a parser for the evaluator to use
-PARSER = lark.Lark.open('sheets/formulas.lark', start='formula', ordered_sets=False)
+# Preallocate a parser for the evaluator to use. The grammar is found next to
+# this module, and the LALR tables built from it are cached by lark in the
+# temporary directory, so later processes load them instead of rebuilding them.
+PARSER = lark.Lark.open('formulas.lark', rel_to=__file__, start='formula',
+                        parser='lalr', cache=True)
+
+
+class FormulaTemplate:
+    """
+    A parsed formula shared by every formula which differs from it only by the
+    relative offsets of its cell references, such as the cells of a column
+    filled with =A1+1, =A2+1, and so on.
+
+    Attributes:
+        tree: The parse tree of the first formula seen with this template.
+        anchor (str): The location of that formula, which the relative
+            references in the tree are relative to, or None if the tree is
+            only used at its own location.
+        compiled (dict): The compiled forms of the template for each numeric
+            mode, set by the compiler.
+        parallel_safe (bool): Whether the template can be evaluated on the
+            process pool, or None if not yet checked.
+        vectorizable (bool): Whether the template can be vectorized, or None
+            if not yet checked.
+        may_spill (bool): Whether the template may evaluate to an array, or
+            None if not yet checked.
+        vectorized (dict): The vectorized forms of the template for each
+            numeric mode, set by the vectorizer.
+    """
+
+    def __init__(self, tree, anchor):
+        self.tree = tree
+        self.anchor = anchor
+        self.compiled = {}
+        self.parallel_safe = None
+        self.vectorizable = None
+        self.may_spill = None
+        self.vectorized = {}
+
+    def __deepcopy__(self, memo):
+        # Templates are shared between cells, so copied cells share them too
+        return self
+
+
+# Number of formula templates kept by the formula cache unless resized
+FORMULA_CACHE_SIZE = 10000
+
+FormulaCacheInfo = namedtuple("FormulaCacheInfo",
+                              ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+
+class FormulaCache:
+    """
+    A least recently used cache of formula templates by their template keys,
+    shared by every workbook in the process. Templates evicted from the cache
+    stay alive as long as cells still use them, and are parsed again the next
+    time a formula with their key is set.
+
+    Attributes:
+        maxsize (int): The number of templates kept, or None for no limit.
+        hits (int): The number of lookups which found their template.
+        misses (int): The number of lookups which did not.
+        evictions (int): The number of templates evicted to make room.
+    """
+
+    def __init__(self, maxsize=FORMULA_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def get(self, key):
+        """
+        Returns the template with the given key, marking it as the most
+        recently used, or None if it is not cached.
+        """
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._templates.move_to_end(key)
+            return template
+
+    def put(self, key, template: "FormulaTemplate") -> None:
+        """
+        Caches the given template under the given key, evicting the least
+        recently used templates if the cache is full.
+        """
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            self._evict()
+
+    def resize(self, maxsize) -> None:
+        """
+        Sets the number of templates kept, or None for no limit, evicting the
+        least recently used templates if the cache holds more than that.
+        Raises a ValueError if the size is negative.
+        """
+        if maxsize is not None and maxsize < 0:
+            raise ValueError("Formula cache size cannot be negative.")
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self) -> None:
+        """
+        Empties the cache and resets its counters.
+        """
+        with self._lock:
+            self._templates.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> FormulaCacheInfo:
+        """
+        Returns the counters and size of the cache.
+        """
+        return FormulaCacheInfo(self.hits, self.misses, self.evictions,
+                                self.maxsize, len(self._templates))
+
+    def _evict(self) -> None:
+        if self.maxsize is None:
+            return
+        while len(self._templates) > self.maxsize:
+            self._templates.popitem(last=False)
+            self.evictions += 1
+
+
+# Formula templates by their template keys
+FORMULA_CACHE = FormulaCache()
+
+
+def template_key(contents: str, location: str):
+    """
+    Returns the key shared by every formula which differs from the given one,
+    at the given location, only by the relative offsets of its cell references.
+    The relative parts of each valid reference are replaced by their offsets
+    from the location, marked off by null characters. Returns None if the
+    formula has no location or already contains null characters.
+    """
+    if location is None or "\0" in contents:
+        return None
+    anchor_col, anchor_row = spreadsheet.location_coords(location)
+    parts = []
+    prev_idx = 0
+    for token in FORMULA_TOKEN.finditer(contents):
+        match = CELL_TOKEN.fullmatch(token.group())
+        if (match is None or NOT_REF_SUFFIX.match(contents, token.end()) or
+                not spreadsheet.check_valid_location(match[2] + match[4])):
+            continue
+        abs_col, col, abs_row, row = match.groups()
+        col_num, row_num = spreadsheet.location_coords(col + row)
+        parts.append(contents[prev_idx:token.start()])
+        parts.append("\0" + (abs_col + col.upper() if abs_col else
+                             str(col_num - anchor_col)))
+        parts.append("\0" + (abs_row + row if abs_row else str(row_num - anchor_row)))
+        prev_idx = token.end()
+    parts.append(contents[prev_idx:])
+    return "".join(parts)
+
+
+def get_template(contents: str, location: str) -> FormulaTemplate:
+    """
+    Returns the template of the given formula at the given location, or of the
+    formula alone if the location is None. The formula is only parsed if no
+    formula with the same template is in the formula cache. Raises a lark error
+    if the formula does not parse.
+    """
+    key = template_key(contents, location)
+    if key is None:
+        # Formulas without a location are only shared with identical formulas,
+        # under keys which never equal a template key
+        key = (contents,)
+        location = None
+    template = FORMULA_CACHE.get(key)
+    if template is None:
+        template = FormulaTemplate(PARSER.parse(contents),
+                                   None if location is None else location.upper())
+        FORMULA_CACHE.put(key, template)
+    return template
 
 
-@lru_cache(maxsize=None)
 def cached_parse(contents: str):
     """
-    This function is a decorator that caches the results of the parse method
-    for a given string. This should improve the performance of evaluating formulas
+    Returns the parse tree of the given formula, parsing it only if it is not
+    in the formula cache. Raises a lark error if the formula does not parse.
     """
-    return PARSER.parse(contents)
+    return get_template(contents, None).tree
 
 
 class CellType(enum.Enum):
@@ -43,6 +230,8 @@ class CellType(enum.Enum):
 
     BOOL = 5
 
+    SPILL = 6
+
 # Utility Functions)
 
 class Cell:
@@ -52,9 +241,12 @@ class Cell:
     Attributes:
         content (str): The string content of the cell.
         type (CellType): The type of the cell.
-        value: The evaluated value of the cell. Can be a string or a Decimal.
-        sheet (Spreadsheet): The spreadsheet that the cell belongs to.
-        parse_tree: The cached parse tree of the cell's formula or None.
+        value: The evaluated value of the cell. Can be a string or a number,
+            which is a Decimal unless the workbook uses floats.
+        sheet (Spreadsheet): The spreadsheet that the cell belongs to, which is
+            told whenever the value of the cell changes.
+        template (FormulaTemplate): The shared template of the cell's formula,
+            or None if the cell is not a formula.
     """
 
     def __init__(self, content: str, sheet=None, location=None):
@@ -69,9 +261,12 @@ class Cell:
         self._value = None
         self.sheet = sheet
         self.location = location
+        self.template = None
 
         # Determine the type and evaluate the cell
         self._parse_contents()
+        if sheet is not None and self._value is not None:
+            sheet.value_changed(location, None, self._value)
 
     # Getters and Setters
 
@@ -97,8 +292,11 @@ class Cell:
         """ 
         Sets the content of the cell and re-evaluates the cell.
         """
+        prev_value = self._value
         self._content = content.strip()
         self._parse_contents()
+        if self.sheet is not None and self._value is not prev_value:
+            self.sheet.value_changed(self.location, prev_value, self._value)
 
     def set_value(self, value) -> None:
         """ 
@@ -108,7 +306,10 @@ class Cell:
         """
         if not self._type == CellType.FORMULA:
             raise TypeError("Value cannot be mutated for non-formula cells.")
+        prev_value = self._value
         self._value = value
+        if self.sheet is not None and value is not prev_value:
+            self.sheet.value_changed(self.location, prev_value, value)
 
     # Private Methods
 
@@ -119,12 +320,13 @@ class Cell:
         """
         if self._content == "":
             raise ValueError("Cell content cannot be empty.")
+        self.template = None
 
         # Check whether cell holds a formula
         if self._content.startswith("="):
             self._type = CellType.FORMULA
             try:
-                cached_parse(self._content)
+                self.template = get_template(self._content, self.location)
             except lark.exceptions.LarkError as e:
                 self._type = CellType.PARSE_ERROR
                 self._value = CellError(CellErrorType.PARSE_ERROR, str(e))
@@ -141,14 +343,18 @@ class Cell:
         try:
             # Check if the cell may be parsed as a number
             assert self._content == re.sub("[a-z|A-Z]", "", self._content)
-            value = Decimal(self._content)
-            # Strip trailing zeroes while preserving value
-            self._value = (value.quantize(1) if value == value.to_integral()
-                          else value.normalize())
+            numeric = getattr(self.sheet, "numeric", None)
+            if numeric is not None and numeric.number_type is not Decimal:
+                self._value = numeric.process_num(numeric.parse(self._content))
+            else:
+                value = Decimal(self._content)
+                # Strip trailing zeroes while preserving value
+                self._value = (value.quantize(1) if value == value.to_integral()
+                              else value.normalize())
             self._type = CellType.NUMBER
 
         # If not a number or formula, cell is a string
-        except (InvalidOperation, AssertionError) as _:
+        except (InvalidOperation, ValueError, AssertionError) as _:
             self._type = CellType.STRING
             if error_dict.get(self._content.upper()):
                 self._value = CellError(error_dict[self._content.upper()],
@@ -158,3 +364,42 @@ class Cell:
                 self._value = self._content[1:]
             else:
                 self._value = self._content
+
+
+class SpillCell(Cell):
+    """
+    A cell holding one value of an array spilled from a formula cell, which is
+    the anchor of the array. A spilled cell has no contents, and its value is
+    set by the workbook when the anchor is evaluated.
+
+    Attributes:
+        anchor (str): The location of the formula cell the value spilled from,
+            which is on the same sheet.
+    """
+
+    def __init__(self, value, anchor: str, sheet=None, location=None):
+        # pylint: disable-next=super-init-not-called
+        self._content = None
+        self._type = CellType.SPILL
+        self._value = value
+        self.sheet = sheet
+        self.location = location
+        self.template = None
+        self.anchor = anchor
+        if sheet is not None:
+            sheet.value_changed(location, None, value)
+
+    def set_content(self, content: str) -> None:
+        """
+        Spilled cells have no contents, which are set by replacing the cell.
+        """
+        raise TypeError("Contents cannot be set for spilled cells.")
+
+    def set_value(self, value) -> None:
+        """
+        Sets the value spilled into the cell.
+        """
+        prev_value = self._value
+        self._value = value
+        if self.sheet is not None and value is not prev_value:
+            self.sheet.value_changed(self.location, prev_value, value)
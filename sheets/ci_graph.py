@@ -4,90 +4,724 @@ cells containing formulas within a workbook and their dependencies. This class
 is used by the evaluator to detect circular references and by the workbook to
 update cells when their dependencies change.
 """
-from collections import defaultdict
-from typing import Tuple
-from copy import deepcopy
-from .regexp import replace_names
+from array import array
+from typing import Optional, Tuple
+from .regexp import references_sheet, replace_names
+from .ranges import is_range, range_bounds, PointIndex, RangeIndex
+
+
+def _remove_item(items: array, item: int) -> None:
+    """
+    Removes a single occurrence of an item from an array by moving the last
+    element into its place, so the rest of the array does not need to shift.
+    """
+    index = items.index(item)
+    items[index] = items[-1]
+    items.pop()
+
 
 class CellInteractionGraph():
     """
     This class represents a graph of cells containing formulas and their
-    dependencies. The graph maps strings of cell locations to lists of strings
-    of cell locations. The graph is directed, and the edges represent
-    dependencies.
+    dependencies. Cells are given to and returned from the graph as tuples of
+    the lowercase sheet name and the cell location. The graph is directed, and
+    the edges represent dependencies.
+
+    Internally, every cell in the graph is interned to a dense integer id, and
+    the adjacency lists are arrays of ids indexed by id. A side table maps ids
+    back to cells, and the ids of cells leaving the graph are reused.
+
+    A reverse index mapping each cell to the formula cells which reference it
+    is maintained alongside the graph, so that the cells affected by a change
+    can be found without visiting the rest of the workbook.
+
+    The graph also maintains a topological order of its cells which is updated
+    locally as dependencies are added, using the Pearce-Kelly algorithm. Cells
+    in the same strongly connected component (i.e. a cycle) share a single
+    position in the order, so the order is always over the condensation of the
+    graph. Each cell is mapped to an integer key, and a cell must be evaluated
+    after every cell it depends on with a smaller key.
+
+    Cycles are tracked in a persistent table mapping each cell in a cycle to
+    the members of its strongly connected component. Components are merged
+    when an added edge closes a cycle and split when a removed edge breaks
+    one, only ever looking at the cells involved.
+
+    Besides the static dependencies found in its formula, a cell may have
+    dynamic dependencies which are only discovered when it is evaluated, such
+    as the branch taken by an IF or the target of an INDIRECT. These are kept
+    between evaluations and only the difference is applied to the graph when
+    they change.
+
+    A range read by a formula, such as A1:B10, is a single node in the graph,
+    which depends on the formula cells inside it but not on the other cells in
+    it. Ranges are never formula cells, so they are left out of has_cell and
+    get_cells, but are otherwise treated as cells whose value changes whenever
+    a cell inside them changes. The ranges covering a cell which is not a
+    formula are found through an index of the ranges on each sheet instead.
+
+    A formula whose value is an array spills it into a block of cells, and the
+    whole block is represented by the formula cell, its anchor. The cells of
+    the block only enter the graph when a formula references them, and then
+    depend on the anchor, as do the ranges overlapping the block, so a change
+    to the array reaches every reader of the block through a single node.
     """
 
     def __init__(self):
         """
         Initializes a new cell interaction graph with no cells.
         """
-        self.graph = {}
+        # Side tables mapping cells to ids and ids to cells. Freed ids are kept
+        # to be handed out to the next cell entering the graph.
+        self._ids = {}
+        self._cells = []
+        self._free = []
+        # Dependencies of every cell, which are None for cells without a
+        # formula, and the formula cells referencing every cell
+        self._deps = []
+        self._rdeps = []
+        # Dependencies of every cell which were found while evaluating it
+        # rather than in its formula
+        self._dynamic = {}
+        # Topological order keys of every cell in the graph, and the members of
+        # the strongly connected component of every cell which is in a cycle
+        self._order = array('q')
+        self._sccs = {}
+        # Cells which joined or left a cycle since the workbook last asked
+        self._cycle_changes = set()
+        # Keys to hand out to cells entering the graph. New dependents are
+        # placed after every other cell and new dependencies before them.
+        self._high_key = 0
+        self._low_key = -1
+        # The ranges in the graph and the formula cells in the graph, indexed
+        # by their locations on each sheet
+        self._ranges = RangeIndex()
+        self._formulas = PointIndex()
+        # Every cell in the graph which is not a range, indexed by its location
+        # on each sheet, to find the cells inside the areas arrays fill
+        self._points = PointIndex()
+        # The area each formula cell spills an array into and the area it
+        # fills, which is None while the spill is blocked, indexed by the id of
+        # the formula cell and by the areas on each sheet. Cells and ranges
+        # depending on the filled areas are mapped to the ids of their anchors.
+        self._spills = {}
+        self._spill_areas = RangeIndex()
+        self._filled = RangeIndex()
+        self._linked = {}
 
     def set_cell(self, cell: Tuple[str, str]) -> None:
         """
         Adds a cell to the graph. The cell should be a Formula Cell.
         """
-        self.graph[cell] = []
+        if self.has_cell(cell):
+            self.remove_cell(cell)
+        cell_id = self._ids.get(cell)
+        # A formula written over a spilled cell no longer depends on its anchor
+        for anchor_id in list(self._linked.get(cell_id, ())):
+            self._unlink(cell_id, anchor_id)
+        cell_id = self._intern(cell, True)
+        self._deps[cell_id] = array('l')
+        self._formulas.add(cell[0], cell[1], cell_id)
+        for range_id in self._ranges.covering(cell[0], cell[1]):
+            self._add_edge(range_id, cell_id)
 
     def add_dependency(self, cell: Tuple[str, str], dependency: Tuple[str, str]) -> None:
         """
         Adds a dependency to a cell in the graph. The cell should be a
         Formula Cell.
         """
-        self.graph[cell].append(dependency)
+        self._add_edge(self._ids[cell], self._intern(dependency, False))
 
     def remove_dependency(self, cell: Tuple[str, str], dependency: Tuple[str, str]) -> None:
         """
-        Adds a dependency to a cell in the graph. The cell should be a
+        Removes a dependency from a cell in the graph. The cell should be a
         Formula Cell.
         """
-        self.graph[cell].remove(dependency)
+        dep_id = self._ids[dependency]
+        self._remove_edge(self._ids[cell], dep_id)
+        self._discard(dep_id)
+
+    def set_dynamic_dependencies(self, cell: Tuple[str, str], dependencies) -> list:
+        """
+        Replaces the dynamic dependencies of a cell with the cells it read in
+        its latest evaluation, ignoring those which are already static
+        dependencies. Only the edges which changed are added to or removed from
+        the graph. Returns the dependencies which were not there before.
+        """
+        cell_id = self._ids[cell]
+        old = self._dynamic.pop(cell_id, set())
+        static = set(self._deps[cell_id]) - old
+        new = {self._intern(dependency, False) for dependency in dependencies}
+        new -= static
+        for dep_id in old - new:
+            self._remove_edge(cell_id, dep_id)
+            self._discard(dep_id)
+        added = new - old
+        for dep_id in added:
+            self._add_edge(cell_id, dep_id)
+        if new:
+            self._dynamic[cell_id] = new
+        return [self._cells[dep_id] for dep_id in added]
+
+    def has_dynamic_dependencies(self, cell: Tuple[str, str]) -> bool:
+        """
+        Returns whether the cell has any dynamic dependencies.
+        """
+        return self._ids.get(cell) in self._dynamic
 
     def remove_cell(self, cell: Tuple[str]) -> None:
         """
         Removes a cell from the graph. The cell should be a Formula Cell.
         Also needs to remove the cell from any other cells' dependencies.
         """
-        self.graph.pop(cell)
+        cell_id = self._ids[cell]
+        if cell_id in self._spills:
+            self.set_spill(cell, None, None)
+        # Ranges only depend on the formula cells inside them
+        self._formulas.remove(cell[0], cell[1])
+        for range_id in self._ranges.covering(cell[0], cell[1]):
+            self._remove_edge(range_id, cell_id)
+        component = self._sccs.get(cell_id)
+        deps = self._deps[cell_id]
+        self._deps[cell_id] = None
+        self._dynamic.pop(cell_id, None)
+        for dep_id in deps:
+            _remove_item(self._rdeps[dep_id], cell_id)
+        if component is not None:
+            # Removing the cell's edges may break the cycle it was in
+            self._split(component)
+        for dep_id in set(deps):
+            if dep_id != cell_id:
+                self._discard(dep_id)
+        self._discard(cell_id)
 
-    def get_dependencies(self, cell: Tuple[str, str]) -> list[str]:
+    def _intern(self, cell: Tuple[str, str], dependent: bool) -> int:
         """
-        Returns the dependencies of a cell in the graph. The cell should be a
-        Formula Cell.
+        Returns the id of a cell, giving it an id and a position in the
+        topological order if it is entering the graph. A cell with no edges
+        may go anywhere, so dependents are placed at the end of the order and
+        dependencies at the start, where the edges about to be added to them
+        cannot violate the order.
+        """
+        cell_id = self._ids.get(cell)
+        if cell_id is not None:
+            return cell_id
+        if dependent:
+            key = self._high_key
+            self._high_key += 1
+        else:
+            key = self._low_key
+            self._low_key -= 1
+        if self._free:
+            cell_id = self._free.pop()
+            self._cells[cell_id] = cell
+            self._rdeps[cell_id] = array('l')
+            self._order[cell_id] = key
+        else:
+            cell_id = len(self._cells)
+            self._cells.append(cell)
+            self._deps.append(None)
+            self._rdeps.append(array('l'))
+            self._order.append(key)
+        self._ids[cell] = cell_id
+        if not is_range(cell[1]):
+            self._points.add(cell[0], cell[1], cell_id)
+        else:
+            # A range depends on the formula cells already inside it
+            self._deps[cell_id] = array('l')
+            self._ranges.add(cell[0], cell[1], cell_id)
+            for member in self._formulas.inside(cell[0], cell[1]):
+                self._add_edge(cell_id, member)
+        if self._spills and not dependent:
+            # A cell or range entering a filled area depends on its anchor
+            for anchor_id in self._anchors_filling(cell):
+                self._link(cell_id, anchor_id)
+        return cell_id
+
+    def _discard(self, cell_id: int) -> None:
+        """
+        Frees the id of a cell once it is no longer a formula cell or
+        referenced by one, or of a range once no formula references it.
+        """
+        if self._rdeps[cell_id]:
+            return
+        sheet, location = self._cells[cell_id]
+        anchors = self._linked.pop(cell_id, None)
+        if anchors is not None:
+            # Nothing depends on the cell, so it is not in a cycle
+            for anchor_id in anchors:
+                _remove_item(self._deps[cell_id], anchor_id)
+                _remove_item(self._rdeps[anchor_id], cell_id)
+            if not is_range(location):
+                self._deps[cell_id] = None
+        if is_range(location):
+            # Nothing depends on the range, so it is not in a cycle
+            self._ranges.remove(sheet, location, cell_id)
+            for member in self._deps[cell_id]:
+                _remove_item(self._rdeps[member], cell_id)
+            self._deps[cell_id] = None
+        if self._deps[cell_id] is None:
+            if not is_range(location):
+                self._points.remove(sheet, location)
+            del self._ids[self._cells[cell_id]]
+            self._cells[cell_id] = None
+            self._sccs.pop(cell_id, None)
+            self._free.append(cell_id)
+
+    def _add_edge(self, cell_id: int, dep_id: int) -> None:
+        """
+        Adds an edge from a formula cell to one of its dependencies and
+        restores the topological order.
+        """
+        self._deps[cell_id].append(dep_id)
+        self._rdeps[dep_id].append(cell_id)
+        self._insert_edge(dep_id, cell_id)
+
+    def _link(self, cell_id: int, anchor_id: int) -> None:
+        """
+        Makes a cell or range overlapping the area filled by a spilled array
+        depend on the formula cell the array spilled from.
+        """
+        if self._deps[cell_id] is None:
+            self._deps[cell_id] = array('l')
+        self._linked.setdefault(cell_id, set()).add(anchor_id)
+        self._add_edge(cell_id, anchor_id)
+
+    def _unlink(self, cell_id: int, anchor_id: int) -> None:
+        """
+        Removes the dependency of a cell or range on the formula cell of a
+        spilled array.
+        """
+        self._remove_edge(cell_id, anchor_id)
+        anchors = self._linked[cell_id]
+        anchors.discard(anchor_id)
+        if not anchors:
+            del self._linked[cell_id]
+            if not is_range(self._cells[cell_id][1]):
+                self._deps[cell_id] = None
+
+    def _anchors_filling(self, cell: Tuple[str, str]) -> list[int]:
+        """
+        Returns the formula cells whose spilled arrays fill the given cell,
+        other than the cell itself, or which fill part of the given range
+        without the formula cell lying in it. A range already depends on the
+        formula cells inside it.
+        """
+        sheet, location = cell
+        if not is_range(location):
+            return [anchor_id for anchor_id in self._filled.covering(sheet, location)
+                    if self._cells[anchor_id] != cell]
+        left, top, right, bottom = range_bounds(location)
+        found = []
+        for anchor_id in self._filled.overlapping(sheet, location):
+            fill_left, fill_top, _, _ = range_bounds(self._spills[anchor_id][1])
+            if not (left <= fill_left <= right and top <= fill_top <= bottom):
+                found.append(anchor_id)
+        return found
+
+    def _overlapping(self, sheet: str, location: str) -> set[int]:
+        """
+        Returns the ids of the cells in the graph inside the range with the
+        given location on the given sheet, and of the ranges overlapping it.
+        """
+        return (set(self._points.inside(sheet, location)) |
+                self._ranges.overlapping(sheet, location))
+
+    def _remove_edge(self, cell_id: int, dep_id: int) -> None:
+        """
+        Removes a single edge from a formula cell to one of its dependencies,
+        splitting the cycle containing the edge if there is one.
+        """
+        _remove_item(self._deps[cell_id], dep_id)
+        _remove_item(self._rdeps[dep_id], cell_id)
+        if self._in_same_scc(cell_id, dep_id):
+            self._split(self._sccs[cell_id])
+
+    def _in_same_scc(self, cell_id: int, other_id: int) -> bool:
+        """
+        Returns whether the two cells are in the same cycle.
+        """
+        return cell_id in self._sccs and other_id in self._sccs[cell_id]
+
+    def _members(self, cell_id: int) -> list[int]:
+        """
+        Returns all cells sharing a position in the topological order with the
+        given cell.
+        """
+        return self._sccs.get(cell_id, (cell_id,))
+
+    def _search(self, start: int, bound: int, forward: bool):
+        """
+        Depth first search from the given cell over whole strongly connected
+        components, visiting only cells whose keys are within the bound. A
+        forward search follows dependents and visits keys no greater than the
+        bound, while a backward search follows dependencies and visits keys no
+        less than the bound. Returns the set of visited cells and the list of
+        visited components.
+        """
+        adjacency = self._rdeps if forward else self._deps
+        order = self._order
+        visited = set()
+        components = []
+        to_visit = [start]
+        while to_visit:
+            node = to_visit.pop()
+            if node in visited:
+                continue
+            members = self._members(node)
+            visited.update(members)
+            components.append(members)
+            for member in members:
+                for neighbor in adjacency[member] or ():
+                    if neighbor in visited:
+                        continue
+                    key = order[neighbor]
+                    if (key <= bound) if forward else (key >= bound):
+                        to_visit.append(neighbor)
+        return visited, components
+
+    def _insert_edge(self, dependency: int, cell: int) -> None:
+        """
+        Restores the topological order after an edge from the dependency to
+        the cell was added, using the Pearce-Kelly algorithm. Only the cells
+        whose keys lie between the keys of the two endpoints are visited, and
+        only those which must move are reordered. If the edge closes a cycle,
+        the components on the cycle are merged into a single component.
+        """
+        lower, upper = self._order[cell], self._order[dependency]
+        if lower > upper:
+            return
+        if lower == upper:
+            # The cells already share a component, unless this is a self loop
+            if cell == dependency and cell not in self._sccs:
+                self._sccs[cell] = [cell]
+                self._cycle_changes.add(self._cells[cell])
+            return
+
+        # Find the cells after the dependent which must now follow it, and the
+        # cells before the dependency which must now precede it
+        forward, forward_comps = self._search(cell, upper, True)
+        backward, backward_comps = self._search(dependency, lower, False)
+        keys = sorted({self._order[comp[0]] for comp in backward_comps + forward_comps})
+
+        # If the dependency depends on the cell, the edge closes a cycle made
+        # up of the components reachable in both directions. Any cycle through
+        # the new edge lies between the two endpoints in the order, so no other
+        # cells can be part of it.
+        cycle = []
+        if dependency in forward:
+            cycle = [member for comp in forward_comps if comp[0] in backward
+                     for member in comp]
+            forward_comps = [comp for comp in forward_comps
+                             if comp[0] not in backward]
+            backward_comps = [comp for comp in backward_comps
+                              if comp[0] not in forward]
+            for member in cycle:
+                self._sccs[member] = cycle
+            self._cycle_changes.update(self._cells[member] for member in cycle)
+
+        # Reassign the keys of the affected components so that those before
+        # the dependency come first, keeping relative order within each set.
+        # Cells before the dependency only move down and cells after the
+        # dependent only move up, so edges leaving the affected region remain
+        # in order. A merged cycle takes a spare key between the two.
+        backward_comps.sort(key=lambda comp: self._order[comp[0]])
+        forward_comps.sort(key=lambda comp: self._order[comp[0]])
+        new_keys = keys[:len(backward_comps)]
+        if cycle:
+            new_keys.append(keys[len(backward_comps)])
+        new_keys += keys[len(keys) - len(forward_comps):]
+        new_order = backward_comps + ([cycle] if cycle else []) + forward_comps
+        for key, comp in zip(new_keys, new_order):
+            for member in comp:
+                self._order[member] = key
+
+    def _split(self, component: list[int]) -> None:
+        """
+        Recomputes the strongly connected components among the members of a
+        former cycle after one of its edges was removed. The first of the new
+        components keeps the position of the old one, and the rest are placed
+        after it before restoring the order of their dependents.
+        """
+        members = set(component)
+        self._cycle_changes.update(self._cells[member] for member in component)
+        pieces = self._tarjan(component)
+        for piece in pieces:
+            cyclic = len(piece) > 1 or piece[0] in (self._deps[piece[0]] or ())
+            for member in piece:
+                if cyclic:
+                    self._sccs[member] = piece
+                else:
+                    self._sccs.pop(member, None)
+        for piece in pieces[1:]:
+            for member in piece:
+                self._order[member] = self._high_key
+            self._high_key += 1
+        for piece in pieces[1:]:
+            for member in piece:
+                for dependent in self._rdeps[member]:
+                    if dependent not in members:
+                        self._insert_edge(member, dependent)
+
+    def ordered(self, cells) -> list[Tuple[str, str]]:
+        """
+        Returns the given cells sorted in topological order, so that every cell
+        comes after the cells it depends on.
         """
-        if cell not in self.graph:
+        ids, order = self._ids, self._order
+        return sorted(cells, key=lambda cell: order[ids[cell]] if cell in ids else 0)
+
+    def pop_cycle_changes(self) -> set[Tuple[str, str]]:
+        """
+        Returns the cells which joined or left a cycle since this was last
+        called. The values of these cells must be recomputed even if none of
+        their dependencies changed value.
+        """
+        changes, self._cycle_changes = self._cycle_changes, set()
+        return changes
+
+    def get_order_key(self, cell: Tuple[str, str]) -> int:
+        """
+        Returns the key of the cell in the topological order. A cell must be
+        evaluated after every cell it depends on with a smaller key.
+        """
+        cell_id = self._ids.get(cell)
+        return 0 if cell_id is None else self._order[cell_id]
+
+    def in_cycle(self, cell: Tuple[str, str]) -> bool:
+        """
+        Returns whether the cell is part of a circular reference.
+        """
+        return self._ids.get(cell) in self._sccs
+
+    def get_component(self, cell: Tuple[str, str]) -> list[Tuple[str, str]]:
+        """
+        Returns the cells in the same circular reference as the given cell, or
+        just the cell itself if it is not part of one.
+        """
+        cell_id = self._ids.get(cell)
+        if cell_id not in self._sccs:
+            return [cell]
+        return [self._cells[member] for member in self._sccs[cell_id]]
+
+    def has_cell(self, cell: Tuple[str, str]) -> bool:
+        """
+        Returns whether the cell is a Formula Cell in the graph.
+        """
+        cell_id = self._ids.get(cell)
+        return (cell_id is not None and self._deps[cell_id] is not None and
+                not is_range(cell[1]) and cell_id not in self._linked)
+
+    def has_dependency(self, cell: Tuple[str, str], dependency: Tuple[str, str]) -> bool:
+        """
+        Returns whether the cell in the graph depends on the given cell. The
+        cell should be a Formula Cell.
+        """
+        dep_id = self._ids.get(dependency)
+        return dep_id is not None and dep_id in self._deps[self._ids[cell]]
+
+    def get_dependents(self, cell: Tuple[str, str]) -> list[Tuple[str, str]]:
+        """
+        Returns the formula cells and ranges which directly depend on the given
+        cell.
+        """
+        dependents = self._covering(cell)
+        if cell in self._ids:
+            dependents.extend(self._rdeps[self._ids[cell]])
+        return [self._cells[dependent] for dependent in dependents]
+
+    def get_covering_ranges(self, cells) -> set[Tuple[str, str]]:
+        """
+        Returns the ranges covering any of the given cells which are not
+        formula cells, and so are not dependencies of the ranges.
+        """
+        return {self._cells[range_id] for cell in cells
+                for range_id in self._covering(cell)}
+
+    def _covering(self, cell: Tuple[str, str]) -> list[int]:
+        """
+        Returns the ranges covering a cell which does not already have edges
+        to them, which is every cell but the formula cells.
+        """
+        if self.has_cell(cell) or is_range(cell[1]):
+            return []
+        return list(self._ranges.covering(cell[0], cell[1]))
+
+    def get_affected(self, cells) -> set[Tuple[str, str]]:
+        """
+        Returns the given cells together with every cell which transitively
+        depends on any of them. Only these cells may need to be reevaluated
+        when the given cells change.
+        """
+        affected = set(cells)
+        to_visit = [self._ids[cell] for cell in affected if cell in self._ids]
+        for cell in affected:
+            to_visit.extend(self._covering(cell))
+        visited = set(to_visit)
+        while to_visit:
+            for dependent in self._rdeps[to_visit.pop()]:
+                if dependent not in visited:
+                    visited.add(dependent)
+                    to_visit.append(dependent)
+        affected.update(self._cells[cell_id] for cell_id in visited)
+        return affected
+
+    def cells_in_sheet(self, sheet_name: str) -> set[Tuple[str, str]]:
+        """
+        Returns all cells in the graph on the given sheet, whether they are
+        formula cells, cells referenced by a formula or ranges.
+        """
+        sheet_name = sheet_name.lower()
+        return {cell for cell in self._ids if cell[0] == sheet_name}
+
+    def get_dependencies(self, cell: Tuple[str, str]) -> list[Tuple[str, str]]:
+        """
+        Returns the dependencies of a cell in the graph, which for a range are
+        the formula cells inside it, and for a cell filled by a spilled array
+        is the formula cell of the array. The cell should be a Formula Cell, a
+        range or a spilled cell.
+        """
+        cell_id = self._ids.get(cell)
+        if cell_id is None or self._deps[cell_id] is None:
             return []
-        return self.graph[cell]
+        return [self._cells[dep_id] for dep_id in self._deps[cell_id]]
+
+    def get_formulas_in(self, sheet: str, location: str) -> list[Tuple[str, str]]:
+        """
+        Returns the formula cells inside the range with the given location on
+        the sheet with the given lowercase name, whether or not any formula
+        reads the range.
+        """
+        return [self._cells[cell_id]
+                for cell_id in self._formulas.inside(sheet, location)]
 
     def get_cells(self) -> list[Tuple[str, str]]:
         """
         Returns all formula cells in the graph.
         """
-        return self.graph.keys()
+        return [cell for cell_id, (cell, deps) in enumerate(zip(self._cells, self._deps))
+                if deps is not None and not is_range(cell[1]) and
+                cell_id not in self._linked]
+
+    def set_spill(self, cell: Tuple[str, str], area: Optional[str],
+                  filled: Optional[str]) -> list[Tuple[str, str]]:
+        """
+        Records the area a formula cell spills an array into, which is None if
+        its value is not an array, and the area the array fills, which is None
+        while the spill is blocked. The cells and ranges referenced by formulas
+        which overlap the filled area depend on the formula cell. Returns the
+        cells and ranges which no longer depend on it.
+        """
+        cell_id = self._ids[cell]
+        old_area, old_filled = self._spills.get(cell_id, (None, None))
+        if area == old_area and filled == old_filled:
+            return []
+        sheet = cell[0]
+        if old_area is not None:
+            del self._spills[cell_id]
+            self._spill_areas.remove(sheet, old_area, cell_id)
+        if area is not None:
+            self._spills[cell_id] = (area, filled)
+            self._spill_areas.add(sheet, area, cell_id)
+        if filled == old_filled:
+            return []
+        if old_filled is not None:
+            self._filled.remove(sheet, old_filled, cell_id)
+        if filled is not None:
+            self._filled.add(sheet, filled, cell_id)
 
-    def tarjan(self) -> tuple[list[Tuple[str, str]], set[Tuple[str, str]]]:
+        # Link the cells and ranges overlapping the new area from scratch
+        unlinked = {dependent for dependent in self._rdeps[cell_id]
+                    if cell_id in self._linked.get(dependent, ())}
+        for dependent in unlinked:
+            self._unlink(dependent, cell_id)
+        if filled is not None:
+            for other_id in self._overlapping(sheet, filled):
+                other = self._cells[other_id]
+                if (not self.has_cell(other) and
+                        cell_id in self._anchors_filling(other)):
+                    self._link(other_id, cell_id)
+                    unlinked.discard(other_id)
+        return [self._cells[dependent] for dependent in unlinked]
+
+    def get_spill(self, cell: Tuple[str, str]) -> Optional[Tuple[str, Optional[str]]]:
         """
-        Returns a topological ordering of the cells in the graph using Tarjan's
-        algorithm for finding strongly connected components. Also returns a set
-        of all cells that are part of a cycle.
+        Returns the area a formula cell spills an array into and the area the
+        array fills, which is None if the spill is blocked, or None if the
+        cell does not spill.
         """
-        ids = defaultdict(lambda : -1) #id of -1 -> never seen a node before
-        lowlinks = defaultdict(int)
-        on_stack = {}
+        return self._spills.get(self._ids.get(cell))
+
+    def spill_anchors(self, sheet: str, location: str) -> list[Tuple[str, str]]:
+        """
+        Returns the formula cells other than the given cell whose arrays spill
+        into areas including the cell, or overlapping the given range, whether
+        or not they are blocked.
+        """
+        if not is_range(location):
+            return [self._cells[anchor_id]
+                    for anchor_id in self._spill_areas.covering(sheet, location)
+                    if self._cells[anchor_id] != (sheet, location)]
+        return [self._cells[anchor_id]
+                for anchor_id in self._spill_areas.overlapping(sheet, location)]
+
+    def is_spilled(self, cell: Tuple[str, str]) -> bool:
+        """
+        Returns whether the cell or range depends on the formula cell of a
+        spilled array filling it.
+        """
+        return self._ids.get(cell) in self._linked
+
+    def tarjan(self, nodes=None) -> list[list[Tuple[str, str]]]:
+        """
+        Returns the strongly connected components of the graph in topological
+        order, so that each component comes after the components it depends
+        on. If a set of cells is given, only the subgraph induced by those
+        cells is considered.
+        """
+        if nodes is not None:
+            nodes = [self._ids[cell] for cell in nodes]
+        return [[self._cells[member] for member in component]
+                for component in self._tarjan(nodes)]
+
+    def _tarjan(self, nodes=None) -> list[list[int]]:
+        """
+        Returns the strongly connected components of the subgraph induced by
+        the given cell ids in topological order using Tarjan's algorithm, or
+        of the whole graph if no ids are given. The subgraph is first copied
+        into CSR form, renumbering its cells from zero, so that the search
+        itself only touches flat arrays.
+        """
+        offsets = array('l', [0])
+        targets = array('l')
+        if nodes is None:
+            # Ids are already dense, so the whole graph needs no renumbering
+            nodes = range(len(self._cells))
+            for deps in self._deps:
+                if deps is not None:
+                    targets.extend(deps)
+                offsets.append(len(targets))
+        else:
+            local = {node: index for index, node in enumerate(nodes)}
+            for node in nodes:
+                for dep_id in self._deps[node] or ():
+                    if dep_id in local:
+                        targets.append(local[dep_id])
+                offsets.append(len(targets))
+
+        ids = array('l', [-1]) * len(nodes) #id of -1 -> never seen a node before
+        lowlinks = array('l', [0]) * len(nodes)
+        on_stack = bytearray(len(nodes))
         stack = []
         call_stack = []
         node_id = 0
-        scc_count = 0
-        scc_nodes = set()
-        nodes_in_cycle = set() # track first nodes in topological order
-        order = []
-        for node in self.graph:
-            if ids[node] == -1: #unvisited node
-                call_stack.append([node, 0])
+        components = []
+        for root in range(len(nodes)):
+            if ids[root] == -1: #unvisited node
+                call_stack.append((root, 0))
                 while call_stack:
                     node, child_idx = call_stack.pop()
-                    neighbors = self.get_dependencies(node)
-                    num_neighbors = len(neighbors)
+                    first, last = offsets[node], offsets[node + 1]
                     if child_idx == 0:#if the child index is 0, this is the
                                       #first time we are seeing this node
                         #add it to the stack
@@ -106,26 +740,25 @@ class CellInteractionGraph():
                         #child_idx - 1, because in that recursive call, we
                         #incremented child_idx before pushing it onto the call
                         #stack.
-                        child = neighbors[child_idx - 1]
+                        child = targets[first + child_idx - 1]
                         #when we backtrack, we min lowlinks of the parent and
                         #child as per tarjans algo
                         lowlinks[node] = min(lowlinks[node],lowlinks[child])
-                    while (child_idx < num_neighbors and
-                           ids[neighbors[child_idx]] != -1):
+                    while (first + child_idx < last and
+                           ids[targets[first + child_idx]] != -1):
                         #if the child is already on the stack, this is a loop, so
                         #min the curr lowlink of the node and the lowlink of the
                         #seen child to get the new lowlink of the node, this is
                         #where backtracking begins
-                        seen = neighbors[child_idx]
+                        seen = targets[first + child_idx]
                         if on_stack[seen]:
-                            nodes_in_cycle.add(node)
                             lowlinks[node] = min(lowlinks[node], lowlinks[seen])
                         child_idx += 1
 
                     #only want to do this if there are still children left that
                     #we haven't seen
-                    if child_idx < num_neighbors:
-                        child = neighbors[child_idx]
+                    if first + child_idx < last:
+                        child = targets[first + child_idx]
                         #For the below lines, the next thing we want to DFS on is
                         #the child, so we push it to the stack after we push the
                         #same node back on, but with a pointer to the next child
@@ -137,30 +770,22 @@ class CellInteractionGraph():
 
                     #we only pop off from the stack once we've backtracked all
                     #the way to the beginning of a connected component do not
-                    #confuse this stack with the call stack
+                    #confuse this stack with the call stack. Components are
+                    #completed after all the components they depend on, so
+                    #they are emitted in topological order
                     if lowlinks[node] == ids[node]:
                         scc = []
                         while True:
                             popped = stack.pop()
                             on_stack[popped] = False
-                            #lowlinks[popped] = ids[node]
-                            scc.append(popped)
+                            scc.append(nodes[popped])
                             if popped == node:
                                 break
-                        if len(scc) > 1 or popped in self.get_dependencies(popped):
-                            #again, we only want sccs with more than one node or
-                            #sccs with a self loop
-                            for node in scc:
-                                scc_nodes.add(node)
-                            scc_count += 1
-                    #add the node to the order after its children have been
-                    #processed, resulting in a post order traversal this will
-                    #only get called when the continue above is not executed,
-                    #meaning there are no more children that haven't been
-                    #processed
-                    order.append(node)
-
-        return order, nodes_in_cycle, scc_nodes
+                        # Freed ids are left out of the components
+                        if self._cells[scc[0]] is not None:
+                            components.append(scc)
+
+        return components
 
     def rename_sheet(self, wb, old_name: str, new_name: str) -> None:
         """
@@ -168,23 +793,79 @@ class CellInteractionGraph():
          - Rename any cell in the renamed old_sheet to the new_sheet
          - Find any formulas that reference the renamed old_sheet and update
            the reference to the new_sheet
+        Cells are renamed in place in the side tables, so no edges need to
+        change unless a formula already referenced a cell on the new sheet.
         """
-        new_graph = deepcopy(self.graph)
-        for (sheet, cell) in self.graph:
-            # If the cell is in the old sheet, rename it in the graph
-            if sheet == old_name.lower():
-                new_graph[(new_name.lower(), cell)] = new_graph.pop((sheet, cell))
-                sheet = new_name.lower()
-            # If the cell references the old sheet, update the reference and the
-            # formula in the cell
-            for dependency in new_graph[(sheet, cell)]:
-                if dependency[0] == old_name.lower():
-                    new_graph[(sheet, cell)].remove(dependency)
-                    new_graph[(sheet, cell)].append((new_name.lower(),
-                                                          dependency[1]))
-                    # Update the formula in the cell
-                    cell_obj = wb.get_sheet(sheet).get_cell(cell)
-                    cell_obj.set_content(replace_names(cell_obj.get_content(),
-                                                         old_name, new_name))
-        # Use the new graph as the reference graph
-        self.graph = new_graph
+        old_lower, new_lower = old_name.lower(), new_name.lower()
+        renamed = [cell_id for cell, cell_id in self._ids.items()
+                   if cell[0] == old_lower]
+        # The new sheet did not exist, so it has no formula cells
+        self._formulas.rename_sheet(old_lower, new_lower)
+        for cell_id in renamed:
+            cell = (new_lower, self._cells[cell_id][1])
+            if is_range(cell[1]):
+                self._ranges.remove(old_lower, cell[1], cell_id)
+                self._ranges.add(new_lower, cell[1], cell_id)
+            if cell_id in self._spills:
+                area, filled = self._spills[cell_id]
+                self._spill_areas.remove(old_lower, area, cell_id)
+                self._spill_areas.add(new_lower, area, cell_id)
+                if filled is not None:
+                    self._filled.remove(old_lower, filled, cell_id)
+                    self._filled.add(new_lower, filled, cell_id)
+            # A formula referencing the new sheet before it existed now
+            # references the renamed cell instead
+            existing = self._ids.get(cell)
+            if existing is not None:
+                for dependent in list(self._rdeps[existing]):
+                    self._remove_edge(dependent, existing)
+                    dynamic = self._dynamic.get(dependent, set())
+                    if existing in dynamic:
+                        dynamic.discard(existing)
+                        if cell_id in self._deps[dependent]:
+                            # Already a dependency of the cell, so the dynamic
+                            # edge is dropped rather than duplicated
+                            if not dynamic:
+                                del self._dynamic[dependent]
+                            continue
+                        dynamic.add(cell_id)
+                    self._add_edge(dependent, cell_id)
+                self._discard(existing)
+            if not is_range(cell[1]):
+                self._points.remove(old_lower, cell[1])
+                self._points.add(new_lower, cell[1], cell_id)
+            del self._ids[self._cells[cell_id]]
+            self._cells[cell_id] = cell
+            self._ids[cell] = cell_id
+
+        # Formula cells moved onto the new sheet lie inside any ranges which
+        # formulas read on it before it existed
+        renamed = set(renamed)
+        for cell_id in renamed:
+            sheet, location = self._cells[cell_id]
+            if self._deps[cell_id] is not None and not is_range(location):
+                for range_id in self._ranges.covering(sheet, location):
+                    if range_id not in renamed:
+                        self._add_edge(range_id, cell_id)
+            if cell_id in self._spills and self._spills[cell_id][1] is not None:
+                # So do the cells and ranges read on it overlapping the arrays
+                # spilled from them
+                for other_id in self._overlapping(sheet, self._spills[cell_id][1]):
+                    other = self._cells[other_id]
+                    if (other_id not in renamed and not self.has_cell(other) and
+                            cell_id in self._anchors_filling(other)):
+                        self._link(other_id, cell_id)
+
+        # Update the formulas in the cells which reference the old sheet. The
+        # references are found in the formulas themselves, since references
+        # which are only read as they are evaluated, such as the arguments of
+        # IF or AND after the first, are not always edges of the graph.
+        for cell_id, deps in enumerate(self._deps):
+            if (deps is None or is_range(self._cells[cell_id][1]) or
+                    cell_id in self._linked):
+                continue
+            sheet, location = self._cells[cell_id]
+            cell_obj = wb.get_sheet(sheet).get_cell(location)
+            if references_sheet(cell_obj.get_content(), old_name):
+                cell_obj.set_content(replace_names(cell_obj.get_content(),
+                                                   old_name, new_name))
@@ -0,0 +1,563 @@
+"""
+This module contains the formula compiler, which translates the parse tree of a
+formula into nested Python closures once, so that evaluating a formula does not
+walk its tree through the interpreter every time. Cell references are resolved
+and operators are chosen when the formula is compiled.
+
+A compiled formula is called with an Evaluator, which supplies the workbook,
+sheet and cell the formula is evaluated in and records the cells it reads. It
+returns the same value the Evaluator computes by visiting the parse tree.
+Formula templates are compiled with their relative references as offsets from
+the location of the evaluated cell, so one compiled template serves every cell
+sharing it. Formulas are compiled for the numeric mode of the workbook, so the
+arithmetic operators work directly on its kind of numbers.
+
+A range used as a value, rather than passed to a function, evaluates to an
+array of the values of its cells, and the operators apply elementwise to
+arrays. The operators only check for arrays once their operands turn out not
+to be numbers, so formulas on single values pay nothing for them.
+"""
+
+from functools import partial
+from typing import Callable
+
+from lark import Tree
+import numpy as np
+
+from .arrays import (ArrayValue, VECTOR_COMPARISONS, array_apply,
+                     array_arithmetic, array_compare, array_negate, divide,
+                     range_array)
+from .cell import FormulaTemplate
+from .error_types import CellError, CellErrorType, error_dict
+from .evaluator import Evaluator, NumericMode, NONE_TYPES, DECIMAL
+from .ranges import range_name
+from .regexp import CELL_TOKEN
+from .spreadsheet import (check_valid_location, location_coords,
+                          location_from_coords)
+
+check_numeric = Evaluator.check_numeric
+check_str = Evaluator.check_str
+check_bool = Evaluator.check_bool
+values_error_helper = Evaluator.values_error_helper
+comp_helper = Evaluator.comp_helper
+
+# Tests applied to the result of comp_helper for each comparison operator
+COMPARISONS = {
+    "=": lambda result: result == 0,
+    "==": lambda result: result == 0,
+    "<>": lambda result: result != 0,
+    "!=": lambda result: result != 0,
+    "<": lambda result: result < 0,
+    "<=": lambda result: result <= 0,
+    ">": lambda result: result > 0,
+    ">=": lambda result: result >= 0,
+}
+
+
+def compile_template(template: FormulaTemplate,
+                     numeric: NumericMode = DECIMAL) -> Callable:
+    """
+    Returns the compiled form of the given formula template for the given
+    numeric mode, compiling each template only once for each mode.
+    """
+    compiled = template.compiled.get(numeric.name)
+    if compiled is None:
+        anchor = None if template.anchor is None else location_coords(template.anchor)
+        compiled = compile_tree(template.tree, anchor, numeric)
+        template.compiled[numeric.name] = compiled
+    return compiled
+
+
+def compile_tree(tree, anchor=None, numeric: NumericMode = DECIMAL) -> Callable:
+    """
+    Compiles a parse tree into a function of an Evaluator. If the column and
+    row numbers of an anchor are given, relative references are compiled as
+    offsets from the anchor, and resolved against the anchor of the Evaluator.
+    Numbers are represented as given by the numeric mode. Nodes the compiler
+    does not know are evaluated by visiting them with the Evaluator.
+    """
+    compiler = COMPILERS.get(tree.data) if isinstance(tree, Tree) else None
+    if compiler is None:
+        return lambda evaluator: evaluator.visit(tree)
+    return compiler(tree, anchor, numeric)
+
+
+def _compile_number(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a number node, whose value is computed once.
+    """
+    value = numeric.process_num(numeric.parse(tree.children[0]))
+    return lambda evaluator: value
+
+
+def _compile_string(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a string node, whose value is computed once.
+    """
+    value = Evaluator.string(None, tree)
+    return lambda evaluator: value
+
+
+def _compile_bool(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a boolean node.
+    """
+    value = tree.children[0].upper() == "TRUE"
+    return lambda evaluator: value
+
+
+def _compile_error(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a cell error node.
+    """
+    error_type = error_dict[tree.children[0].upper()]
+    return lambda evaluator: CellError(error_type, "Error from error() str")
+
+
+def _compile_parens(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a parentheses node.
+    """
+    inner = compile_tree(tree.children[0], anchor, numeric)
+    process_num = numeric.process_num
+    return lambda evaluator: process_num(inner(evaluator))
+
+
+def _compile_cell(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a cell reference. The name of the referenced cell is resolved
+    once, so reading it is a lookup in the cell table of its sheet. References
+    to the cell's own sheet use the sheet's current name.
+    """
+    ref = tree.children[-1].value.upper()
+    index = ref.replace("$", "")
+    if not check_valid_location(index):
+        return lambda evaluator: CellError(CellErrorType.BAD_REFERENCE,
+                                           f"Invalid cell location {index}")
+    abs_col, _, abs_row, _ = CELL_TOKEN.fullmatch(ref).groups()
+    if anchor is not None and not (abs_col and abs_row):
+        return _compile_relative_cell(tree, anchor, index, abs_col, abs_row)
+
+    if len(tree.children) == 2:
+        cell_name = (tree.children[0].value.strip('\'"').lower(), index)
+
+        def cell(evaluator):
+            evaluator.eval_dependencies.add(cell_name)
+            try:
+                return evaluator.workbook.cell_value_at(cell_name)
+            except KeyError:
+                return CellError(CellErrorType.BAD_REFERENCE, "No such sheet")
+        return cell
+
+    def local_cell(evaluator):
+        cell_name = (evaluator.sheet_key, index)
+        evaluator.eval_dependencies.add(cell_name)
+        try:
+            return evaluator.workbook.cell_value_at(cell_name)
+        except KeyError:
+            return CellError(CellErrorType.BAD_REFERENCE, "No such sheet")
+    return local_cell
+
+
+def _compile_relative_cell(tree, anchor, index, abs_col, abs_row) -> Callable:
+    """
+    Compiles a cell reference with a relative column or row, whose location is
+    found from the anchor of the Evaluator.
+    """
+    col_num, row_num = location_coords(index)
+    col_offset, row_offset = col_num - anchor[0], row_num - anchor[1]
+
+    def resolve(evaluator):
+        col, row = evaluator.anchor
+        return location_from_coords(col_num if abs_col else col + col_offset,
+                                    row_num if abs_row else row + row_offset)
+
+    if len(tree.children) == 2:
+        sheet_name = tree.children[0].value.strip('\'"').lower()
+
+        def cell(evaluator):
+            cell_name = (sheet_name, resolve(evaluator))
+            evaluator.eval_dependencies.add(cell_name)
+            try:
+                return evaluator.workbook.cell_value_at(cell_name)
+            except KeyError:
+                return CellError(CellErrorType.BAD_REFERENCE, "No such sheet")
+        return cell
+
+    def local_cell(evaluator):
+        cell_name = (evaluator.sheet_key, resolve(evaluator))
+        evaluator.eval_dependencies.add(cell_name)
+        try:
+            return evaluator.workbook.cell_value_at(cell_name)
+        except KeyError:
+            return CellError(CellErrorType.BAD_REFERENCE, "No such sheet")
+    return local_cell
+
+
+def _compile_range(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a range used as a value rather than passed to a function, whose
+    value is the array of the values of its cells. The range is recorded as a
+    single cell read, as a range passed to a function is.
+    """
+    cell_range = _compile_range_arg(tree, anchor)
+
+    def array(evaluator):
+        value = cell_range(evaluator)
+        if isinstance(value, CellError):
+            return value
+        return range_array(value)
+    return array
+
+
+def _compile_range_arg(tree, anchor) -> Callable:
+    """
+    Compiles a range passed to a function, whose value is the range itself.
+    The corners of the range are resolved as cell references are, and the
+    range is recorded as a single cell read, however many cells are in it.
+    """
+    corners = []
+    for token in tree.children[-2:]:
+        ref = token.value.upper()
+        index = ref.replace("$", "")
+        if not check_valid_location(index):
+            return lambda evaluator: CellError(CellErrorType.BAD_REFERENCE,
+                                               f"Invalid cell location {index}")
+        abs_col, _, abs_row, _ = CELL_TOKEN.fullmatch(ref).groups()
+        corners.append((index, abs_col, abs_row))
+    sheet_name = (tree.children[0].value.strip('\'"').lower()
+                  if len(tree.children) == 3 else None)
+
+    if anchor is None or all(abs_col and abs_row for _, abs_col, abs_row in corners):
+        location = range_name(corners[0][0], corners[1][0])
+        resolve = lambda evaluator: location
+    else:
+        offsets = []
+        for index, abs_col, abs_row in corners:
+            col_num, row_num = location_coords(index)
+            offsets.append((col_num, row_num, col_num - anchor[0],
+                            row_num - anchor[1], abs_col, abs_row))
+
+        def resolve(evaluator):
+            col, row = evaluator.anchor
+            start, end = (
+                location_from_coords(col_num if abs_col else col + col_offset,
+                                     row_num if abs_row else row + row_offset)
+                for col_num, row_num, col_offset, row_offset, abs_col, abs_row
+                in offsets)
+            return range_name(start, end)
+
+    def cell_range(evaluator):
+        try:
+            cell_name = (sheet_name or evaluator.sheet_key, resolve(evaluator))
+        except ValueError:
+            return CellError(CellErrorType.BAD_REFERENCE, "Invalid range")
+        evaluator.eval_dependencies.add(cell_name)
+        try:
+            return evaluator.workbook.range_value(cell_name)
+        except KeyError:
+            return CellError(CellErrorType.BAD_REFERENCE, "No such sheet")
+    return cell_range
+
+
+def _compile_add(tree, anchor, numeric) -> Callable:
+    """
+    Compiles an addition or subtraction.
+    """
+    left, operator, right = tree.children
+    left, right = (compile_tree(child, anchor, numeric) for child in (left, right))
+    if operator not in ("+", "-"):
+        raise ValueError("Invalid operator")
+    subtract = operator == "-"
+    operation = np.subtract if subtract else np.add
+    number_type, to_number = numeric.number_type, numeric.check_numeric
+    process_num = numeric.process_num
+
+    def add(evaluator):
+        val1 = left(evaluator)
+        val2 = right(evaluator)
+        if type(val1) is not number_type: # pylint: disable=unidiomatic-typecheck
+            if isinstance(val1, ArrayValue):
+                return array_arithmetic(numeric, operation, val1, val2)
+            val1 = to_number(val1)
+        if type(val2) is not number_type: # pylint: disable=unidiomatic-typecheck
+            if isinstance(val2, ArrayValue):
+                return array_arithmetic(numeric, operation, val1, val2)
+            val2 = to_number(val2)
+        if isinstance(val1, CellError) or isinstance(val2, CellError):
+            return values_error_helper((val1, val2))
+        return process_num(val1 - val2 if subtract else val1 + val2)
+    return add
+
+
+def _compile_mul(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a multiplication or division.
+    """
+    left, operator, right = tree.children
+    left, right = (compile_tree(child, anchor, numeric) for child in (left, right))
+    if operator not in ("*", "/"):
+        raise ValueError("Invalid operator")
+    is_divide = operator == "/"
+    operation = divide if is_divide else np.multiply
+    number_type, to_number = numeric.number_type, numeric.check_numeric
+    process_num = numeric.process_num
+
+    def mul(evaluator):
+        val1 = left(evaluator)
+        val2 = right(evaluator)
+        if type(val1) is not number_type: # pylint: disable=unidiomatic-typecheck
+            if isinstance(val1, ArrayValue):
+                return array_arithmetic(numeric, operation, val1, val2)
+            val1 = to_number(val1)
+        if type(val2) is not number_type: # pylint: disable=unidiomatic-typecheck
+            if isinstance(val2, ArrayValue):
+                return array_arithmetic(numeric, operation, val1, val2)
+            val2 = to_number(val2)
+        if isinstance(val1, CellError) or isinstance(val2, CellError):
+            return values_error_helper((val1, val2))
+        if is_divide:
+            if val2 == 0:
+                return CellError(CellErrorType.DIVIDE_BY_ZERO, "Divided by zero")
+            return process_num(val1 / val2)
+        return process_num(val1 * val2)
+    return mul
+
+
+def _compile_concat(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a string concatenation.
+    """
+    left, right = (compile_tree(child, anchor, numeric) for child in tree.children)
+
+    def concat(evaluator):
+        val1 = left(evaluator)
+        val2 = right(evaluator)
+        if isinstance(val1, ArrayValue) or isinstance(val2, ArrayValue):
+            return array_apply(_concat_elements, val1, val2)
+        return concat_values(val1, val2)
+    return concat
+
+
+def _compile_unary(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a unary plus or minus.
+    """
+    operator, operand = tree.children
+    operand = compile_tree(operand, anchor, numeric)
+    if operator not in ("+", "-"):
+        raise ValueError("Invalid operator")
+    negate = operator == "-"
+    to_number, process_num = numeric.check_numeric, numeric.process_num
+
+    def unary(evaluator):
+        value = operand(evaluator)
+        if isinstance(value, ArrayValue):
+            return array_negate(numeric, value, negate)
+        value = to_number(value)
+        if isinstance(value, CellError):
+            return value
+        return process_num(-value if negate else value)
+    return unary
+
+
+def _compile_comp(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a comparison.
+    """
+    left, operator, right = tree.children
+    left, right = (compile_tree(child, anchor, numeric) for child in (left, right))
+    test = COMPARISONS[operator]
+    vector_test = VECTOR_COMPARISONS[operator]
+    compare = np.frompyfunc(lambda val1, val2: compare_values(val1, val2, test),
+                            2, 1)
+
+    def comp(evaluator):
+        val1 = left(evaluator)
+        val2 = right(evaluator)
+        if isinstance(val1, ArrayValue) or isinstance(val2, ArrayValue):
+            return array_compare(numeric, vector_test, compare, val1, val2)
+        return compare_values(val1, val2, test)
+    return comp
+
+
+def concat_values(val1, val2):
+    """
+    Returns the concatenation of two values, or the error of either.
+    """
+    if isinstance(val1, CellError) or isinstance(val2, CellError):
+        return values_error_helper((val1, val2))
+    return check_str(val1) + check_str(val2)
+
+
+def compare_values(val1, val2, test):
+    """
+    Compares two values, passing the result of comp_helper to the test for the
+    comparison operator, or returns the error of either value.
+    """
+    if isinstance(val1, CellError) or isinstance(val2, CellError):
+        return values_error_helper((val1, val2))
+    if val1 is None:
+        if val2 is not None:
+            val1 = NONE_TYPES[type(val2)]
+        else:
+            val1 = val2 = 0
+    elif val2 is None:
+        val2 = NONE_TYPES[type(val1)]
+    if isinstance(val1, str):
+        val1 = val1.lower()
+    if isinstance(val2, str):
+        val2 = val2.lower()
+    return test(comp_helper(val1, val2))
+
+
+# Elementwise concatenation, for operands which are arrays
+_concat_elements = np.frompyfunc(concat_values, 2, 1)
+
+
+def _compile_function(tree, anchor, numeric) -> Callable:
+    """
+    Compiles a function call. The conditional functions only evaluate the
+    arguments they use, and other functions are called through the function
+    directory of the workbook, which only evaluates the arguments of lazy
+    functions as they are read. Ranges are only passed to functions which
+    take them, and arrays are not passed to functions at all.
+    """
+    func_name = tree.children[0].upper()
+    arg_list = tree.children[1]
+    if arg_list is not None and not (isinstance(arg_list, Tree) and
+                                     arg_list.data == "arg_list"):
+        return lambda evaluator: evaluator.visit(tree)
+    children = [] if arg_list is None else arg_list.children
+    # The conditional functions return their arguments, so cannot take ranges
+    ranges = [isinstance(child, Tree) and child.data == "cell_range" and
+              func_name not in CONDITIONALS for child in children]
+    args = [None if child is None else
+            _compile_range_arg(child, anchor) if is_range else
+            compile_tree(child, anchor, numeric)
+            for child, is_range in zip(children, ranges)]
+    has_ranges = any(ranges)
+    # Only arguments using a range may evaluate to arrays
+    may_be_arrays = any(isinstance(child, Tree) and not is_range and
+                        any(subtree.data == "cell_range"
+                            for subtree in child.iter_subtrees())
+                        for child, is_range in zip(children, ranges))
+
+    if func_name in ("IF", "IFERROR", "CHOOSE"):
+        if len(args) == 0:
+            return lambda evaluator: CellError(CellErrorType.TYPE_ERROR,
+                                               "Invalid number of arguments.")
+        return CONDITIONALS[func_name](args)
+
+    lazy_args = [arg for arg in args if arg is not None]
+
+    def function(evaluator):
+        workbook = evaluator.workbook
+        if has_ranges and workbook.func_dir.rejects_ranges(func_name):
+            return CellError(CellErrorType.TYPE_ERROR,
+                             f"Function {func_name} does not take ranges.")
+        if workbook.func_dir.is_lazy(func_name):
+            thunks = [partial(arg, evaluator) for arg in lazy_args]
+            return workbook.func_dir.evaluate(func_name, thunks, workbook,
+                                              evaluator.sheet, evaluator.from_cell,
+                                              evaluator)
+        values = [None if arg is None else arg(evaluator) for arg in args]
+        if values and values[-1] is None:
+            values = values[:-1]
+        if may_be_arrays and any(isinstance(value, ArrayValue) for value in values):
+            return CellError(CellErrorType.TYPE_ERROR,
+                             f"Function {func_name} does not take arrays.")
+        # Propagate errors if necessary
+        if func_name not in ("INDIRECT", "ISERROR"):
+            error = values_error_helper(values)
+            if error is not None:
+                return error
+        return workbook.func_dir.evaluate(func_name, values, workbook,
+                                          evaluator.sheet, evaluator.from_cell,
+                                          evaluator)
+    return function
+
+
+def _compile_if(args) -> Callable:
+    """
+    Compiles an IF call from its compiled arguments.
+    """
+    def if_function(evaluator):
+        condition = args[0](evaluator)
+        if args[-1] is None or len(args) > 3:
+            return CellError(CellErrorType.TYPE_ERROR, "IF: Invalid number of arguments.")
+        if isinstance(condition, ArrayValue):
+            return CellError(CellErrorType.TYPE_ERROR, "IF: Condition is an array.")
+        condition = check_bool(condition)
+        if isinstance(condition, CellError):
+            return condition
+        if condition:
+            return args[1](evaluator)
+        if len(args) == 3:
+            return args[2](evaluator)
+        return False
+    return if_function
+
+
+def _compile_iferror(args) -> Callable:
+    """
+    Compiles an IFERROR call from its compiled arguments.
+    """
+    def iferror(evaluator):
+        value = args[0](evaluator)
+        if len(args) > 2:
+            return CellError(CellErrorType.TYPE_ERROR,
+                             "IFERROR: Invalid number of arguments.")
+        if not isinstance(value, CellError):
+            return value
+        if len(args) == 2:
+            if args[-1] is not None:
+                return args[1](evaluator)
+            return ""
+        return None
+    return iferror
+
+
+def _compile_choose(args) -> Callable:
+    """
+    Compiles a CHOOSE call from its compiled arguments.
+    """
+    def choose(evaluator):
+        index = check_numeric(args[0](evaluator))
+        if isinstance(index, CellError):
+            return index
+        int_index = int(index)
+        if int_index != index:
+            return CellError(CellErrorType.TYPE_ERROR, "CHOOSE: Index is not an integer.")
+        if int_index < 1 or int_index > len(args) - 1:
+            return CellError(CellErrorType.TYPE_ERROR, "CHOOSE: Index out of range.")
+        if args[int_index] is None:
+            return CellError(CellErrorType.TYPE_ERROR,
+                             "CHOOSE: Invalid number of arguments.")
+        return args[int_index](evaluator)
+    return choose
+
+
+# Compilers for each kind of node in the parse tree
+COMPILERS = {
+    "number": _compile_number,
+    "string": _compile_string,
+    "bool": _compile_bool,
+    "error": _compile_error,
+    "parens": _compile_parens,
+    "cell": _compile_cell,
+    "cell_range": _compile_range,
+    "add_expr": _compile_add,
+    "mul_expr": _compile_mul,
+    "concat_expr": _compile_concat,
+    "unary_op": _compile_unary,
+    "comp_expr": _compile_comp,
+    "function": _compile_function,
+}
+
+# Compilers for the functions which only evaluate some of their arguments
+CONDITIONALS = {
+    "IF": _compile_if,
+    "IFERROR": _compile_iferror,
+    "CHOOSE": _compile_choose,
+}
@@ -9,20 +9,22 @@ references in a given formula. This is used by the workbook to populate its cell
 dependency graph.
 """
 
-from functools import lru_cache
 from decimal import Decimal, InvalidOperation
 
+from lark import Tree
 from lark.visitors import Interpreter, visit_children_decor
 
 
 from .error_types import CellError, CellErrorType, error_dict
-from .spreadsheet import check_valid_location
+from .ranges import range_name
+from .spreadsheet import check_valid_location, location_coords
 
 
 # Default empty cell types for each datatype
 NONE_TYPES = {
     str: "",
     Decimal: Decimal(0),
+    float: 0.0,
     bool: False
 }
 
@@ -31,6 +33,7 @@ NONE_TYPES = {
 # comparison operations between two values of potentially different types.
 TYPE_VALUES = {
     Decimal: 0,
+    float: 0,
     str: 1,
     bool: 2
 }
@@ -48,6 +51,10 @@ class Evaluator(Interpreter):
     Attributes:
         workbook (Workbook): The workbook that the cell belongs to.
         sheet (Spreadsheet): The sheet that the cell belongs to.
+        sheet_key (str): The lowercase name of the sheet.
+        numeric (NumericMode): How numbers are represented in the workbook.
+        anchor (tuple): The column and row numbers of the evaluated cell, which
+            compiled formula templates resolve relative references against.
     """
 
     def __init__(self, workbook, sheet, cell=None):
@@ -58,19 +65,38 @@ class Evaluator(Interpreter):
         """
         self.workbook = workbook
         self.sheet = sheet
+        self.sheet_key = None if sheet is None else sheet.display_name.lower()
         self.from_cell = cell
-        # list of dependencies acquired from evaluation
+        self.numeric = getattr(workbook, "numeric", DECIMAL)
+        self.anchor = None
+        if cell is not None and cell.location is not None:
+            self.anchor = location_coords(cell.location)
+        # set of cells read during the current evaluation
         self.eval_dependencies = set()
 
     def get_eval_dependencies(self):
         """
-        Returns the list of dependencies acquired from evaluation.
+        Returns the set of cells read during evaluation.
         """
         return self.eval_dependencies
+
     def reset_eval_dependencies(self):
         """
-        Resets the list of dependencies acquired from evaluation.
+        Resets the set of cells read during evaluation.
+        """
+        self.eval_dependencies = set()
+
+    def bind(self, cell) -> None:
+        """
+        Rebinds the evaluator to the given cell of its workbook, so that one
+        evaluator can be reused for every cell, and resets the set of cells
+        read during evaluation.
         """
+        self.sheet = cell.sheet
+        self.sheet_key = cell.sheet.display_name.lower()
+        self.from_cell = cell
+        self.anchor = (None if cell.location is None
+                       else location_coords(cell.location))
         self.eval_dependencies = set()
 
     @staticmethod
@@ -135,6 +161,8 @@ class Evaluator(Interpreter):
             return ""
         if isinstance(value, bool):
             return str(value).upper()
+        if isinstance(value, float):
+            return float_str(value)
         return str(value)
 
     @staticmethod
@@ -150,27 +178,24 @@ class Evaluator(Interpreter):
             if value.upper() in ["TRUE", "FALSE"]:
                 return value.upper() == "TRUE"
             return CellError(CellErrorType.TYPE_ERROR, "Not boolean")
-        if isinstance(value, Decimal):
+        if isinstance(value, (Decimal, float)):
             return value != 0
         if isinstance(value, CellError):
             return value
         return False
 
-    @lru_cache(maxsize=200)
     def number(self, tree):
         """
         Return the value of a number node.
         """
-        # For a number node we should be able to parse as a decimal
+        # For a number node we should be able to parse as a number
         try:
-            value =  Decimal(tree.children[0])
-            return Evaluator.process_num(value)
+            return self.numeric.process_num(self.numeric.parse(tree.children[0]))
 
         # If unable to parse, return a CellError
-        except InvalidOperation:
+        except (InvalidOperation, ValueError):
             return CellError(CellErrorType.TYPE_ERROR, "Not numeric")
 
-    @lru_cache(maxsize=200)
     def string(self, tree):
         """
         Return the value of a string node.
@@ -186,7 +211,7 @@ class Evaluator(Interpreter):
         """
         Return the value of a parentheses node.
         """
-        return Evaluator.process_num(values[0])
+        return self.numeric.process_num(values[0])
 
     @visit_children_decor
     def cell(self, values):
@@ -206,17 +231,9 @@ class Evaluator(Interpreter):
             if not check_valid_location(index):
                 return CellError(CellErrorType.BAD_REFERENCE, f"Invalid cell location {index}")
 
-            # adding evaluation time dependencies if they are not already in the graph
-            if self.from_cell: # evaluator must have a cell for this to work
-                from_sheet_name = self.sheet.display_name.lower()
-                from_index = self.from_cell.location
-                if ((sheet_name.lower(), index) not in
-                    self.workbook.interaction_graph.graph[(from_sheet_name, from_index)]):
-
-                    self.eval_dependencies.add(((from_sheet_name, from_index),
-                                                (sheet_name.lower(), index)))
-                    self.workbook.interaction_graph.add_dependency((from_sheet_name, from_index),
-                                                                    (sheet_name.lower(), index))
+            # record the cell as read, so the workbook can keep the dynamic
+            # dependencies of the evaluated cell up to date
+            self.eval_dependencies.add((sheet_name.lower(), index))
 
             ref_val = self.workbook.get_cell_value(sheet_name, index)
 
@@ -225,20 +242,57 @@ class Evaluator(Interpreter):
 
         return ref_val
 
+    def cell_range(self, tree):
+        """
+        Return the value of a range used as a value rather than passed to a
+        function, which is a type error here. Compiled formulas evaluate it to
+        an array instead.
+        """
+        return CellError(CellErrorType.TYPE_ERROR, "Range used as a value")
+
+    def range_arg(self, tree):
+        """
+        Return the value of a range passed to a function, which is the range
+        itself. The range is recorded as a single cell read.
+        """
+        if len(tree.children) == 3:
+            sheet_name = tree.children[0].value.strip('\'"').lower()
+        else:
+            sheet_name = self.sheet.display_name.lower()
+        try:
+            cell_name = (sheet_name, range_name(tree.children[-2].value,
+                                                tree.children[-1].value))
+        except ValueError:
+            return CellError(CellErrorType.BAD_REFERENCE, "Invalid range")
+        self.eval_dependencies.add(cell_name)
+        try:
+            return self.workbook.range_value(cell_name)
+        except KeyError:
+            return CellError(CellErrorType.BAD_REFERENCE, "No such sheet")
+
+    def argument(self, tree):
+        """
+        Return the value of an argument of a function, where ranges are
+        values.
+        """
+        if isinstance(tree, Tree) and tree.data == "cell_range":
+            return self.range_arg(tree)
+        return self.visit(tree)
+
     @visit_children_decor
     def add_expr(self, values):
         """
         Return the value of an addition expression node.
         """
-        values[0], values[2] = (Evaluator.check_numeric(values[0]),
-                                Evaluator.check_numeric(values[2]))
+        values[0], values[2] = (self.numeric.check_numeric(values[0]),
+                                self.numeric.check_numeric(values[2]))
         e = Evaluator.values_error_helper(values)
         if e:
             return e
         if values[1] == '+':
-            return Evaluator.process_num(values[0] + values[2])
+            return self.numeric.process_num(values[0] + values[2])
         if values[1] == '-':
-            return Evaluator.process_num(values[0] - values[2])
+            return self.numeric.process_num(values[0] - values[2])
         raise ValueError("Invalid operator")
 
     @visit_children_decor
@@ -246,17 +300,17 @@ class Evaluator(Interpreter):
         """
         Return the value of a multiplication expression node.
         """
-        values[0], values[2] = (Evaluator.check_numeric(values[0]),
-                                Evaluator.check_numeric(values[2]))
+        values[0], values[2] = (self.numeric.check_numeric(values[0]),
+                                self.numeric.check_numeric(values[2]))
         e = Evaluator.values_error_helper(values)
         if e:
             return e
         if values[1] == '*':
-            return Evaluator.process_num(values[0] * values[2])
+            return self.numeric.process_num(values[0] * values[2])
         if values[1] == '/':
             if values[2] == 0:
                 return CellError(CellErrorType.DIVIDE_BY_ZERO, "Divided by zero")
-            return Evaluator.process_num(values[0] / values[2])
+            return self.numeric.process_num(values[0] / values[2])
         raise ValueError("Invalid operator")
 
     @visit_children_decor
@@ -277,14 +331,14 @@ class Evaluator(Interpreter):
         """
         Return the value of a unary operation node.
         """
-        values[1] = Evaluator.check_numeric(values[1])
+        values[1] = self.numeric.check_numeric(values[1])
         e = Evaluator.values_error_helper(values)
         if e:
             return e
         if values[0] == '+':
-            return Evaluator.process_num(values[1])
+            return self.numeric.process_num(values[1])
         if values[0] == '-':
-            return Evaluator.process_num(-values[1])
+            return self.numeric.process_num(-values[1])
         raise ValueError("Invalid operator")
 
     @staticmethod
@@ -399,13 +453,21 @@ class Evaluator(Interpreter):
                                      "CHOOSE: Invalid number of arguments.")
                 return self.visit(subtrees[int_index])
         else:
-            values = self.visit_children(tree)
-            args = values[1]
-            if values[1] is not None:
-                if values[1][-1] is None:
-                    args = values[1][:-1]
-            else:
-                args = []
+            subtrees = [] if tree.children[1] is None else tree.children[1].children
+            if (self.workbook.func_dir.rejects_ranges(func_name) and
+                    any(isinstance(subtree, Tree) and subtree.data == "cell_range"
+                        for subtree in subtrees)):
+                return CellError(CellErrorType.TYPE_ERROR,
+                                 f"Function {func_name} does not take ranges.")
+            if self.workbook.func_dir.is_lazy(func_name):
+                thunks = [lambda subtree=subtree: self.argument(subtree)
+                          for subtree in subtrees if subtree is not None]
+                return self.workbook.func_dir.evaluate(func_name, thunks, self.workbook,
+                                                       self.sheet, self.from_cell, self)
+            args = [None if subtree is None else self.argument(subtree)
+                    for subtree in subtrees]
+            if args and args[-1] is None:
+                args = args[:-1]
             # Propagate errors if necessary
             if func_name not in ["INDIRECT", "ISERROR"]:
                 e_vals = Evaluator.values_error_helper(args)
@@ -417,11 +479,73 @@ class Evaluator(Interpreter):
                                                self.sheet, self.from_cell, self)
 
 
-@lru_cache(maxsize=None)
-def cached_evaluators(wb, sheet, cell) -> Evaluator:
+def float_str(value: float) -> str:
     """
-    Cache enabled factory function for creating evaluators. Returning the same 
-    evaluator for the same workbook and sheet should then allow caching of 
-    results of the evaluation of formulas.
+    Returns the string form of a float, without a trailing ".0" for integers.
     """
-    return Evaluator(wb, sheet, cell)
+    text = repr(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+class NumericMode():
+    """
+    The representation of numbers in a workbook. By default numbers are exact
+    Decimals, normalized after every operation, while in float mode they are
+    binary floats, which are much cheaper to create and operate on.
+
+    Attributes:
+        name (str): The name of the mode.
+        number_type (type): The type of the numbers.
+        parse (Callable): Converts a string to a number, raising a ValueError
+            or InvalidOperation if it is not a number.
+        check_numeric (Callable): Converts a value to a number, as
+            Evaluator.check_numeric does, returning a CellError if it is not
+            numeric.
+        process_num (Callable): Normalizes the result of an operation.
+        zero: The number zero, which is the value of empty cells.
+    """
+
+    def __init__(self, name, number_type, parse, check_numeric, process_num):
+        self.name = name
+        self.number_type = number_type
+        self.parse = parse
+        self.check_numeric = check_numeric
+        self.process_num = process_num
+        self.zero = number_type(0)
+
+
+def _check_float(value):
+    """
+    Converts a value to a float, returning a CellError if it is not numeric.
+    """
+    try:
+        if value is None:
+            return 0.0
+        if isinstance(value, str) and value.startswith("'"):
+            return float(value[1:].strip())
+        if isinstance(value, bool):
+            return 1.0 if value else 0.0
+        return float(value)
+    except (ValueError, TypeError):
+        if isinstance(value, CellError):
+            return value
+        return CellError(CellErrorType.TYPE_ERROR, "Not numeric")
+
+
+def _process_float(value):
+    """
+    Normalizes a float result, turning negative zero into zero.
+    """
+    # pylint: disable-next=unidiomatic-typecheck
+    return value + 0.0 if type(value) is float else value
+
+
+DECIMAL = NumericMode("decimal", Decimal, Decimal, Evaluator.check_numeric,
+                      Evaluator.process_num)
+FLOAT = NumericMode("float", float, float, _check_float, _process_float)
+
+# Numeric modes by name
+NUMERIC_MODES = {
+    "decimal": DECIMAL,
+    "float": FLOAT,
+}
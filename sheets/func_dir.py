@@ -11,20 +11,39 @@ from typing import Optional, Callable, Tuple
 from decimal import Decimal
 from functools import reduce
 from copy import deepcopy
+from collections import OrderedDict, namedtuple
+import math
+import re
 
 import sheets
 from .error_types import CellError, CellErrorType
 from .regexp import is_ref, find_refs
-from .evaluator import Evaluator
+from .evaluator import Evaluator, FLOAT
+from .ranges import RangeValue
+from .aggregates import Summary
+from .lookups import ValueIndex, parse_criterion
 
 # A map from the required types of arguments to the function which converts
 # an argument to that type.
 type_conv_map = {
     str : Evaluator.check_str,
     Decimal : Evaluator.check_numeric,
+    float : FLOAT.check_numeric,
     bool : Evaluator.check_bool,
 }
 
+# Number of results kept for each pure function registered with a workbook
+MEMO_SIZE = 1024
+
+# The names functions can be called by in formulas
+FUNCTION_NAME = re.compile(r"[A-Za-z][A-Za-z0-9_]*")
+
+FunctionCacheInfo = namedtuple("FunctionCacheInfo",
+                               ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+# Marks a result which is not in a memo
+_MISSING = object()
+
 class FuncInfo():
     """
     A class representing the information about a function. This includes the
@@ -35,9 +54,16 @@ class FuncInfo():
     def __init__(self, arg_limit: Optional[int], min_args: int,
                  req_arg_types: Optional[dict[int, type]],
                  rpt_type: Optional[type], evaler: Callable,
-                 contextual: bool = False):
+                 contextual: bool = False, lazy: bool = False,
+                 ranges: bool = False, memo_size: Optional[int] = None):
         """
-        Initializes a new FuncInfo object with the given properties.
+        Initializes a new FuncInfo object with the given properties. A lazy
+        function is passed LazyArgs instead of a list of values, so it only
+        evaluates the arguments it reads. A function taking ranges is passed
+        a RangeValue for each range argument, which is never converted, and
+        other functions given a range are a type error. If a memo size is
+        given, the function is pure, and up to that many of its results are
+        kept by their converted arguments.
         """
         self.arg_limit = arg_limit
         self.min_args = min_args
@@ -45,6 +71,16 @@ class FuncInfo():
         self.rpt_type = rpt_type
         self.evaler = evaler
         self.contextual = contextual
+        self.lazy = lazy
+        self.ranges = ranges
+        self.memo = None if memo_size is None else ResultMemo(memo_size)
+        # The type each argument must have and the function converting it to
+        # that type, for the arguments with required types by index and for
+        # the repeated arguments, so calls only look the conversions up
+        self._conversions = {index: (arg_type, type_conv_map[arg_type])
+                             for index, arg_type in (req_arg_types or {}).items()}
+        self._rpt_conversion = (None if rpt_type is None
+                                else (rpt_type, type_conv_map[rpt_type]))
 
     def get_requirements(self) -> tuple:
         """
@@ -52,34 +88,519 @@ class FuncInfo():
         """
         return (self.arg_limit, self.min_args, self.req_arg_types, self.rpt_type)
 
+    def check_arg_count(self, num_args: int) -> bool:
+        """
+        Returns whether the function accepts the given number of arguments.
+        """
+        if self.arg_limit is not None and num_args > self.arg_limit:
+            return False
+        return num_args >= self.min_args
+
+    def convert_arg(self, index: int, value):
+        """
+        Returns the argument at the given index converted to the type the
+        function requires, or a CellError if it cannot be converted.
+        """
+        conversion = self._conversions.get(index, self._rpt_conversion)
+        if conversion is None or isinstance(value, conversion[0]):
+            return value
+        return conversion[1](value)
+
     def check_args(self, args : list) -> Tuple[bool, list]:
         """
         Takes in a list of arguments and checks if the arguments are valid
-        based on the requirements of the function.
+        based on the requirements of the function. The arguments are only
+        copied if one of them has to be converted.
         """
-        if self.arg_limit is not None and len(args) > self.arg_limit:
+        if not self.check_arg_count(len(args)):
             return (False, [])
-        if len(args) < self.min_args:
-            return (False, [])
-        new_args = deepcopy(args)
-        if self.req_arg_types is not None:
-            for arg in self.req_arg_types:
-                if not isinstance(args[arg], self.req_arg_types[arg]):
-                    new_arg = type_conv_map[self.req_arg_types[arg]](args[arg])
-                    if isinstance(new_arg, CellError):
-                        return (False, [])
-                    new_args[arg] = new_arg
-        if self.rpt_type is not None:
-            for i, arg in enumerate(args):
-                if self.req_arg_types is not None and i in self.req_arg_types:
-                    continue
-                if not isinstance(arg, self.rpt_type):
-                    new_arg = type_conv_map[self.rpt_type](arg)
-                    if isinstance(new_arg, CellError):
-                        return (False, [])
-                    new_args[i] = new_arg
+        if not self._conversions and self._rpt_conversion is None:
+            return (True, args)
+        new_args = args
+        for index, arg in enumerate(args):
+            conversion = self._conversions.get(index, self._rpt_conversion)
+            if (conversion is None or isinstance(arg, conversion[0]) or
+                    isinstance(arg, RangeValue)):
+                continue
+            new_arg = conversion[1](arg)
+            if isinstance(new_arg, CellError):
+                return (False, [])
+            if new_args is args:
+                new_args = list(args)
+            new_args[index] = new_arg
         return (True, new_args)
 
+    @staticmethod
+    def memo_key(args: list) -> Optional[tuple]:
+        """
+        Returns the key the results of a pure function for the given converted
+        arguments are kept by, or None if they are not kept, which is the case
+        for errors and unhashable arguments. Arguments of different types are
+        never the same, even if they compare equal.
+        """
+        key = []
+        for arg in args:
+            if isinstance(arg, CellError) or arg.__hash__ is None:
+                return None
+            key.append((type(arg), arg))
+        return tuple(key)
+
+
+class ResultMemo():
+    """
+    A least recently used cache of the results of a pure function by the key
+    of their arguments.
+
+    Attributes:
+        maxsize (int): The number of results kept.
+        hits (int): The number of lookups which found their result.
+        misses (int): The number of lookups which did not.
+        evictions (int): The number of results evicted to make room.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+
+    def get(self, key: tuple):
+        """
+        Returns the result kept under the given key, marking it as the most
+        recently used, or _MISSING if it is not kept.
+        """
+        result = self._results.get(key, _MISSING)
+        if result is _MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._results.move_to_end(key)
+        return result
+
+    def put(self, key: tuple, result) -> None:
+        """
+        Keeps the given result under the given key, evicting the least
+        recently used results if the memo is full.
+        """
+        self._results[key] = result
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+    def info(self) -> FunctionCacheInfo:
+        """
+        Returns the counters and size of the memo.
+        """
+        return FunctionCacheInfo(self.hits, self.misses, self.evictions,
+                                 self.maxsize, len(self._results))
+
+
+class LazyArgs():
+    """
+    The arguments of a call to a lazy function. Each argument is evaluated and
+    converted to the type the function requires the first time it is read, so
+    the cells read by arguments the function never reads are not dependencies
+    of the call. Reading an argument which evaluates to an error, or which
+    cannot be converted, gives a CellError.
+    """
+
+    def __init__(self, func_name: str, func: FuncInfo, thunks: list):
+        """
+        Initializes the arguments from a function which evaluates each one.
+        """
+        self.func_name = func_name
+        self.func = func
+        self.thunks = thunks
+        self.values = {}
+
+    def __len__(self) -> int:
+        return len(self.thunks)
+
+    def __getitem__(self, index: int):
+        if index not in self.values:
+            value = self.thunks[index]()
+            if not isinstance(value, CellError):
+                value = self.func.convert_arg(index, value)
+                if isinstance(value, CellError):
+                    value = CellError(CellErrorType.TYPE_ERROR,
+                                      f"Invalid arguments for function {self.func_name}.")
+            self.values[index] = value
+        return self.values[index]
+
+    def __iter__(self):
+        for index in range(len(self.thunks)):
+            yield self[index]
+
+
+def and_function(args: LazyArgs):
+    """
+    The function implementation for the default AND function, which stops at
+    the first argument that is false or an error.
+    """
+    for value in args:
+        if isinstance(value, CellError) or not value:
+            return value
+    return True
+
+
+def or_function(args: LazyArgs):
+    """
+    The function implementation for the default OR function, which stops at
+    the first argument that is true or an error.
+    """
+    for value in args:
+        if isinstance(value, CellError) or value:
+            return value
+    return False
+
+
+def summarize(args, wb):
+    """
+    Summarizes the numbers among the arguments of an aggregate function.
+    Arguments given directly are converted to numbers, while only the numbers
+    in a range are included, skipping its empty cells, strings and booleans.
+    Ranges are summarized by their running aggregates, so they are not read
+    again unless they have changed. Returns the Summary, or the error to
+    report, which is the first error among the arguments given directly, or
+    failing that the first error in a range, preferring circular references.
+    """
+    numeric = wb.numeric
+    summary = Summary(numeric.number_type)
+    error = None
+    for arg in args:
+        if isinstance(arg, RangeValue):
+            aggregate = arg.aggregate()
+            range_error = aggregate.error()
+            if range_error is not None:
+                if range_error.get_type() == CellErrorType.CIRCULAR_REFERENCE:
+                    return range_error
+                error = error or range_error
+            summary.merge(aggregate)
+            continue
+        value = numeric.check_numeric(arg)
+        if isinstance(value, CellError):
+            return value
+        summary.add(value)
+    return error or summary
+
+
+def sum_function(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default SUM function.
+    """
+    summary = summarize(args, wb)
+    if isinstance(summary, CellError):
+        return summary
+    return wb.numeric.process_num(summary.total())
+
+
+def count_function(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default COUNT function, which counts
+    the numbers in its ranges and the arguments given directly which can be
+    converted to numbers. Empty cells and errors are never counted.
+    """
+    count = 0
+    for arg in args:
+        if isinstance(arg, RangeValue):
+            count += arg.aggregate().count
+        elif (arg is not None and
+              not isinstance(wb.numeric.check_numeric(arg), CellError)):
+            count += 1
+    return wb.numeric.number_type(count)
+
+
+def average_function(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default AVERAGE function.
+    """
+    summary = summarize(args, wb)
+    if isinstance(summary, CellError):
+        return summary
+    if summary.count == 0:
+        return CellError(CellErrorType.DIVIDE_BY_ZERO,
+                         "AVERAGE: No numbers to average.")
+    return wb.numeric.process_num(summary.total() / summary.count)
+
+
+def min_function(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default MIN function, which is zero
+    if there are no numbers.
+    """
+    summary = summarize(args, wb)
+    if isinstance(summary, CellError):
+        return summary
+    smallest = summary.smallest()
+    return wb.numeric.process_num(wb.numeric.zero if smallest is None
+                                  else smallest)
+
+
+def max_function(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default MAX function, which is zero
+    if there are no numbers.
+    """
+    summary = summarize(args, wb)
+    if isinstance(summary, CellError):
+        return summary
+    largest = summary.largest()
+    return wb.numeric.process_num(wb.numeric.zero if largest is None
+                                  else largest)
+
+
+def _check_ranges(func_name: str, args, range_indexes) -> Optional[CellError]:
+    """
+    Returns a type error if the arguments at the given indexes are not ranges,
+    or any other argument is a range, otherwise None.
+    """
+    for index, arg in enumerate(args):
+        if isinstance(arg, RangeValue) != (index in range_indexes):
+            return CellError(CellErrorType.TYPE_ERROR,
+                             f"{func_name}: Argument {index + 1} must "
+                             f"{'' if index in range_indexes else 'not '}be a range.")
+    return None
+
+
+def _is_line(range_value: RangeValue) -> bool:
+    """
+    Returns whether a range is a single row or column.
+    """
+    left, top, right, bottom = range_value.bounds
+    return left == right or top == bottom
+
+
+def _line_length(range_value: RangeValue) -> int:
+    """
+    Returns the number of cells in a range which is a single row or column.
+    """
+    left, top, right, bottom = range_value.bounds
+    return max(right - left, bottom - top) + 1
+
+
+def _table_lookup(func_name: str, args, vertical: bool):
+    """
+    Looks a value up in the first column of a table, or its first row if not
+    vertical, returning the value in the same row or column of the table at
+    the given index. The nearest match is found unless the fourth argument is
+    FALSE, as for VLOOKUP and HLOOKUP.
+    """
+    error = _check_ranges(func_name, args, {1})
+    if error is not None:
+        return error
+    if isinstance(args[0], CellError):
+        return args[0]
+    table, index = args[1], args[2]
+    approximate = args[3] if len(args) > 3 else True
+    left, top, right, bottom = table.bounds
+    size = right - left + 1 if vertical else bottom - top + 1
+    if int(index) != index or not 1 <= index <= size:
+        return CellError(CellErrorType.TYPE_ERROR,
+                         f"{func_name}: Index out of range.")
+    line = table.column(0) if vertical else table.row(0)
+    position = line.lookup_index().find(args[0], -1 if approximate else 0,
+                                        approximate)
+    if position is None:
+        return CellError(CellErrorType.TYPE_ERROR, f"{func_name}: No match.")
+    if vertical:
+        return table.value_at(int(index) - 1, position)
+    return table.value_at(position, int(index) - 1)
+
+
+def vlookup(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default VLOOKUP function.
+    """
+    return _table_lookup("VLOOKUP", args, True)
+
+
+def hlookup(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default HLOOKUP function.
+    """
+    return _table_lookup("HLOOKUP", args, False)
+
+
+def match(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default MATCH function, which returns
+    the position of a value in a row or column counting from one. By default
+    the last position holding the largest value no larger is found, while a
+    match type of zero finds the first position holding an equal value, and a
+    negative match type the last position holding the smallest value no
+    smaller.
+    """
+    error = _check_ranges("MATCH", args, {1})
+    if error is not None:
+        return error
+    if isinstance(args[0], CellError):
+        return args[0]
+    if not _is_line(args[1]):
+        return CellError(CellErrorType.TYPE_ERROR,
+                         "MATCH: Range is not a row or column.")
+    match_type = args[2] if len(args) > 2 else 1
+    # A positive match type searches down for values no larger
+    direction = (match_type < 0) - (match_type > 0)
+    position = args[1].lookup_index().find(args[0], direction, direction != 0)
+    if position is None:
+        return CellError(CellErrorType.TYPE_ERROR, "MATCH: No match.")
+    return wb.numeric.number_type(position + 1)
+
+
+def xlookup(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default XLOOKUP function, which finds
+    the first position of a value in a row or column and returns the value at
+    the same position of another. The fourth argument is returned if there is
+    no match. A match mode of -1 or 1 finds the largest value no larger or the
+    smallest value no smaller if there is no equal value.
+    """
+    error = _check_ranges("XLOOKUP", args, {1, 2})
+    if error is not None:
+        return error
+    if isinstance(args[0], CellError):
+        return args[0]
+    lookup_range, return_range = args[1], args[2]
+    if not (_is_line(lookup_range) and _is_line(return_range)):
+        return CellError(CellErrorType.TYPE_ERROR,
+                         "XLOOKUP: Range is not a row or column.")
+    if _line_length(lookup_range) != _line_length(return_range):
+        return CellError(CellErrorType.TYPE_ERROR,
+                         "XLOOKUP: Ranges have different sizes.")
+    match_mode = args[4] if len(args) > 4 else 0
+    if match_mode not in (-1, 0, 1):
+        return CellError(CellErrorType.TYPE_ERROR,
+                         "XLOOKUP: Match mode must be -1, 0 or 1.")
+    position = lookup_range.lookup_index().find(args[0], int(match_mode))
+    if position is None:
+        if len(args) > 3:
+            return args[3]
+        return CellError(CellErrorType.TYPE_ERROR, "XLOOKUP: No match.")
+    left, _, right, _ = return_range.bounds
+    if left == right:
+        return return_range.value_at(0, position)
+    return return_range.value_at(position, 0)
+
+
+def _count_matching(index: ValueIndex, operator: str, key) -> int:
+    """
+    Returns the number of cells in an index which match a criterion.
+    """
+    if key is None:
+        # An empty criterion matches the empty cells, or with <> the others
+        return {"=": index.size - index.populated, "<>": index.populated}.get(
+            operator, 0)
+    if operator == "<>":
+        return index.size - len(index.positions(key))
+    return sum(len(index.positions(other))
+               for other in index.matching(operator, key))
+
+
+def _matching_positions(criteria: RangeValue, index: ValueIndex, operator: str,
+                        key) -> list:
+    """
+    Returns the sorted positions of the cells in an index which match a
+    criterion.
+    """
+    if key is None:
+        if operator not in ("=", "<>"):
+            return []
+        # Errors are not indexed, so empty cells are found from the range
+        populated = {index.position(location)
+                     for location in criteria.locations()}
+        return [position for position in range(index.size)
+                if (position in populated) == (operator == "<>")]
+    if operator == "<>":
+        excluded = set(index.positions(key))
+        return [position for position in range(index.size)
+                if position not in excluded]
+    return sorted(position for other in index.matching(operator, key)
+                  for position in index.positions(other))
+
+
+def _summarize_matching(func_name: str, args, wb):
+    """
+    Summarizes the numbers in the cells of the range in the first argument
+    which match the criterion in the second, or in the cells at the same
+    positions of the range in the third argument if it is given, as SUMIF and
+    AVERAGEIF do. The cells matching are found from the buckets of the shared
+    index of the first range. Returns the Summary, or the error to report,
+    which is the first error in the matching cells of the third range,
+    preferring circular references.
+    """
+    error = _check_ranges(func_name, args, {0, 2} if len(args) > 2 else {0})
+    if error is not None:
+        return error
+    if isinstance(args[1], CellError):
+        return args[1]
+    criteria = args[0]
+    operator, key = parse_criterion(args[1], wb.numeric)
+    index = criteria.lookup_index()
+    summary = Summary(wb.numeric.number_type)
+    if len(args) < 3:
+        # The cells in a bucket hold equal values, so each is added at once
+        if key is not None:
+            for other in index.matching(operator, key):
+                if other[0] == 0:
+                    summary.add(other[1], len(index.positions(other)))
+        return summary
+
+    left, top, right, bottom = criteria.bounds
+    sum_left, sum_top, sum_right, sum_bottom = args[2].bounds
+    if (right - left, bottom - top) != (sum_right - sum_left, sum_bottom - sum_top):
+        return CellError(CellErrorType.TYPE_ERROR,
+                         f"{func_name}: Ranges have different sizes.")
+    positions = _matching_positions(criteria, index, operator, key)
+    error = None
+    for value in args[2].values_at(index.offsets(position)
+                                   for position in positions):
+        if isinstance(value, wb.numeric.number_type):
+            summary.add(value)
+        elif isinstance(value, CellError):
+            if value.get_type() == CellErrorType.CIRCULAR_REFERENCE:
+                return value
+            error = error or value
+    return error or summary
+
+
+def countif(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default COUNTIF function, which counts
+    the cells in a range matching a criterion, such as "apple", ">5" or "<>0".
+    """
+    error = _check_ranges("COUNTIF", args, {0})
+    if error is not None:
+        return error
+    if isinstance(args[1], CellError):
+        return args[1]
+    operator, key = parse_criterion(args[1], wb.numeric)
+    return wb.numeric.number_type(
+        _count_matching(args[0].lookup_index(), operator, key))
+
+
+def sumif(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default SUMIF function.
+    """
+    summary = _summarize_matching("SUMIF", args, wb)
+    if isinstance(summary, CellError):
+        return summary
+    return wb.numeric.process_num(summary.total())
+
+
+def averageif(args, wb, sheet, cell, evaluator):
+    """
+    The function implementation for the default AVERAGEIF function.
+    """
+    summary = _summarize_matching("AVERAGEIF", args, wb)
+    if isinstance(summary, CellError):
+        return summary
+    if summary.count == 0:
+        return CellError(CellErrorType.DIVIDE_BY_ZERO,
+                         "AVERAGEIF: No numbers to average.")
+    return wb.numeric.process_num(summary.total() / summary.count)
+
 
 def choose(args):
     """
@@ -129,27 +650,61 @@ def indirect(args, wb, from_sheet, from_cell, evaluator):
         sheet_name = from_sheet.display_name
         index = val[0][0].upper()
         index = index.replace("$", "")
+    # The reference is recorded even if its sheet is missing, so the cell is
+    # updated once the sheet is created
+    evaluator.eval_dependencies.add((sheet_name.lower(), index))
     if sheet_name.lower() not in wb.sheets:
         return CellError(CellErrorType.BAD_REFERENCE, "INDIRECT: Sheet does not exist.")
-
-    from_sheet_name = from_sheet.display_name.lower()
-    from_index = from_cell.location
-    if ((sheet_name.lower(), index) not in
-        wb.interaction_graph.graph[(from_sheet_name, from_index)]):
-        evaluator.eval_dependencies.add(((from_sheet_name, from_index),
-                                         (sheet_name.lower(), index)))
-        wb.interaction_graph.add_dependency((from_sheet_name, from_index),
-                                             (sheet_name.lower(), index))
     return wb.get_cell_value(sheet_name, index)
 
 
+def _user_result(func_name: str, result, numeric):
+    """
+    Returns the result of a registered function as a cell value. Numbers are
+    converted to the numbers of the workbook, with floats converted by their
+    shortest representation. Results which are not finite numbers, such as
+    NaN, and results of other types are a type error.
+    """
+    if result is None or isinstance(result, (bool, str, CellError)):
+        return result
+    if isinstance(result, (int, float, Decimal)):
+        if ((isinstance(result, float) and not math.isfinite(result)) or
+                (isinstance(result, Decimal) and not result.is_finite())):
+            return CellError(CellErrorType.TYPE_ERROR,
+                             f"Function {func_name} returned {result}.")
+        if isinstance(result, float) and numeric.number_type is Decimal:
+            result = repr(result)
+        return numeric.process_num(numeric.check_numeric(result))
+    return CellError(CellErrorType.TYPE_ERROR,
+                     f"Function {func_name} returned a {type(result).__name__}.")
+
+
+def user_function(func_name: str, fn: Callable) -> Callable:
+    """
+    Returns the implementation of a function registered with a workbook,
+    which calls the given Python function with the arguments of the call. The
+    first error among the arguments is the result, preferring circular
+    references, and an exception raised by the function is a type error.
+    """
+    def evaler(args, wb, sheet, cell, evaluator):
+        error = Evaluator.values_error_helper(args)
+        if error is not None:
+            return error
+        try:
+            result = fn(*args)
+        except Exception as exception: # pylint: disable=broad-except
+            return CellError(CellErrorType.TYPE_ERROR,
+                             f"Function {func_name} failed: {exception}",
+                             exception)
+        return _user_result(func_name, result, wb.numeric)
+    return evaler
+
+
 # Default functions that are available in every workbook
 FUNCTION_DEFAULTS = {
     # Boolean Functions
-    "AND" : FuncInfo(None, 1, None, bool, lambda l:
-                     reduce(lambda x, y: x and y, l, True)),
-    "OR" : FuncInfo(None, 1, None, bool, lambda l:
-                    reduce(lambda x, y: x or y, l)),
+    "AND" : FuncInfo(None, 1, None, bool, and_function, lazy=True),
+    "OR" : FuncInfo(None, 1, None, bool, or_function, lazy=True),
     "NOT" : FuncInfo(1, 1, {0 : bool}, None, lambda x: not x[0]),
     "XOR" : FuncInfo(None, 1, None, bool, lambda l:
                      reduce(lambda x, y: x + y, l) % 2 == 1),
@@ -167,6 +722,24 @@ FUNCTION_DEFAULTS = {
     "VERSION" : FuncInfo(0, 0, None, None, lambda _: sheets.version),
     # Indirection
     "INDIRECT" : FuncInfo(1, 1, {0 : str}, None, indirect, True),
+    # Aggregate functions
+    "SUM" : FuncInfo(None, 1, None, None, sum_function, True, ranges=True),
+    "COUNT" : FuncInfo(None, 1, None, None, count_function, True, ranges=True),
+    "AVERAGE" : FuncInfo(None, 1, None, None, average_function, True,
+                         ranges=True),
+    "MIN" : FuncInfo(None, 1, None, None, min_function, True, ranges=True),
+    "MAX" : FuncInfo(None, 1, None, None, max_function, True, ranges=True),
+    # Conditional aggregate functions
+    "COUNTIF" : FuncInfo(2, 2, None, None, countif, True, ranges=True),
+    "SUMIF" : FuncInfo(3, 2, None, None, sumif, True, ranges=True),
+    "AVERAGEIF" : FuncInfo(3, 2, None, None, averageif, True, ranges=True),
+    # Lookup functions
+    "VLOOKUP" : FuncInfo(4, 3, {2 : Decimal, 3 : bool}, None, vlookup, True,
+                         ranges=True),
+    "HLOOKUP" : FuncInfo(4, 3, {2 : Decimal, 3 : bool}, None, hlookup, True,
+                         ranges=True),
+    "MATCH" : FuncInfo(3, 2, {2 : Decimal}, None, match, True, ranges=True),
+    "XLOOKUP" : FuncInfo(5, 3, {4 : Decimal}, None, xlookup, True, ranges=True),
 }
 
 
@@ -188,20 +761,106 @@ class FuncDir():
         """
         return list(self.funcs.keys())
 
+    def is_lazy(self, func_name: str) -> bool:
+        """
+        Returns whether the function with the given name is passed functions
+        evaluating its arguments rather than their values.
+        """
+        func = self.funcs.get(func_name)
+        return func is not None and func.lazy
+
+    def rejects_ranges(self, func_name: str) -> bool:
+        """
+        Returns whether the function with the given name exists and does not
+        take ranges as arguments.
+        """
+        func = self.funcs.get(func_name)
+        return func is not None and not func.ranges
+
+    def register(self, func_name: str, fn: Callable, pure: bool = True,
+                 min_args: int = 0, max_args: Optional[int] = None,
+                 arg_types=None, memo_size: int = MEMO_SIZE) -> str:
+        """
+        Adds a Python function to the directory under the given name, which is
+        case-insensitive, replacing any function registered with that name
+        before. Returns the name the function is called by in formulas.
+
+        The function is called with between min_args and max_args arguments,
+        or any number from min_args if max_args is None. Arguments are
+        converted to the types given by arg_types, either a dict of types by
+        argument index or a list of the types of the first arguments, where
+        each type is str, Decimal, float or bool. A pure function is assumed
+        to always give the same result for the same arguments, so the results
+        of up to memo_size of its calls are kept and reused.
+
+        Raises a ValueError if the name is not a valid function name or is
+        the name of a default function, or if the requirements are invalid,
+        and a TypeError if the function is not callable.
+        """
+        if not callable(fn):
+            raise TypeError(f"Function {func_name} is not callable.")
+        if not FUNCTION_NAME.fullmatch(func_name):
+            raise ValueError(f"Function name {func_name} is invalid.")
+        func_name = func_name.upper()
+        if func_name in FUNCTION_DEFAULTS:
+            raise ValueError(f"Function {func_name} is a default function.")
+        if min_args < 0 or (max_args is not None and max_args < min_args):
+            raise ValueError(f"Invalid argument counts for function {func_name}.")
+        if arg_types is not None and not isinstance(arg_types, dict):
+            arg_types = dict(enumerate(arg_types))
+        for arg_type in (arg_types or {}).values():
+            if arg_type not in type_conv_map:
+                raise ValueError(f"Invalid argument type {arg_type} for "
+                                 f"function {func_name}.")
+        if pure and memo_size < 1:
+            raise ValueError("Memo size must be positive.")
+        self.funcs[func_name] = FuncInfo(max_args, min_args, arg_types, None,
+                                         user_function(func_name, fn), True,
+                                         memo_size=memo_size if pure else None)
+        return func_name
+
+    def cache_info(self, func_name: str) -> Optional[FunctionCacheInfo]:
+        """
+        Returns the hits, misses and evictions of the memo of the function
+        with the given name, along with its maximum and current size, or None
+        if the function is not pure.
+        """
+        func = self.funcs[func_name.upper()]
+        return None if func.memo is None else func.memo.info()
+
     def evaluate(self, func_name: str, args: list,
                  wb, sheet, cell, evaluator) -> any:
         """
         Takes in a function name and a list of arguments and evaluates the
         function with the given arguments. Returns the result of the evaluation.
+        The results of pure functions are reused for arguments they were
+        already called with. The arguments of a lazy function are functions
+        which evaluate each argument, and are only called for the arguments
+        the function reads.
         """
         if func_name in self.funcs:
             func = self.funcs[func_name]
+            if func.lazy:
+                if not func.check_arg_count(len(args)):
+                    return CellError(CellErrorType.TYPE_ERROR,
+                                     f"Invalid arguments for function {func_name}.")
+                args = LazyArgs(func_name, func, args)
+                if func.contextual:
+                    return func.evaler(args, wb, sheet, cell, evaluator)
+                return func.evaler(args)
             valid_args, conv_args = func.check_args(args)
             if valid_args:
+                key = None if func.memo is None else func.memo_key(conv_args)
+                if key is not None:
+                    content = func.memo.get(key)
+                    if content is not _MISSING:
+                        return content
                 if func.contextual:
                     content = func.evaler(conv_args, wb, sheet, cell, evaluator)
                 else:
                     content = func.evaler(conv_args)
+                if key is not None:
+                    func.memo.put(key, content)
                 return content
             return CellError(CellErrorType.TYPE_ERROR,
                              f"Invalid arguments for function {func_name}.")
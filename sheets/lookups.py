@@ -0,0 +1,215 @@
+"""
+This module contains the indexes behind the lookup functions VLOOKUP, HLOOKUP,
+MATCH and XLOOKUP, and the conditional aggregates COUNTIF, SUMIF and
+AVERAGEIF. The first time a range is searched, an index of its values by
+position is built, and from then on it is updated as the cells in the range
+change, so each lookup costs O(1) for an exact match or O(log n) for the
+nearest match rather than a scan of the cells. The index buckets the cells of
+the range by value, so a criterion is answered from the buckets of the values
+matching it, and every function searching a range shares its index.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from decimal import Decimal
+from typing import Iterable, Optional, Tuple
+
+from .ranges import range_bounds
+from .spreadsheet import location_coords
+
+
+def lookup_key(value) -> Optional[tuple]:
+    """
+    Returns the key a value is indexed and looked up by, or None for values
+    which never match, which are empty cells, errors and NaNs. Strings match
+    regardless of case, and keys order numbers before strings before booleans,
+    as comparisons do.
+    """
+    if isinstance(value, bool):
+        return (2, value)
+    if isinstance(value, str):
+        return (1, value.lower())
+    if isinstance(value, (Decimal, float)) and value == value:
+        return (0, value)
+    return None
+
+
+def parse_criterion(criterion, numeric) -> Tuple[str, Optional[tuple]]:
+    """
+    Returns the operator and key of a criterion of a conditional aggregate.
+    A string criterion may start with one of the operators =, <>, <=, >=, <
+    and >, and is otherwise an equality. The rest of the string is a number if
+    it can be read as one in the given numeric mode, a boolean if it is TRUE
+    or FALSE, and a string otherwise, while an empty key matches empty cells.
+    Any other criterion is an equality with its own value.
+    """
+    if not isinstance(criterion, str):
+        return "=", lookup_key(criterion)
+    for operator in ("<>", "<=", ">=", "=", "<", ">"):
+        if criterion.startswith(operator):
+            criterion = criterion[len(operator):]
+            break
+    else:
+        operator = "="
+    if criterion == "":
+        return operator, None
+    if criterion.upper() in ("TRUE", "FALSE"):
+        return operator, (2, criterion.upper() == "TRUE")
+    try:
+        number = numeric.parse(criterion.strip())
+        if number == number:
+            return operator, (0, number)
+    except (ArithmeticError, ValueError):
+        pass
+    return operator, (1, criterion.lower())
+
+
+class ValueIndex():
+    """
+    An index of the values in a range of cells by their position in it,
+    counting from zero row by row. Exact matches are found through a hash of
+    the positions holding each value, while the sorted list of the distinct
+    values, used to find the nearest value or the values in an interval, is
+    only built the first time it is needed.
+
+    Attributes:
+        size (int): The number of cells in the range.
+        populated (int): The number of populated cells in the range.
+    """
+
+    def __init__(self, location: str, items: Iterable[Tuple[str, object]]):
+        """
+        Initializes the index of the range with the given location from the
+        locations and values of its populated cells.
+        """
+        left, top, right, bottom = range_bounds(location)
+        self._left, self._top = left, top
+        self._width = right - left + 1
+        self.size = self._width * (bottom - top + 1)
+        self.populated = 0
+        # The sorted positions holding each key, and the sorted keys
+        self._positions = {}
+        self._keys = None
+        for cell_location, value in items:
+            self.populated += value is not None
+            self._add(self.position(cell_location), lookup_key(value))
+
+    def position(self, location: str) -> int:
+        """
+        Returns the position of the cell at the given location.
+        """
+        col, row = location_coords(location)
+        return (row - self._top) * self._width + col - self._left
+
+    def offsets(self, position: int) -> Tuple[int, int]:
+        """
+        Returns the column and row offsets from the top left of the range of
+        the cell at the given position.
+        """
+        row, col = divmod(position, self._width)
+        return col, row
+
+    def _add(self, position: int, key: Optional[tuple]) -> None:
+        """
+        Adds a key at the given position to the index.
+        """
+        if key is None:
+            return
+        positions = self._positions.get(key)
+        if positions is None:
+            self._positions[key] = [position]
+            if self._keys is not None:
+                insort(self._keys, key)
+        else:
+            insort(positions, position)
+
+    def _remove(self, position: int, key: Optional[tuple]) -> None:
+        """
+        Removes the key at the given position from the index.
+        """
+        if key is None:
+            return
+        positions = self._positions[key]
+        positions.pop(bisect_left(positions, position))
+        if not positions:
+            del self._positions[key]
+            if self._keys is not None:
+                self._keys.pop(bisect_left(self._keys, key))
+
+    def replace(self, location: str, old_value, new_value) -> None:
+        """
+        Updates the index for the cell at the given location changing from the
+        old value to the new value, either of which may be None for an empty
+        cell.
+        """
+        position = self.position(location)
+        self.populated += (new_value is not None) - (old_value is not None)
+        self._remove(position, lookup_key(old_value))
+        self._add(position, lookup_key(new_value))
+
+    def _sorted_keys(self) -> list:
+        """
+        Returns the sorted list of the distinct keys, building it if needed.
+        """
+        if self._keys is None:
+            self._keys = sorted(self._positions)
+        return self._keys
+
+    def nearest(self, key: tuple, direction: int) -> Optional[tuple]:
+        """
+        Returns the largest key of the same type no larger than the given key
+        if direction is negative, or the smallest no smaller if it is positive,
+        or None if there is none.
+        """
+        keys = self._sorted_keys()
+        if direction < 0:
+            index = bisect_right(keys, key) - 1
+        else:
+            index = bisect_left(keys, key)
+        if 0 <= index < len(keys) and keys[index][0] == key[0]:
+            return keys[index]
+        return None
+
+    def matching(self, operator: str, key: tuple) -> list:
+        """
+        Returns the keys in the index which compare to the given key with the
+        given operator. Keys only compare as less or greater than keys of the
+        same type, while every key of another type is unequal.
+        """
+        if operator == "=":
+            return [key] if key in self._positions else []
+        if operator == "<>":
+            return [other for other in self._positions if other != key]
+        # The keys of each type lie between the tuples of its rank and the next
+        keys = self._sorted_keys()
+        start = bisect_left(keys, (key[0],))
+        end = bisect_left(keys, (key[0] + 1,))
+        if operator == "<":
+            return keys[start:bisect_left(keys, key)]
+        if operator == "<=":
+            return keys[start:bisect_right(keys, key)]
+        if operator == ">":
+            return keys[bisect_right(keys, key):end]
+        return keys[bisect_left(keys, key):end]
+
+    def positions(self, key: tuple) -> list:
+        """
+        Returns the sorted positions of the cells holding the given key.
+        """
+        return self._positions.get(key, [])
+
+    def find(self, value, match_type: int = 0, last: bool = False) -> Optional[int]:
+        """
+        Returns the position of the given value, or None if it is not found.
+        With a match type of zero only an equal value matches, while with a
+        negative match type the largest value no larger matches, and with a
+        positive match type the smallest value no smaller. If the matching
+        value is in more than one position, the first is returned, or the last
+        if last is True.
+        """
+        key = lookup_key(value)
+        if key is not None and match_type != 0:
+            key = self.nearest(key, match_type)
+        positions = self._positions.get(key)
+        if positions is None:
+            return None
+        return positions[-1] if last else positions[0]
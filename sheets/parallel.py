@@ -0,0 +1,118 @@
+"""
+This module contains the helpers used by the workbook to evaluate formula cells
+on a process pool. Workers do not have access to the workbook, so each batch of
+cells is shipped with the values of the cells they read, and evaluated against
+a snapshot holding only those values.
+
+Only formulas whose values depend on nothing but their static references can be
+evaluated this way. Conditional functions, lazy functions and INDIRECT read
+cells which are not known before evaluation, so cells using them are always
+evaluated by the workbook itself.
+"""
+
+from .cell import FormulaTemplate, get_template
+from .compiler import compile_template
+from .evaluator import Evaluator, NUMERIC_MODES
+from .spreadsheet import location_coords
+from .func_dir import FuncDir, FUNCTION_DEFAULTS
+
+# Functions which may read cells other than the static references of a formula
+DYNAMIC_FUNCS = {"IF", "IFERROR", "CHOOSE", "INDIRECT"}
+
+# Levels with fewer cells to evaluate than this are evaluated by the workbook,
+# since shipping them to the pool would cost more than evaluating them
+MIN_PARALLEL_LEVEL = 500
+
+# Number of batches each level is split into per worker, so workers which
+# finish early can pick up more of the level
+CHUNKS_PER_WORKER = 4
+
+
+def is_parallel_safe(template: FormulaTemplate) -> bool:
+    """
+    Returns whether the given formula template can be evaluated from the values
+    of its static references alone, which is the case if it only calls default
+    functions which neither read other cells nor evaluate their arguments
+    lazily. Formulas using ranges are not, since they may evaluate to arrays
+    which the workbook spills into other cells.
+    """
+    if template.parallel_safe is None:
+        template.parallel_safe = not any(template.tree.find_data("cell_range"))
+        for function in template.tree.find_data("function"):
+            func_name = function.children[0].upper()
+            if (func_name in DYNAMIC_FUNCS or func_name not in FUNCTION_DEFAULTS or
+                    FUNCTION_DEFAULTS[func_name].contextual or
+                    FUNCTION_DEFAULTS[func_name].lazy):
+                template.parallel_safe = False
+                break
+    return template.parallel_safe
+
+
+class _SheetView():
+    """
+    Stands in for the sheet of an evaluated cell, which the evaluator only uses
+    for its name.
+    """
+
+    def __init__(self, display_name: str):
+        self.display_name = display_name
+
+
+class _Snapshot():
+    """
+    Stands in for the workbook while evaluating cells in a worker, answering
+    reads from the values shipped with the cells.
+    """
+
+    func_dir = None
+
+    def __init__(self, sheet_names, numeric, values):
+        self.sheets = sheet_names
+        self.numeric = numeric
+        self.values = values
+        if _Snapshot.func_dir is None:
+            _Snapshot.func_dir = FuncDir()
+
+    def get_cell_value(self, sheet_name: str, location: str):
+        """
+        Returns the shipped value of the specified cell, raising a KeyError if
+        the sheet does not exist.
+        """
+        sheet_name = sheet_name.lower()
+        if sheet_name not in self.sheets:
+            raise KeyError(f"Sheet '{sheet_name}' not found.")
+        return self.values.get((sheet_name, location.upper()))
+
+    def cell_value_at(self, cell_name):
+        """
+        Returns the shipped value of the cell with the given lowercase sheet
+        name and uppercase location, raising a KeyError if the sheet does not
+        exist.
+        """
+        if cell_name[0] not in self.sheets:
+            raise KeyError(f"Sheet '{cell_name[0]}' not found.")
+        return self.values.get(cell_name)
+
+
+def evaluate_cells(payload) -> list:
+    """
+    Evaluates a batch of formula cells in a worker. The payload holds the names
+    of the sheets in the workbook, the name of its numeric mode, the values of
+    the cells read by the batch, and the name, sheet name and contents of each
+    cell. Returns the name and value of each cell.
+    """
+    sheet_names, numeric, values, cells = payload
+    numeric = NUMERIC_MODES[numeric]
+    snapshot = _Snapshot(sheet_names, numeric, values)
+    evaluators = {}
+    results = []
+    for cell_name, sheet_name, contents in cells:
+        if sheet_name not in evaluators:
+            evaluators[sheet_name] = Evaluator(snapshot, _SheetView(sheet_name))
+        evaluator = evaluators[sheet_name]
+        evaluator.reset_eval_dependencies()
+        evaluator.anchor = location_coords(cell_name[1])
+        template = get_template(contents, cell_name[1])
+        value = compile_template(template, numeric)(evaluator)
+        results.append((cell_name, numeric.zero if value is None else value))
+    return results
@@ -0,0 +1,433 @@
+"""
+This module contains the logic for cell ranges such as A1:B10. A range is
+named like a cell, by the lowercase name of its sheet and its location, where
+the location of a range is its top left and bottom right corners joined by a
+colon. Formulas depend on a range as a whole rather than on every cell in it,
+so a formula reading a large range adds a single node to the cell interaction
+graph instead of one for every cell.
+
+The graph finds the ranges covering a changed cell through a RangeIndex, and
+the formula cells inside a range through a PointIndex, so neither ever visits
+the cells of a range one at a time. Functions which keep state about the
+values in a range, such as running aggregates and lookup indexes, keep it in
+RangeStates, which find the states covering a changed cell the same way.
+"""
+
+from collections import OrderedDict
+from functools import cache
+from typing import Callable, Iterator, Tuple
+
+from .spreadsheet import (check_valid_location, location_coords,
+                          location_from_coords)
+
+
+def is_range(location: str) -> bool:
+    """
+    Returns whether the given location in the graph is a range rather than a
+    single cell.
+    """
+    return ":" in location
+
+
+def range_name(start: str, end: str) -> str:
+    """
+    Returns the location of the range between the two given corners, which
+    may be any two opposite corners, as its top left and bottom right corners.
+    Absolute markers are dropped. Raises a ValueError if either corner is not
+    a valid location.
+    """
+    start, end = start.replace("$", "").upper(), end.replace("$", "").upper()
+    if not (check_valid_location(start) and check_valid_location(end)):
+        raise ValueError(f"Invalid range {start}:{end}")
+    (col1, row1), (col2, row2) = location_coords(start), location_coords(end)
+    return range_from_bounds(min(col1, col2), min(row1, row2),
+                             max(col1, col2), max(row1, row2))
+
+
+def range_from_bounds(left: int, top: int, right: int, bottom: int) -> str:
+    """
+    Returns the location of the range with the given bounds.
+    """
+    return (location_from_coords(left, top) + ":" +
+            location_from_coords(right, bottom))
+
+
+@cache
+def range_bounds(location: str) -> Tuple[int, int, int, int]:
+    """
+    Returns the left column, top row, right column and bottom row of the
+    range with the given location.
+    """
+    start, end = location.split(":")
+    return location_coords(start) + location_coords(end)
+
+
+def _blocks(low: int, high: int) -> Iterator[Tuple[int, int]]:
+    """
+    Splits the interval from low to high into the fewest aligned blocks whose
+    lengths are powers of two, yielding the level and index of each, where
+    the block at level l and index i covers i * 2**l to (i + 1) * 2**l - 1.
+    Any interval is covered by at most two blocks per level.
+    """
+    while low <= high:
+        level = 0
+        while low % (2 << level) == 0 and low + (2 << level) - 1 <= high:
+            level += 1
+        yield level, low >> level
+        low += 1 << level
+
+
+class RangeIndex():
+    """
+    An index of the ranges on each sheet, answering which ranges cover a cell.
+
+    Every range is split into aligned blocks of columns and of rows whose sizes
+    are powers of two, and is stored under each pair of a column block and a
+    row block, so a range is stored under at most a few hundred keys however
+    large it is. A cell lies in exactly one block of each size in each
+    direction, so the ranges covering it are found by one lookup for every
+    pair of block sizes in use on its sheet.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty index.
+        """
+        # Each sheet maps its blocks to the ranges stored under them, and
+        # counts the keys stored at every pair of block levels
+        self._blocks = {}
+        self._levels = {}
+
+    def _keys(self, location: str) -> Iterator[tuple]:
+        """
+        Yields the keys the range with the given location is stored under.
+        """
+        left, top, right, bottom = range_bounds(location)
+        row_blocks = list(_blocks(top, bottom))
+        for col_level, col_index in _blocks(left, right):
+            for row_level, row_index in row_blocks:
+                yield col_level, row_level, col_index, row_index
+
+    def add(self, sheet: str, location: str, item) -> None:
+        """
+        Adds an item for the range with the given location on the given sheet.
+        """
+        blocks = self._blocks.setdefault(sheet, {})
+        levels = self._levels.setdefault(sheet, {})
+        for key in self._keys(location):
+            items = blocks.get(key)
+            if items is None:
+                items = blocks[key] = set()
+                levels[key[:2]] = levels.get(key[:2], 0) + 1
+            items.add(item)
+
+    def remove(self, sheet: str, location: str, item) -> None:
+        """
+        Removes the item for the range with the given location on the given
+        sheet.
+        """
+        blocks, levels = self._blocks[sheet], self._levels[sheet]
+        for key in self._keys(location):
+            items = blocks[key]
+            items.discard(item)
+            if not items:
+                del blocks[key]
+                levels[key[:2]] -= 1
+                if not levels[key[:2]]:
+                    del levels[key[:2]]
+        if not blocks:
+            del self._blocks[sheet]
+            del self._levels[sheet]
+
+    def covering(self, sheet: str, location: str) -> set:
+        """
+        Returns the items of the ranges on the given sheet which cover the
+        cell at the given location.
+        """
+        levels = self._levels.get(sheet)
+        if not levels:
+            return set()
+        blocks = self._blocks[sheet]
+        col, row = location_coords(location)
+        found = set()
+        for col_level, row_level in levels:
+            items = blocks.get((col_level, row_level, col >> col_level,
+                                row >> row_level))
+            if items:
+                found.update(items)
+        return found
+
+    def overlapping(self, sheet: str, location: str) -> set:
+        """
+        Returns the items of the ranges on the given sheet which overlap the
+        range with the given location. The blocks at each pair of levels which
+        meet the range are looked up, unless there are more of them than keys
+        stored at those levels, in which case the stored keys are searched.
+        """
+        levels = self._levels.get(sheet)
+        if not levels:
+            return set()
+        blocks = self._blocks[sheet]
+        left, top, right, bottom = range_bounds(location)
+        found = set()
+        searched = set()
+        for (col_level, row_level), count in levels.items():
+            cols = range(left >> col_level, (right >> col_level) + 1)
+            rows = range(top >> row_level, (bottom >> row_level) + 1)
+            if len(cols) * len(rows) > count:
+                searched.add((col_level, row_level))
+                continue
+            for col_index in cols:
+                for row_index in rows:
+                    items = blocks.get((col_level, row_level, col_index, row_index))
+                    if items:
+                        found.update(items)
+        if searched:
+            for key, items in blocks.items():
+                col_level, row_level, col_index, row_index = key
+                if ((col_level, row_level) in searched and
+                        left >> col_level <= col_index <= right >> col_level and
+                        top >> row_level <= row_index <= bottom >> row_level):
+                    found.update(items)
+        return found
+
+
+class PointIndex():
+    """
+    An index of the cells on each sheet by column and row, answering which of
+    them lie inside a range without visiting the empty cells of the range.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty index.
+        """
+        # Each sheet maps its columns to the rows of the cells in them, and
+        # each cell to its item
+        self._columns = {}
+        self._items = {}
+
+    def add(self, sheet: str, location: str, item) -> None:
+        """
+        Adds the item of the cell at the given location on the given sheet.
+        """
+        col, row = location_coords(location)
+        self._columns.setdefault(sheet, {}).setdefault(col, set()).add(row)
+        self._items.setdefault(sheet, {})[(col, row)] = item
+
+    def remove(self, sheet: str, location: str) -> None:
+        """
+        Removes the cell at the given location on the given sheet.
+        """
+        col, row = location_coords(location)
+        columns = self._columns[sheet]
+        columns[col].discard(row)
+        if not columns[col]:
+            del columns[col]
+        del self._items[sheet][(col, row)]
+        if not columns:
+            del self._columns[sheet]
+            del self._items[sheet]
+
+    def inside(self, sheet: str, location: str) -> list:
+        """
+        Returns the items of the cells on the given sheet which lie inside the
+        range with the given location.
+        """
+        columns = self._columns.get(sheet)
+        if not columns:
+            return []
+        items = self._items[sheet]
+        left, top, right, bottom = range_bounds(location)
+        if right - left + 1 <= len(columns):
+            cols = [col for col in range(left, right + 1) if col in columns]
+        else:
+            cols = [col for col in columns if left <= col <= right]
+        found = []
+        for col in cols:
+            rows = columns[col]
+            if bottom - top + 1 <= len(rows):
+                found.extend(items[(col, row)] for row in range(top, bottom + 1)
+                             if row in rows)
+            else:
+                found.extend(items[(col, row)] for row in rows
+                             if top <= row <= bottom)
+        return found
+
+    def rename_sheet(self, old_sheet: str, new_sheet: str) -> None:
+        """
+        Moves the cells of a renamed sheet to its new name, which must not
+        have any cells.
+        """
+        if old_sheet in self._columns:
+            self._columns[new_sheet] = self._columns.pop(old_sheet)
+            self._items[new_sheet] = self._items.pop(old_sheet)
+
+
+class RangeStates():
+    """
+    The states kept about the values in the most recently used ranges of a
+    workbook, such as their running aggregates. A state is made from the
+    locations and values of the populated cells of its range the first time
+    it is asked for, and from then on is told of every change to the value of
+    a cell in its range by the sheet of the range, through its replace method.
+    """
+
+    # The number of ranges whose states are kept. The state of the least
+    # recently used range is dropped first, and made again if it is asked for.
+    max_states = 256
+
+    def __init__(self, make_state: Callable):
+        """
+        Initializes an empty collection of states, which are made by calling
+        make_state with the location of a range and the locations and values
+        of its populated cells.
+        """
+        self._make_state = make_state
+        # The states by sheet and range location, least recently used first
+        self._states = OrderedDict()
+        self._index = RangeIndex()
+        self._sheets = set()
+
+    def get(self, sheet, location: str, read: Callable):
+        """
+        Returns the state of the range with the given location on the given
+        sheet. If it is not kept, it is made from the locations and values
+        returned by read.
+        """
+        key = (sheet, location)
+        state = self._states.get(key)
+        if state is not None:
+            self._states.move_to_end(key)
+            return state
+        state = self._make_state(location, read())
+        self._states[key] = state
+        self._index.add(sheet, location, key)
+        if sheet not in self._sheets:
+            self._sheets.add(sheet)
+            sheet.add_listener(self.value_changed)
+        if len(self._states) > self.max_states:
+            old_key, _ = self._states.popitem(last=False)
+            self._index.remove(old_key[0], old_key[1], old_key)
+        return state
+
+    def value_changed(self, sheet, location: str, old_value, new_value) -> None:
+        """
+        Updates the states of the ranges covering a changed cell. Called by the
+        sheets of the ranges.
+        """
+        for key in self._index.covering(sheet, location):
+            self._states[key].replace(location, old_value, new_value)
+
+    def forget_sheet(self, sheet) -> None:
+        """
+        Drops the states of the ranges on a sheet which has been deleted.
+        """
+        if sheet not in self._sheets:
+            return
+        self._sheets.remove(sheet)
+        sheet.remove_listener(self.value_changed)
+        for key in [key for key in self._states if key[0] is sheet]:
+            del self._states[key]
+            self._index.remove(key[0], key[1], key)
+
+
+class RangeValue():
+    """
+    The value of a range passed to a function. The values of its cells are
+    only read from the workbook when they are asked for, so a range holds no
+    copy of the sheet, and reading it brings dirty cells up to date as reading
+    a single cell does.
+
+    Attributes:
+        workbook (Workbook): The workbook the range is in.
+        sheet (str): The lowercase name of the sheet of the range.
+        location (str): The location of the range.
+    """
+
+    def __init__(self, workbook, sheet: str, location: str):
+        self.workbook = workbook
+        self.sheet = sheet
+        self.location = location
+
+    def __repr__(self) -> str:
+        return f"RangeValue({self.sheet}!{self.location})"
+
+    @property
+    def bounds(self) -> Tuple[int, int, int, int]:
+        """
+        The left column, top row, right column and bottom row of the range.
+        """
+        return range_bounds(self.location)
+
+    def locations(self) -> list:
+        """
+        Returns the locations of the populated cells in the range, row by row.
+        """
+        return self.workbook.sheets[self.sheet].locations_in(*self.bounds)
+
+    def values(self) -> list:
+        """
+        Returns the values of the populated cells in the range, row by row.
+        """
+        return self.workbook.cell_values_at(self.sheet, self.locations())
+
+    def items(self) -> list:
+        """
+        Returns the locations and values of the populated cells in the range,
+        row by row.
+        """
+        locations = self.locations()
+        return list(zip(locations,
+                        self.workbook.cell_values_at(self.sheet, locations)))
+
+    def aggregate(self):
+        """
+        Returns the running aggregate of the numbers in the range, which is
+        kept by the workbook across evaluations.
+        """
+        return self.workbook.range_aggregate(self)
+
+    def column(self, offset: int) -> 'RangeValue':
+        """
+        Returns the column of the range at the given offset from its left.
+        """
+        left, top, _, bottom = self.bounds
+        return RangeValue(self.workbook, self.sheet,
+                          range_from_bounds(left + offset, top,
+                                            left + offset, bottom))
+
+    def row(self, offset: int) -> 'RangeValue':
+        """
+        Returns the row of the range at the given offset from its top.
+        """
+        left, top, right, _ = self.bounds
+        return RangeValue(self.workbook, self.sheet,
+                          range_from_bounds(left, top + offset,
+                                            right, top + offset))
+
+    def value_at(self, col_offset: int, row_offset: int):
+        """
+        Returns the value of the cell at the given offsets from the top left of
+        the range.
+        """
+        left, top, _, _ = self.bounds
+        return self.workbook.cell_value_at(
+            (self.sheet, location_from_coords(left + col_offset, top + row_offset)))
+
+    def values_at(self, offsets) -> list:
+        """
+        Returns the values of the cells at the given column and row offsets
+        from the top left of the range, which are None for empty cells.
+        """
+        left, top, _, _ = self.bounds
+        read = self.workbook.cell_value_at
+        return [read((self.sheet, location_from_coords(left + col, top + row)))
+                for col, row in offsets]
+
+    def lookup_index(self):
+        """
+        Returns the index of the values in the range, kept by the workbook
+        across evaluations.
+        """
+        return self.workbook.lookup_index(self)
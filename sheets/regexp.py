@@ -55,6 +55,10 @@ SINGLE_SQ_REF = rf"'{SHT_BEG_END}'!{FORM_CELL}"
 UNQ_REF = rf"{UNQ_SHT_NAME}!{FORM_CELL}"
 REF = re.compile(rf"({MULTI_SQ_REF}|{SINGLE_SQ_REF}|{UNQ_REF})|({FORM_CELL})")
 
+# Matches any range in a formula with dbl quotes removed from it, i.e.
+# Sheet1!A1:B2, 'Sheet1'!A1:B2, A1:B2, capturing the sheet name and corners
+RANGE_REF = re.compile(rf"(?:({SQ_SHT_NAME}|{UNQ_SHT_NAME})!)?({FORM_CELL}):({FORM_CELL})")
+
 # Match sheet names in cell ref formulas. These are either valid single quoted
 # sheet names, or valid unquoted sheet names that are not preceded by a number
 # or word character (Should be an operator or opening parenthesis) and are
@@ -62,6 +66,18 @@ REF = re.compile(rf"({MULTI_SQ_REF}|{SINGLE_SQ_REF}|{UNQ_REF})|({FORM_CELL})")
 SHT_REF = re.compile(fr"(?<![\d\w\"]){SQ_SHT_NAME}(?=!)|(?<![\d\w\"])" +
                      fr"{UNQ_SHT_NAME}(?=!)")
 
+# Tokens of a formula which may hold cell references. String literals and
+# quoted sheet names are matched so that references are not found inside them.
+FORMULA_TOKEN = re.compile(r'"[^"]*"|\'[^\']*\'|[A-Za-z_$][A-Za-z0-9_$]*')
+
+# A cell reference token, split into its column and row and their absolute
+# markers
+CELL_TOKEN = re.compile(r'(\$?)([A-Za-z]+)(\$?)([1-9][0-9]*)')
+
+# Text following a token which makes it a function or sheet name instead of a
+# cell reference
+NOT_REF_SUFFIX = re.compile(r'\s*[(!]')
+
 # Match any funtion with evaluation time dependencies
 HAS_EVAL_DEP = re.compile(r'if|iferror|choose|indirect', re.IGNORECASE)
 
@@ -113,6 +129,20 @@ def find_refs(formula: str):
             inds.append(ref[1].replace("$", ""))
     return inds, sheetsrefs
 
+def find_ranges(formula: str):
+    """
+    Finds all ranges in the given formula and returns them as a list of
+    tuples of the sheet name, or None for ranges local to the sheet, and the
+    two corners of the range. Also returns the formula with the ranges blanked
+    out, so that find_refs does not find their corners as single cells.
+    """
+    formula = rpl_dbl_quotes(formula)
+    ranges = []
+    for match in RANGE_REF.finditer(formula):
+        sheet_name = match[1].strip("'") if match[1] else None
+        ranges.append((sheet_name, match[2], match[3]))
+    return ranges, RANGE_REF.sub(lambda match: " " * len(match[0]), formula)
+
 def find_refs_absolute(formula: str):
     """
     Finds all references to other cells in the given formula and returns them 
@@ -164,6 +194,21 @@ def replace_names(formula: str, old_name: str, new_name: str) -> str:
     return final_form + formula[prev_idx:]
 
 
+def references_sheet(formula: str, sheet_name: str) -> bool:
+    """
+    Returns true if the given formula references a cell or range on the sheet
+    with the given name, wherever the reference is in the formula, and false
+    otherwise.
+    """
+    sheet_name = sheet_name.lower()
+    if sheet_name not in formula.lower():
+        return False
+    ranges, formula = find_ranges(formula)
+    return (any(sheet is not None and sheet.lower() == sheet_name
+                for sheet, _, _ in ranges) or
+            any(sheet.lower() == sheet_name for sheet, _ in find_refs(formula)[1]))
+
+
 def is_ref(string: str) -> bool:
     """
     Returns true if the given string is a valid cell reference of any type, and
@@ -7,7 +7,7 @@ consists of a Dictionary mapping cell locations in a spreadsheet to Cell objects
 from functools import cache
 
 from .regexp import VALID_LOC
-from .cell import Cell
+from .cell import Cell, CellType, SpillCell
 
 # Utility Functions
 @cache
@@ -48,6 +48,16 @@ def get_row_number(location : str) -> int:
     """
     return int(location[len(get_column_label(location)):])
 
+
+@cache
+def location_coords(location: str) -> tuple:
+    """
+    Returns the column and row numbers of the given location.
+    """
+    location = location.upper()
+    return column_label_to_number(get_column_label(location)), get_row_number(location)
+
+
 def get_column_label_from_number(col_num: int) -> str:
     """
     Converts a column number to its corresponding Excel column label.
@@ -74,6 +84,14 @@ def get_column_label_from_number(col_num: int) -> str:
     return column_label
 
 
+@cache
+def location_from_coords(col_num: int, row_num: int) -> str:
+    """
+    Returns the location with the given column and row numbers.
+    """
+    return get_column_label_from_number(col_num) + str(row_num)
+
+
 class Spreadsheet():
     """
     This class represents a spreadsheet. It is responsible for managing the cells
@@ -84,15 +102,50 @@ class Spreadsheet():
         max_row (int): The maximum row number of the spreadsheet.
         max_col (int): The maximum column number of the spreadsheet.
         display_name (str): The name of the spreadsheet with preserved casing.
+        numeric (NumericMode): How numbers are represented in the workbook, or
+            None for Decimals.
     """
 
-    def __init__(self, display_name: str):
+    def __init__(self, display_name: str, numeric=None):
         self._cells = {}
         self._rows = {}
         self._cols = {}
         self._max_row = 0
         self._max_col = 0
         self.display_name = display_name
+        self.numeric = numeric
+        self._listeners = []
+
+    def __getstate__(self) -> dict:
+        """
+        Returns the state of the sheet to copy. Listeners belong to the
+        workbook watching the sheet, so a copy of the sheet has none.
+        """
+        state = self.__dict__.copy()
+        state["_listeners"] = []
+        return state
+
+    def add_listener(self, listener) -> None:
+        """
+        Registers a function to be called as listener(sheet, location,
+        old_value, new_value) whenever the value of a cell on the sheet
+        changes, including when a cell is populated or deleted.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        """
+        Unregisters a function registered with add_listener.
+        """
+        self._listeners.remove(listener)
+
+    def value_changed(self, location: str, old_value, new_value) -> None:
+        """
+        Passes a change to the value of the cell at the given location on to
+        the listeners of the sheet. Called by the cells of the sheet.
+        """
+        for listener in self._listeners:
+            listener(self, location, old_value, new_value)
 
     def set_cell_contents(self, location: str, content: str) -> None:
         """ 
@@ -103,24 +156,57 @@ class Spreadsheet():
         if not check_valid_location(location):
             raise ValueError(f"Invalid cell location: {location}")
 
+        cell = self._cells.get(location)
+        # Emptying a spilled cell leaves the value spilled into it, while
+        # setting its contents replaces it with a new cell
+        if cell is not None and cell.get_type() == CellType.SPILL:
+            if content is None or content.strip() == "":
+                return
+            self._del_cell(location)
+            cell = None
+
         # If contents are empty, then delete the cell
         if content is None or content.strip() == "":
             self._del_cell(location)
             return
 
-        col_label = get_column_label(location)
-        col_num = column_label_to_number(col_label)
-        row_num = get_row_number(location)
-
         # If no cell deleted, then set the contents as desired. If the cell
         # already exists, mutate it, otherwise allocate a new cell.
-        cell = self._cells.get(location)
         if cell:
             cell.set_content(content)
         else:
             self._cells[location] = Cell(content, self, location)
-            self._max_row = max(self._max_row, row_num)
-            self._max_col = max(self._max_col, column_label_to_number(col_label))
+            self._add_location(location)
+
+    def set_spill_value(self, location: str, value, anchor: str) -> None:
+        """
+        Sets the value spilled into the cell at the given location from the
+        formula cell at the anchor location, creating a spilled cell if the
+        cell is empty. The cell must be empty or spilled from the same anchor.
+        """
+        cell = self._cells.get(location)
+        if cell is None:
+            self._cells[location] = SpillCell(value, anchor, self, location)
+            self._add_location(location)
+        else:
+            cell.set_value(value)
+
+    def remove_spill(self, location: str) -> None:
+        """
+        Deletes the spilled cell at the given location, if there is one.
+        """
+        cell = self._cells.get(location)
+        if cell is not None and cell.get_type() == CellType.SPILL:
+            self._del_cell(location)
+
+    def _add_location(self, location: str) -> None:
+        """
+        Adds the location of a new cell to the rows and columns of the sheet,
+        and grows the extent of the sheet to include it.
+        """
+        col_num, row_num = location_coords(location)
+        self._max_row = max(self._max_row, row_num)
+        self._max_col = max(self._max_col, col_num)
         # Update the row and column dicts to include the new cell
         if row_num not in self._rows:
             self._rows[row_num] = set()
@@ -139,7 +225,9 @@ class Spreadsheet():
             col_label = get_column_label(location)
             col_num = column_label_to_number(col_label)
             row_num = get_row_number(location)
-            del self._cells[location]
+            cell = self._cells.pop(location)
+            if self._listeners and cell.get_value() is not None:
+                self.value_changed(location, cell.get_value(), None)
             # Remove from row and col dictionaries
             if col_num in self._cols:
                 self._cols[col_num].remove(row_num)
@@ -209,12 +297,41 @@ class Spreadsheet():
             raise ValueError(f"Invalid cell location: {location}")
         return self._cells.get(location)
 
+    def cell_table(self) -> dict:
+        """
+        Returns the dictionary mapping the locations of populated cells to the
+        cells. It is the same dictionary for the life of the sheet, so it can
+        be kept to read cells without going through the sheet.
+        """
+        return self._cells
+
     def get_cells(self) -> list:
         """
         Returns a list of all cells locations populated in the sheet.
         """
         return list(self._cells.keys())
 
+    def locations_in(self, left: int, top: int, right: int, bottom: int) -> list:
+        """
+        Returns the locations of the populated cells within the given column
+        and row bounds, row by row. Only the populated columns and rows are
+        visited, so a large and mostly empty region is as cheap as its cells.
+        """
+        if right - left + 1 <= len(self._cols):
+            cols = [col for col in range(left, right + 1) if col in self._cols]
+        else:
+            cols = [col for col in self._cols if left <= col <= right]
+        found = []
+        for col in cols:
+            rows = self._cols[col]
+            if bottom - top + 1 <= len(rows):
+                found.extend((row, col) for row in range(top, bottom + 1)
+                             if row in rows)
+            else:
+                found.extend((row, col) for row in rows if top <= row <= bottom)
+        found.sort()
+        return [location_from_coords(col, row) for row, col in found]
+
     def __getitem__(self, location: str) -> Cell:
         """ 
         Returns the value of the cell at the given location.
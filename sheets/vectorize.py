@@ -0,0 +1,258 @@
+"""
+This module contains the vectorized evaluator, which evaluates one formula
+template for many cells at once. Each node of the template is evaluated into a
+NumPy array holding its value in every cell, so each operator is applied to a
+whole column of values instead of once per cell, and error values are tracked
+with masks over the arrays.
+
+Only templates made of cell references, literals, arithmetic, concatenation
+and comparisons can be vectorized. The cells evaluated together must not read
+each other, which the workbook ensures by only evaluating cells of the same
+level together. Numbers are kept in the numeric mode of the workbook, so the
+vectorized evaluation of a cell gives the same value as its compiled formula.
+Decimals are operated on as arrays of Python objects, while floats are
+operated on as native float arrays.
+"""
+
+from typing import Callable
+
+import numpy as np
+
+from .arrays import (NumberArrays, VECTOR_COMPARISONS, arithmetic, divide,
+                     number_arrays)
+from .cell import FormulaTemplate
+from .compiler import COMPARISONS, concat_values, compare_values
+from .error_types import CellError, CellErrorType
+from .evaluator import Evaluator
+from .regexp import CELL_TOKEN
+from .spreadsheet import (check_valid_location, location_coords,
+                          location_from_coords)
+
+# Groups of cells sharing a template smaller than this are evaluated one cell
+# at a time, since building the arrays would cost more than it saves
+MIN_VECTOR_RUN = 64
+
+# Elementwise concatenation, for arrays of values
+_concat = np.frompyfunc(concat_values, 2, 1)
+
+
+class _Run():
+    """
+    The cells a template is evaluated for: the workbook and sheet holding them,
+    and arrays of their column and row numbers.
+    """
+
+    def __init__(self, workbook, sheet, locations):
+        self.workbook = workbook
+        self.sheet = sheet
+        coords = np.array([location_coords(location) for location in locations])
+        self.cols = coords[:, 0]
+        self.rows = coords[:, 1]
+        self.size = len(locations)
+
+    def full(self, value) -> np.ndarray:
+        """
+        Returns an array holding the given value for every cell.
+        """
+        return np.full(self.size, value, dtype=object)
+
+    def errors(self, error_type: CellErrorType, detail: str) -> np.ndarray:
+        """
+        Returns an array holding a new error for every cell.
+        """
+        return _array((CellError(error_type, detail) for _ in range(self.size)),
+                      self.size)
+
+
+def _array(values, size: int) -> np.ndarray:
+    """
+    Returns an array holding the given number of values as Python objects.
+    """
+    return np.fromiter(values, dtype=object, count=size)
+
+
+def is_vectorizable(template: FormulaTemplate) -> bool:
+    """
+    Returns whether the given formula template can be evaluated for many cells
+    at once, which is the case if every node in it has a vectorized form.
+    """
+    if template.vectorizable is None:
+        template.vectorizable = all(subtree.data in VECTORIZERS
+                                    for subtree in template.tree.iter_subtrees())
+    return template.vectorizable
+
+
+def evaluate_run(template: FormulaTemplate, workbook, sheet, locations) -> list:
+    """
+    Evaluates the given formula template for each of the given locations on
+    the given sheet, none of which may read any of the others. Returns the
+    value of each cell.
+    """
+    if not is_vectorizable(template):
+        raise ValueError("Formula template cannot be vectorized")
+    numeric = workbook.numeric
+    vectorized = template.vectorized.get(numeric.name)
+    if vectorized is None:
+        anchor = None if template.anchor is None else location_coords(template.anchor)
+        vectorized = vectorize_tree(template.tree, anchor, number_arrays(numeric))
+        template.vectorized[numeric.name] = vectorized
+    values = vectorized(_Run(workbook, sheet, locations))
+    return [numeric.zero if value is None else value for value in values]
+
+
+def vectorize_tree(tree, anchor, arrays: NumberArrays) -> Callable:
+    """
+    Translates a parse tree into a function of a run of cells, returning an
+    array of the values of the tree in each cell. If the column and row
+    numbers of an anchor are given, relative references are resolved as
+    offsets from the anchor. Numbers are operated on with the given array
+    operations.
+    """
+    return VECTORIZERS[tree.data](tree, anchor, arrays)
+
+
+def _vectorize_constant(tree, anchor, arrays) -> Callable:
+    """
+    Vectorizes a number, string or boolean node, whose value is the same in
+    every cell.
+    """
+    if tree.data == "bool":
+        value = tree.children[0].upper() == "TRUE"
+    elif tree.data == "number":
+        numeric = arrays.numeric
+        value = numeric.process_num(numeric.parse(tree.children[0]))
+    else:
+        value = Evaluator.string(None, tree)
+    return lambda run: run.full(value)
+
+
+def _vectorize_parens(tree, anchor, arrays) -> Callable:
+    """
+    Vectorizes a parentheses node.
+    """
+    inner = vectorize_tree(tree.children[0], anchor, arrays)
+    return lambda run: arrays.process_num(inner(run))
+
+
+def _vectorize_cell(tree, anchor, arrays) -> Callable:
+    """
+    Vectorizes a cell reference, reading the referenced cell of every cell in
+    the run. References to a sheet which does not exist are errors.
+    """
+    ref = tree.children[-1].value.upper()
+    index = ref.replace("$", "")
+    if not check_valid_location(index):
+        return lambda run: run.errors(CellErrorType.BAD_REFERENCE,
+                                      f"Invalid cell location {index}")
+    abs_col, _, abs_row, _ = CELL_TOKEN.fullmatch(ref).groups()
+    col_num, row_num = location_coords(index)
+    if anchor is None:
+        abs_col = abs_row = "$"
+    else:
+        col_offset, row_offset = col_num - anchor[0], row_num - anchor[1]
+    sheet_name = (tree.children[0].value.strip('\'"').lower()
+                  if len(tree.children) == 2 else None)
+
+    def cell(run):
+        if sheet_name is None:
+            sheet = run.sheet
+        elif sheet_name in run.workbook.sheets:
+            sheet = run.workbook.sheets[sheet_name]
+        else:
+            return run.errors(CellErrorType.BAD_REFERENCE, "No such sheet")
+        if abs_col and abs_row:
+            return run.full(sheet.get_cell_value(index))
+        cols = run.cols + col_offset if not abs_col else np.full(run.size, col_num)
+        rows = run.rows + row_offset if not abs_row else np.full(run.size, row_num)
+        return _array(map(sheet.get_cell_value,
+                          map(location_from_coords, cols.tolist(), rows.tolist())),
+                      run.size)
+    return cell
+
+
+def _vectorize_add(tree, anchor, arrays) -> Callable:
+    """
+    Vectorizes an addition or subtraction.
+    """
+    left, operator, right = tree.children
+    left, right = (vectorize_tree(child, anchor, arrays) for child in (left, right))
+    if operator not in ("+", "-"):
+        raise ValueError("Invalid operator")
+    operation = np.subtract if operator == "-" else np.add
+    return lambda run: arithmetic(arrays, operation, left(run), right(run))
+
+
+def _vectorize_mul(tree, anchor, arrays) -> Callable:
+    """
+    Vectorizes a multiplication or division.
+    """
+    left, operator, right = tree.children
+    left, right = (vectorize_tree(child, anchor, arrays) for child in (left, right))
+    if operator not in ("*", "/"):
+        raise ValueError("Invalid operator")
+    operation = divide if operator == "/" else np.multiply
+    return lambda run: arithmetic(arrays, operation, left(run), right(run))
+
+
+def _vectorize_unary(tree, anchor, arrays) -> Callable:
+    """
+    Vectorizes a unary plus or minus.
+    """
+    operator, operand = tree.children
+    operand = vectorize_tree(operand, anchor, arrays)
+    if operator not in ("+", "-"):
+        raise ValueError("Invalid operator")
+    negate = operator == "-"
+
+    def unary(run):
+        values, errors = arrays.numbers(operand(run))
+        if negate:
+            values = values.copy()
+            valid = slice(None) if errors is None else ~errors
+            values[valid] = -values[valid]
+        return arrays.process_num(values)
+    return unary
+
+
+def _vectorize_concat(tree, anchor, arrays) -> Callable:
+    """
+    Vectorizes a string concatenation.
+    """
+    left, right = (vectorize_tree(child, anchor, arrays) for child in tree.children)
+    return lambda run: _concat(left(run), right(run))
+
+
+def _vectorize_comp(tree, anchor, arrays) -> Callable:
+    """
+    Vectorizes a comparison. Arrays of numbers are compared directly, and any
+    other values are compared one cell at a time.
+    """
+    left, operator, right = tree.children
+    left, right = (vectorize_tree(child, anchor, arrays) for child in (left, right))
+    test = COMPARISONS[operator]
+    vector_test = VECTOR_COMPARISONS[operator]
+    compare = np.frompyfunc(lambda val1, val2: compare_values(val1, val2, test),
+                            2, 1)
+
+    def comp(run):
+        val1 = left(run)
+        val2 = right(run)
+        if arrays.all_numbers(val1) and arrays.all_numbers(val2):
+            return arrays.compare(vector_test, val1, val2)
+        return compare(val1, val2)
+    return comp
+
+
+# Vectorizers for each kind of node which can be vectorized
+VECTORIZERS = {
+    "number": _vectorize_constant,
+    "string": _vectorize_constant,
+    "bool": _vectorize_constant,
+    "parens": _vectorize_parens,
+    "cell": _vectorize_cell,
+    "add_expr": _vectorize_add,
+    "mul_expr": _vectorize_mul,
+    "unary_op": _vectorize_unary,
+    "concat_expr": _vectorize_concat,
+    "comp_expr": _vectorize_comp,
+}
@@ -8,27 +8,92 @@ evaluation of formulas.
 
 from typing import List, Tuple, Optional, Callable, TextIO
 from copy import deepcopy
-from decimal import Decimal
 import json
 import re
+import weakref
 from functools import total_ordering
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappop, heappush
 
-from .regexp import find_refs, find_refs_absolute, has_eval_dep
+from .regexp import find_refs, find_refs_absolute, find_ranges
 from .spreadsheet import (Spreadsheet, check_valid_location, get_column_label,
                             get_row_number, column_label_to_number,
-                            get_column_label_from_number)
-from .cell import CellType, cached_parse
-from .evaluator import cached_evaluators
+                            get_column_label_from_number, location_coords,
+                            location_from_coords)
+from .cell import CellType, FORMULA_CACHE, FormulaCacheInfo
+from .evaluator import Evaluator, NUMERIC_MODES
+from .compiler import compile_template
 from .error_types import CellErrorType, CellError, rev_error_dict
 from .regexp import VALID_SHEET_NAME
 from.ci_graph import CellInteractionGraph
-from .func_dir import FuncDir
+from .func_dir import FuncDir, FunctionCacheInfo, MEMO_SIZE
+from .aggregates import RangeAggregate
+from .lookups import ValueIndex
+from .ranges import (RangeStates, RangeValue, is_range, range_bounds,
+                     range_from_bounds, range_name)
+from .arrays import ArrayValue, array_shape, may_spill
+from .vectorize import evaluate_run, is_vectorizable, MIN_VECTOR_RUN
+from .parallel import (evaluate_cells, is_parallel_safe, MIN_PARALLEL_LEVEL,
+                       CHUNKS_PER_WORKER)
 
 # Define the maximum row and column values
 MAX_ROW = 9999
 MAX_COLUMN = column_label_to_number('ZZZZ')
 #functions that have evaluation time dependencies
-EVAL_TIME_DEP_FUNCS = {"=IF", "=IFERROR", "=CHOOSE", "=INDIRECT"}
+EVAL_TIME_DEP_FUNCS = {"IF", "IFERROR", "CHOOSE", "INDIRECT", "AND", "OR"}
+# Tokens of a formula which matter when finding the arguments of its function
+# calls: strings and quoted sheet names, which may hold any characters, names
+# and the calls they start, and any other runs of characters
+_CALL_TOKENS = re.compile(r'"[^"]*"|\'[^\']*\'|([A-Za-z][A-Za-z0-9_.]*)(\s*\()?|'
+                          r'[^"\'A-Za-z(),]+|.', re.S)
+
+
+def _skip_dynamic_args(contents: str) -> str:
+    """
+    Returns the formula with every argument after the first of each call to a
+    function with evaluation time dependencies removed, wherever the call is
+    nested, so that only the references which are always read are left.
+    """
+    if "(" not in contents:
+        return contents
+    kept = []
+    # Whether each open parenthesis starts the arguments of such a function,
+    # and the number of open calls whose first argument has ended
+    calls = []
+    skipping = 0
+    for token in _CALL_TOKENS.finditer(contents):
+        text = token.group(0)
+        if token.group(2) is not None or text == "(":
+            calls.append(token.group(2) is not None and
+                         token.group(1).upper() in EVAL_TIME_DEP_FUNCS)
+        elif text == ")" and calls:
+            if calls.pop() is None:
+                skipping -= 1
+        elif text == "," and calls and calls[-1]:
+            # Later arguments of the call are skipped until it closes
+            calls[-1] = None
+            skipping += 1
+            continue
+        if not skipping:
+            kept.append(text)
+    return "".join(kept)
+
+
+def _same_value(old, new) -> bool:
+    """
+    Returns whether a recomputed cell value is the same as the previous one,
+    so that cells depending on it do not need to be updated. Values of
+    different types are never the same, even if they compare equal, and
+    errors are the same if they have the same type and detail.
+    """
+    if type(old) is not type(new):
+        return False
+    if isinstance(old, CellError):
+        return (old.get_type() == new.get_type() and
+                old.get_detail() == new.get_detail())
+    return old == new
+
 
 class Workbook():
     """
@@ -38,12 +103,71 @@ class Workbook():
         sheets (dict): A dictionary mapping sheet names to Spreadsheet objects.
     """
 
-    def __init__(self):
+    def __init__(self, lazy: bool = False, workers: Optional[int] = None,
+                 numeric: str = "decimal"):
+        """
+        Initializes an empty workbook. In lazy mode, changing a cell only marks
+        the cells depending on it as dirty, and dirty cells are recomputed when
+        their values are read. Notification functions still see every change,
+        since dirty cells are brought up to date before they are called.
+
+        If a number of workers is given, wide recalculations are spread across
+        a pool of that many processes, which is started on first use and shut
+        down when the workbook is closed or garbage collected.
+
+        Numbers are exact Decimals by default. With numeric="float" they are
+        binary floats instead, which is much faster where exact decimal
+        arithmetic is not needed. Any other numeric mode raises a ValueError.
+        """
+        if numeric not in NUMERIC_MODES:
+            raise ValueError(f"Unknown numeric mode {numeric}.")
+        self.numeric = NUMERIC_MODES[numeric]
         self.sheets = {}
+        # The cell table of each sheet by its lowercase name, which compiled
+        # formulas read cells from directly
+        self._cell_tables = {}
         self.interaction_graph = CellInteractionGraph()
         self._notifs = []
         self.sheet_order = []
         self.func_dir = FuncDir()
+        # The running aggregates of the ranges read by aggregate functions,
+        # and the indexes of the rows and columns searched by lookups
+        number_type = self.numeric.number_type
+        self._aggregates = RangeStates(
+            lambda location, items: RangeAggregate(number_type, items))
+        self._lookups = RangeStates(ValueIndex)
+        self._lazy = lazy
+        # In lazy mode, cells which may be out of date, and the dirty cells
+        # which must be recomputed because their contents or the value of one
+        # of their dependencies changed
+        self._dirty = set()
+        self._seeds = set()
+        self._demanding = False
+        # Number of open batches, and the cells whose values changed in them
+        self._batch_depth = 0
+        self._batch_changed = set()
+        self._workers = workers
+        self._pool = None
+        # Shuts the pool down once, when the workbook is closed or collected
+        self._pool_finalizer = None
+        # Evaluators which are not evaluating a cell, reused for each formula
+        # so that none are kept per cell
+        self._evaluators = []
+        # Formula cells whose spilled arrays may have been blocked or unblocked
+        # by changes to other cells, and the values of spilled cells before
+        # they were first changed by the latest update
+        self._spill_changes = set()
+        self._spilled_values = {}
+
+    def close(self) -> None:
+        """
+        Shuts down the process pool of the workbook, if it was started, and
+        waits for its workers to exit. The workbook can still be used, and
+        starts a new pool if it needs one.
+        """
+        if self._pool_finalizer is not None:
+            self._pool_finalizer()
+        self._pool = self._pool_finalizer = None
 
     def num_sheets(self) -> int:
         """
@@ -56,8 +180,109 @@ class Workbook():
         Registers a function to be called whenever a cell is changed. The 
         function should return an iterable of cells that have changed.
         """
+        # Changes made before the function was registered are not reported
+        if self._dirty:
+            self._demand()
         self._notifs.append(notify_function)
 
+    def register_function(self, name: str, fn: Callable, pure: bool = True,
+                          min_args: int = 0, max_args: Optional[int] = None,
+                          arg_types=None, memo_size: int = MEMO_SIZE) -> None:
+        """
+        Registers a Python function which formulas in the workbook can call by
+        the given case-insensitive name, replacing any function registered
+        with that name before. Cells already calling the name are updated.
+
+        Arguments are converted to the types in arg_types, a dict of str,
+        Decimal, float or bool types by argument index, or a list of the types
+        of the first arguments, and calls with fewer than min_args or more than
+        max_args arguments are a type error. The result may be a number,
+        string, boolean or None. The first error among the arguments is the
+        result of the call without calling the function, and an exception it
+        raises is a type error.
+
+        A pure function must always give the same result for the same
+        arguments, so the results of up to memo_size calls are kept and
+        reused for calls with the same converted arguments.
+
+        Raises a ValueError if the name is invalid or is the name of a default
+        function, or the requirements are invalid, and a TypeError if the
+        function is not callable.
+        """
+        func_name = self.func_dir.register(name, fn, pure, min_args, max_args,
+                                           arg_types, memo_size)
+        # Templates are shared, so each is only searched once
+        calls = {}
+        callers = set()
+        for sheet_key, cell_table in self._cell_tables.items():
+            for location, cell in cell_table.items():
+                template = cell.template
+                if template is None:
+                    continue
+                if template not in calls:
+                    calls[template] = any(
+                        function.children[0].upper() == func_name
+                        for function in template.tree.find_data("function"))
+                if calls[template]:
+                    callers.add((sheet_key, location))
+        self.update_cells(callers, set())
+
+    def function_cache_info(self, name: str) -> Optional[FunctionCacheInfo]:
+        """
+        Returns the hits, misses and evictions of the memo of the registered
+        pure function with the given name, along with its maximum and current
+        size, or None if the function is not pure. Raises a KeyError if there
+        is no function with the name.
+        """
+        return self.func_dir.cache_info(name)
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups the edits made inside the with block, so cells are recalculated
+        and notification functions are called once when the outermost batch
+        ends, rather than after every edit. Values read inside the batch are
+        brought up to date as they are read.
+        """
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def begin(self) -> None:
+        """
+        Starts a batch of edits, which ends at the matching call to commit.
+        Batches may be nested.
+        """
+        self._batch_depth += 1
+
+    def commit(self) -> None:
+        """
+        Ends a batch of edits. When the outermost batch ends, the cells changed
+        in it are recalculated and notification functions are called once with
+        every cell whose value changed. If no batch was started, a ValueError
+        is raised.
+        """
+        if self._batch_depth == 0:
+            raise ValueError("No batch in progress.")
+        self._batch_depth -= 1
+        if self._batch_depth > 0:
+            return
+        # In lazy mode cells are only recalculated if they will be reported
+        if not self._lazy:
+            changed_val_cells = self._level_update(self._seeds)
+            if changed_val_cells is not None:
+                self._batch_changed.update(changed_val_cells)
+                self._dirty = set()
+                self._seeds = set()
+        if not self._lazy or self._notifs:
+            self._batch_changed.update(self._demand())
+        changed_val_cells = {cell_name for cell_name in self._batch_changed
+                             if cell_name[0] in self.sheets}
+        self._batch_changed = set()
+        self._notify(changed_val_cells)
+
     def list_sheets(self) -> list:
         """
         Returns a list of the sheet names in the workbook.
@@ -116,14 +341,16 @@ class Workbook():
                 raise ValueError(f'Sheet name {sheet_name} is invalid or not unique.')
 
         # Create a new Spreadsheet object and add to the sheets dictionary
-        new_sheet = Spreadsheet(sheet_name)
+        new_sheet = Spreadsheet(sheet_name, self.numeric)
         self.sheets[sheet_name.lower()] = new_sheet
+        self._cell_tables[sheet_name.lower()] = new_sheet.cell_table()
 
         # Append the new Spreadsheet object to the sheet_order list
         self.sheet_order.append(new_sheet)
 
-        # Update cells if necessary
-        self.update_cells(set(), set())
+        # Update any cells which referenced the sheet before it existed
+        self.update_cells(self.interaction_graph.cells_in_sheet(sheet_name),
+                          set())
 
         # Return the index and name of the new sheet
         return len(self.sheet_order) - 1, new_sheet.display_name
@@ -144,7 +371,10 @@ class Workbook():
             raise KeyError(f"Sheet '{sheet_name}' not found.")
 
         # Remove the sheet from the sheets dictionary
+        for states in (self._aggregates, self._lookups):
+            states.forget_sheet(self.sheets[lower_sheet_name])
         del self.sheets[lower_sheet_name]
+        del self._cell_tables[lower_sheet_name]
 
         # Find and remove the corresponding Spreadsheet object from sheet_order
         sheet_to_remove = None
@@ -157,16 +387,14 @@ class Workbook():
             self.sheet_order.remove(sheet_to_remove)
 
         # Collect those cells which were deleted and lived in the dependency
-        # graph and remove them from the graph
-        to_remove = []
-        for cell in self.interaction_graph.get_cells():
-            if cell[0] == sheet_name.lower():
-                to_remove.append(cell)
-        for cell in to_remove:
-            self.interaction_graph.remove_cell(cell)
+        # graph and remove the formula cells from the graph
+        deleted_cells = self.interaction_graph.cells_in_sheet(lower_sheet_name)
+        for cell in deleted_cells:
+            if self.interaction_graph.has_cell(cell):
+                self.interaction_graph.remove_cell(cell)
 
-        # Update any cells whose values may have changed
-        self.update_cells(set(), set())
+        # Update any cells which referenced the deleted cells
+        self.update_cells(deleted_cells, set())
 
     def rename_sheet(self, sheet_name: str, new_sheet_name: str) -> None:
         """
@@ -188,12 +416,24 @@ class Workbook():
         sheet.display_name = new_sheet_name
         self.sheets[new_sheet_name.lower()] = sheet
         del self.sheets[sheet_name.lower()]
+        self._cell_tables[new_sheet_name.lower()] = self._cell_tables.pop(
+            sheet_name.lower())
 
         # Use the reference graph to update all cells that reference the sheet
         self.interaction_graph.rename_sheet(self, sheet_name, new_sheet_name)
-
-        # Update the cells in the graph in case a rename has repaired a bad ref
-        self.update_cells(set(), set())
+        if self._dirty or self._batch_changed:
+            renamed = lambda cell: ((new_sheet_name.lower(), cell[1])
+                                    if cell[0] == sheet_name.lower() else cell)
+            self._dirty = {renamed(cell) for cell in self._dirty}
+            self._seeds = {renamed(cell) for cell in self._seeds}
+            self._batch_changed = {renamed(cell) for cell in self._batch_changed}
+
+        # Update the cells in the graph in case a rename has repaired a bad ref.
+        # The renamed cells keep their values, so the cells referencing the new
+        # name are updated along with them rather than only if a value changed
+        renamed_cells = set(self.interaction_graph.cells_in_sheet(new_sheet_name))
+        self.update_cells(renamed_cells | self._graph_dependents(renamed_cells),
+                          set())
 
     def move_sheet(self, sheet_name: str, index: int) -> None:
         """Move the specified sheet to the specified index in the workbook's ordered 
@@ -246,28 +486,32 @@ class Workbook():
         copied_sheet = deepcopy(original_sheet)
         copied_sheet.display_name = copy_name
         self.sheets[copy_name.lower()] = copied_sheet
+        self._cell_tables[copy_name.lower()] = copied_sheet.cell_table()
         self.sheet_order.append(copied_sheet)
 
         changed_cells  = set()
 
+        # Arrays are spilled again when the formulas of the copy are evaluated
+        for location in copied_sheet.get_cells():
+            if copied_sheet.get_cell_type(location) == CellType.SPILL:
+                copied_sheet.remove_spill(location)
+
         # Add all populated cells in the copied sheet to the interaction graph
         for cell in copied_sheet.get_cells():
             changed_cells.add((copy_name.lower(), cell.upper()))
             cell_obj = copied_sheet.get_cell(cell)
             if cell_obj.get_type() == CellType.FORMULA:
                 self.interaction_graph.set_cell((copy_name.lower(), cell))
-                dependencies = find_refs(cell_obj.get_content())
-                for dep in dependencies[1]:
-                    self.interaction_graph.add_dependency((copy_name.lower(),
-                                                            cell), (dep[0].lower(),
-                                                                    dep[1].upper()))
-                for dep in dependencies[0]:
+                for dep in self._static_dependencies(copy_name,
+                                                     cell_obj.get_content()):
                     self.interaction_graph.add_dependency((copy_name.lower(),
-                                                            cell), (copy_name.lower(),
-                                                                    dep.upper()))
+                                                            cell), dep)
 
-        # Update the cells in the graph in case a rename has repaired a bad ref
-        self.update_cells(changed_cells, changed_cells)
+        # Update the cells in the graph in case the copy has repaired a bad ref.
+        # The copied cells may keep the values they had, so the cells
+        # referencing the copy are updated along with them
+        self.update_cells(changed_cells | self._graph_dependents(changed_cells),
+                          changed_cells)
 
         return len(self.sheet_order) - 1, copy_name
 
@@ -289,16 +533,19 @@ class Workbook():
         reevaluate the workbook.
         """
         # If the cell was previously a formula, we need to remove it from the
-        # interaction graph
+        # interaction graph, along with any array it spilled
+        cell_name = (sheet_name.lower(), location.upper())
         if self.get_cell_type(sheet_name, location) == CellType.FORMULA:
-            self.interaction_graph.remove_cell((sheet_name.lower(),
-                                                 location.upper()))
+            if self.interaction_graph.get_spill(cell_name) is not None:
+                self._spill(cell_name, None, None, None, self._spill_changes.update)
+            self.interaction_graph.remove_cell(cell_name)
 
-        # Create a set to keep track of changed cells
+        # Create a set to keep track of changed cells. The stored value is read
+        # directly, so a dirty cell is not recomputed just to be replaced.
         changed_cells = set()
-        prev_val = self.get_cell_value(sheet_name, location)
-
         spreadsheet = self.get_sheet(sheet_name)
+        prev_val = spreadsheet[location.upper()]
+
         spreadsheet.set_cell_contents(location.upper(), contents)
 
         if spreadsheet.get_cell_type(location.upper()) == CellType.FORMULA:
@@ -308,31 +555,38 @@ class Workbook():
             self.interaction_graph.set_cell((sheet_name.lower(),
                                             location.upper()))
 
-            # for functions with eval time dependencies (IF, IFERROR, CHOOSE, INDIRECT)
-            # we only want to add the static dependencies
-            if cell.get_content().split("(")[0].upper() in EVAL_TIME_DEP_FUNCS:
-                # for all these functions, the static dependencies will be the first arg
-                # cut off everything except first arg to be fed into regex
-                contents = contents.split(",")[0]
-            # Use regexps to find all static references in the formula
-            inds, refs = find_refs(contents)
-
             # Add all visited locations to cell ref graph
-            for ind in inds:
+            for dep in self._static_dependencies(cell.sheet.display_name,
+                                                 contents):
                 self.interaction_graph.add_dependency((sheet_name.lower(),
-                                                        location.upper()),
-                                                        (cell.sheet.display_name.lower(),
-                                                        ind.upper()))
-            for ref in refs:
-                self.interaction_graph.add_dependency((sheet_name.lower(),
-                                                        location.upper()),
-                                                        (ref[0].lower(),
-                                                        ref[1].upper()))
+                                                        location.upper()), dep)
         # If the value of the cell has changed, add to set of changed cells
-        if prev_val != self.get_cell_value(sheet_name, location):
+        if prev_val != spreadsheet[location.upper()]:
             changed_cells.add((sheet_name.lower(), location.upper()))
+        # Arrays spilling over the cell may be blocked or unblocked by it
+        self._spill_changes.update(self.interaction_graph.spill_anchors(*cell_name))
         return changed_cells
 
+    @staticmethod
+    def _static_dependencies(sheet_name: str, contents: str) -> list:
+        """
+        Uses regexps to find all static references in the given formula on the
+        given sheet, returning the names of the cells and ranges it references.
+        Ranges are found first, so the cells at their corners are not also
+        found as references of their own. Functions with evaluation time
+        dependencies (IF, IFERROR, CHOOSE, INDIRECT, and the lazy AND and OR)
+        only read their later arguments as they are evaluated, so only their
+        first arguments are searched.
+        """
+        ranges, contents = find_ranges(_skip_dynamic_args(contents))
+        inds, refs = find_refs(contents)
+        dependencies = [(sheet_name.lower(), ind.upper()) for ind in inds]
+        dependencies += [(ref[0].lower(), ref[1].upper()) for ref in refs]
+        for sheet, start, end in ranges:
+            dependencies.append(((sheet or sheet_name).lower(),
+                                 range_name(start, end)))
+        return dependencies
+
     def set_cell_contents(self, sheet_name: str, location: str,
                           contents: str) -> None:
         """
@@ -355,8 +609,83 @@ class Workbook():
         Returns the value of the specified cell on the specified sheet.
         """
         spreadsheet = self.get_sheet(sheet_name)
+        # Reads made while dirty cells are being recomputed see the stored
+        # value, and the reading cell is recomputed once the cell is updated
+        if self._dirty and not self._demanding:
+            cell_name = (sheet_name.lower(), location.upper())
+            # Arrays spilled over the cell are brought up to date with it
+            dirty = [dirty_cell for dirty_cell in
+                     [cell_name] + self.interaction_graph.spill_anchors(*cell_name)
+                     if dirty_cell in self._dirty]
+            if dirty:
+                self._demand(dirty)
         return spreadsheet[location.upper()]
 
+    def cell_value_at(self, cell_name: Tuple[str, str]):
+        """
+        Returns the value of the cell with the given lowercase sheet name and
+        uppercase location, which are not checked, raising a KeyError if the
+        sheet does not exist. Used by compiled formulas, whose references are
+        resolved when they are compiled.
+        """
+        cells = self._cell_tables[cell_name[0]]
+        if self._dirty and not self._demanding and cell_name in self._dirty:
+            self._demand([cell_name])
+        cell = cells.get(cell_name[1])
+        return None if cell is None else cell.get_value()
+
+    def cell_values_at(self, sheet_name: str, locations: list) -> list:
+        """
+        Returns the values of the populated cells at the given locations on
+        the sheet with the given lowercase name. Any of the cells which are
+        dirty are brought up to date together before they are read.
+        """
+        cells = self._cell_tables[sheet_name]
+        if self._dirty and not self._demanding:
+            dirty = [(sheet_name, location) for location in locations
+                     if (sheet_name, location) in self._dirty]
+            if dirty:
+                self._demand(dirty)
+        return [cells[location].get_value() for location in locations]
+
+    def range_value(self, cell_name: Tuple[str, str]) -> RangeValue:
+        """
+        Returns the value of the range with the given lowercase sheet name and
+        location, raising a KeyError if the sheet does not exist. The values of
+        its cells are only read as the range is iterated.
+        """
+        if cell_name[0] not in self._cell_tables:
+            raise KeyError(cell_name[0])
+        return RangeValue(self, cell_name[0], cell_name[1])
+
+    def _range_state(self, states: RangeStates, range_value: RangeValue):
+        """
+        Returns the state kept in the given states for the given range. Any
+        dirty formula cells inside the range are brought up to date first, so
+        the state has seen their current values.
+        """
+        if self._dirty and not self._demanding:
+            dirty = [cell_name for cell_name in
+                     self.interaction_graph.get_formulas_in(range_value.sheet,
+                                                            range_value.location)
+                     if cell_name in self._dirty]
+            if dirty:
+                self._demand(dirty)
+        return states.get(self.sheets[range_value.sheet], range_value.location,
+                          range_value.items)
+
+    def range_aggregate(self, range_value: RangeValue) -> RangeAggregate:
+        """
+        Returns the running aggregate of the numbers in the given range.
+        """
+        return self._range_state(self._aggregates, range_value)
+
+    def lookup_index(self, range_value: RangeValue) -> ValueIndex:
+        """
+        Returns the index of the values in the given range.
+        """
+        return self._range_state(self._lookups, range_value)
+
     def get_cell_type(self, sheet_name: str, location: str) -> Optional[str]:
         """
         Returns the type of the specified cell on the specified sheet.
@@ -370,75 +699,598 @@ class Workbook():
     def update_cells(self, changed_cont_cells, changed_val_cells) -> None:
         """
         This method is called any time when the value of cells may have 
-        changed and all cells need to be updated accordingly.
-        """
-        # list of edges added at evaluation time to be removed after evaluation
-        eval_time_edges = set()
-        # this flag will be set to false once we don't observe any changes in the graph
-        # i.e. no new edges are added at evaluation time
-
-        continue_tarjan_and_eval = True
-        num_while = 0
-        while continue_tarjan_and_eval:
-            num_while += 1
-            #flag will be set to true if we add any new edges at evaluation time
-            continue_tarjan_and_eval = False
-
-        # Use Tarjans algorithm to compute ordering and check for cycles
-            topo_order, nodes_in_cycle, scc_nodes = self.interaction_graph.tarjan()
-            # This flag indicates whether we have found the first node in the
-            # topological ordering which needs to be updated
-            # Update cells in topological order
-            found_first = False
-            for cell_name in topo_order:
-
-                # Try to find the specified cell
-                try:
-                    loc = cell_name[0]
-                    index = cell_name[1]
-                    cell = self.get_sheet(loc).get_cell(index.upper())
+        changed and cells need to be updated accordingly. Cells are updated in
+        a single pass over the topological order of the interaction graph,
+        starting from the changed cells. The dependents of a cell are only
+        reevaluated if its value actually changed.
+
+        The cells read by each evaluation are kept as its dynamic dependencies.
+        If an evaluation reads a cell which has yet to be updated, or closes a
+        cycle, the cell is scheduled again at its new position in the order.
+
+        In lazy mode, or inside a batch, the changed cells and their dependents
+        are only marked as dirty, unless there are notification functions to
+        call outside of a batch.
+        """
+        graph = self.interaction_graph
+        spill_changes, self._spill_changes = self._spill_changes, set()
+        if self._lazy or self._batch_depth > 0:
+            self._mark_dirty(set(changed_cont_cells) | graph.pop_cycle_changes() |
+                             spill_changes)
+            if self._batch_depth > 0:
+                self._batch_changed.update(changed_val_cells)
+            elif self._notifs:
+                changed_val_cells.update(self._demand())
+                self._notify(changed_val_cells)
+            else:
+                # Formulas which may spill are evaluated as they are set, so
+                # the cells they spill into are known to depend on them
+                spilling = [cell_name for cell_name in changed_cont_cells
+                            if cell_name in self._dirty and self._may_spill(cell_name)]
+                if spilling:
+                    self._demand(spilling)
+            return
+
+        seeds = set(changed_cont_cells) | graph.pop_cycle_changes() | spill_changes
+        changed = self._level_update(seeds)
+        if changed is not None:
+            changed_val_cells.update(changed)
+            self._notify(changed_val_cells)
+            return
+        # The cycle changes were already taken from the graph
+        changed_cont_cells = seeds
+
+        pending = set()
+        heap = []
+
+        def schedule(cells) -> None:
+            for cell_name in cells:
+                if cell_name not in pending:
+                    pending.add(cell_name)
+                    heappush(heap, (graph.get_order_key(cell_name), cell_name))
+
+        schedule(changed_cont_cells)
+        schedule(graph.pop_cycle_changes())
+        # Values of the updated cells before this update
+        prev_values = {}
+        # Cells in a cycle whose dynamic dependencies have already been dropped
+        retried = set()
+
+        while heap:
+            cell_name = self._next_cell(heap, pending)
+            if cell_name is None:
+                continue
+            cell = self._find_cell(cell_name)
+            # Cells which were not evaluated had their contents changed, so
+            # their dependents are always updated
+            if cell is None or (cell.get_type() != CellType.FORMULA and
+                                not graph.in_cycle(cell_name)):
+                schedule(graph.get_dependents(cell_name))
+                continue
+            prev_values.setdefault(cell_name, cell.get_value())
+            # Early cutoff: only update the dependents if the value changed
+            if self._recompute(cell_name, cell, pending.__contains__, schedule,
+                               retried):
+                schedule(graph.get_dependents(cell_name))
+
+        changed_val_cells.update(self._changed_since(prev_values))
+        self._notify(changed_val_cells)
+
+    def _level_update(self, seeds) -> Optional[set]:
+        """
+        Updates the cells depending on the given changed cells one level at a
+        time, where each level only depends on the levels before it. Wide levels
+        are evaluated on the process pool, and cells of a level sharing a
+        formula template are evaluated together as arrays. Returns the cells
+        whose values changed, or None without updating anything if the update
+        is too small for either, or an affected cell is in a cycle or may read
+        cells outside of its static references.
+        """
+        graph = self.interaction_graph
+        affected = graph.get_affected(seeds)
+        cells = {}
+        for cell_name in affected:
+            cell = self._find_cell(cell_name)
+            if cell is not None and cell.get_type() == CellType.FORMULA:
+                if (graph.in_cycle(cell_name) or
+                        not is_parallel_safe(cell.template)):
+                    return None
+                cells[cell_name] = cell
+        if not (self._workers and len(cells) >= MIN_PARALLEL_LEVEL or
+                len(cells) >= MIN_VECTOR_RUN and self._has_vector_runs(cells)):
+            return None
+        dependencies = {cell_name: graph.get_dependencies(cell_name)
+                        for cell_name in affected}
+
+        # Group the formula cells into levels by their longest path from a
+        # changed cell
+        depth = {}
+        levels = []
+        for cell_name in graph.ordered(affected):
+            depth[cell_name] = max((depth[dep] + 1 for dep in
+                                    dependencies[cell_name]
+                                    if dep in depth), default=0)
+            if cell_name in cells:
+                while len(levels) <= depth[cell_name]:
+                    levels.append([])
+                levels[depth[cell_name]].append(cell_name)
+
+        # Cells whose values changed, starting with the changed non-formulas
+        changed = set(seeds).difference(cells)
+        prev_values = {}
+        # Dirty cells left over from a batch are only read, never recomputed,
+        # since the levels already visit every cell which must be updated
+        self._demanding = True
+        try:
+            self._update_levels(levels, cells, dependencies, seeds, changed,
+                                prev_values)
+        finally:
+            self._demanding = False
+        return self._changed_since(prev_values)
+
+    def _update_levels(self, levels, cells, dependencies, seeds, changed,
+                       prev_values) -> None:
+        """
+        Evaluates the given levels of formula cells in order, adding the cells
+        whose values changed to changed and recording their previous values.
+        """
+        for level in levels:
+            # Early cutoff: only cells with a changed dependency are evaluated
+            to_eval = [cell_name for cell_name in level if cell_name in seeds or
+                       any(dep in changed for dep in
+                           dependencies[cell_name])]
+            results = []
+            for (sheet, template), run in self._template_runs(to_eval, cells).items():
+                if len(run) >= MIN_VECTOR_RUN:
+                    values = evaluate_run(template, self, sheet,
+                                          [cell_name[1] for cell_name in run])
+                    results.extend(zip(run, values))
+            vectorized = {cell_name for cell_name, _ in results}
+            to_eval = [cell_name for cell_name in to_eval
+                       if cell_name not in vectorized]
+            if self._workers and len(to_eval) >= MIN_PARALLEL_LEVEL:
+                results.extend(self._evaluate_on_pool(to_eval, cells))
+            else:
+                for cell_name in to_eval:
+                    val, _ = self._evaluate(cells[cell_name])
+                    results.append((cell_name, val))
+            for cell_name, val in results:
+                cell = cells[cell_name]
+                prev_values[cell_name] = cell.get_value()
+                cell.set_value(val)
+                if not _same_value(prev_values[cell_name], val):
+                    changed.add(cell_name)
+
+    def _has_vector_runs(self, cells) -> bool:
+        """
+        Returns whether enough of the given formula cells share a template, and
+        do not read each other, to be worth evaluating as arrays. Cells filled
+        with a formula reading the cell before them, such as =A1+1, each end up
+        on their own level, so they are only evaluated one cell at a time.
+        """
+        graph = self.interaction_graph
+        for run in self._template_runs(cells, cells).values():
+            if len(run) < MIN_VECTOR_RUN:
+                continue
+            members = set(run)
+            independent = dependent = 0
+            for cell_name in run:
+                if members.isdisjoint(graph.get_dependencies(cell_name)):
+                    independent += 1
+                    if independent >= MIN_VECTOR_RUN:
+                        return True
+                else:
+                    dependent += 1
+                    if dependent >= MIN_VECTOR_RUN:
+                        break
+        return False
 
-                # If fails, then cell doesn't exist
-                except KeyError:
-                    continue
+    @staticmethod
+    def _template_runs(cell_names, cells) -> dict:
+        """
+        Groups the given formula cells of a level by their sheet and formula
+        template, keeping only templates which can be evaluated as arrays.
+        """
+        runs = {}
+        for cell_name in cell_names:
+            cell = cells[cell_name]
+            if is_vectorizable(cell.template):
+                runs.setdefault((cell.sheet, cell.template), []).append(cell_name)
+        return runs
+
+    def _evaluate_on_pool(self, cell_names, cells) -> list:
+        """
+        Evaluates the given formula cells on the process pool, shipping each
+        batch of cells with the values of the cells they read. Returns the name
+        and value of each cell.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+            # The finalizer holds the pool but not the workbook, so dropping
+            # the workbook still collects it and shuts the pool down
+            self._pool_finalizer = weakref.finalize(self, self._pool.shutdown)
+        sheet_names = frozenset(self.sheets)
+        num_chunks = self._workers * CHUNKS_PER_WORKER
+        chunk_size = -(-len(cell_names) // num_chunks)
+        payloads = []
+        for start in range(0, len(cell_names), chunk_size):
+            values = {}
+            batch = []
+            for cell_name in cell_names[start:start + chunk_size]:
+                cell = cells[cell_name]
+                for dep in self.interaction_graph.get_dependencies(cell_name):
+                    dep_cell = self._find_cell(dep)
+                    values[dep] = None if dep_cell is None else dep_cell.get_value()
+                batch.append((cell_name, cell.sheet.display_name,
+                              cell.get_content()))
+            payloads.append((sheet_names, self.numeric.name, values, batch))
+        results = []
+        for chunk_results in self._pool.map(evaluate_cells, payloads):
+            results.extend(chunk_results)
+        return results
+
+    def _graph_dependents(self, cells) -> set:
+        """
+        Returns the cells in the interaction graph which depend directly on
+        any of the given cells.
+        """
+        return {dependent for cell_name in cells
+                for dependent in self.interaction_graph.get_dependents(cell_name)}
 
-                prev_value = cell.get_value() if cell is not None else None
-                eval_deps = has_eval_dep(cell.get_content()) if cell is not None else False
+    def _mark_dirty(self, cells) -> list:
+        """
+        Marks cells as needing to be recomputed in lazy mode, and marks every
+        cell depending on them as dirty. The given cells may have gained
+        dependents since they were marked dirty, such as a cell inside a range
+        which is first read after the cell changed, so their dependents are
+        always searched, but other cells which are already dirty already have
+        dirty dependents, so are not searched again. Returns the cells which
+        became dirty.
+        """
+        self._seeds.update(cells)
+        # Ranges do not depend on the cells inside them which are not formulas,
+        # so the ranges covering those cells are changed along with them
+        self._seeds.update(self.interaction_graph.get_covering_ranges(cells))
+        marked = [cell for cell in cells if cell not in self._dirty]
+        self._dirty.update(marked)
+        to_visit = list(cells)
+        while to_visit:
+            for dependent in self.interaction_graph.get_dependents(to_visit.pop()):
+                if dependent not in self._dirty:
+                    self._dirty.add(dependent)
+                    marked.append(dependent)
+                    to_visit.append(dependent)
+        return marked
+
+    def _demand(self, cells=None) -> set:
+        """
+        Brings the given cells up to date in lazy mode, or every dirty cell if
+        no cells are given. Only the dirty cells which the given cells depend
+        on are visited, in topological order, and of those only the ones whose
+        contents or dependencies changed are recomputed. If an evaluation reads
+        a dirty cell outside of those, the cell and its dirty dependencies are
+        added to the pass. Returns the cells whose values changed.
+        """
+        graph = self.interaction_graph
+        # The dirty cells which the given cells depend on
+        scope = set()
+        pending = set()
+        heap = []
+
+        def include(cells) -> None:
+            to_visit = list(cells)
+            scope.update(to_visit)
+            while to_visit:
+                cell_name = to_visit.pop()
+                if cell_name not in pending:
+                    pending.add(cell_name)
+                    heappush(heap, (graph.get_order_key(cell_name), cell_name))
+                # A range or spilled cell may have been added after the cells it
+                # depends on were marked dirty, so they are searched even if
+                # they are clean
+                for dep in graph.get_dependencies(cell_name):
+                    if ((dep in self._dirty or is_range(dep[1]) or
+                         graph.is_spilled(dep)) and dep not in scope):
+                        scope.add(dep)
+                        to_visit.append(dep)
+
+        def schedule(cells) -> None:
+            marked = self._mark_dirty(cells)
+            if flush:
+                include(marked)
+            # Cells in the pass which were marked dirty again, such as a range
+            # in a cycle, are visited again so that none are left dirty
+            include([cell_name for cell_name in list(cells) + marked
+                     if cell_name in scope])
+
+        flush = cells is None
+        include(self._dirty if flush else
+                [cell_name for cell_name in cells if cell_name in self._dirty])
+        prev_values = {}
+        retried = set()
+        self._demanding = True
+        try:
+            while heap:
+                cell_name = self._next_cell(heap, pending)
+                if cell_name is None:
+                    continue
+                self._dirty.discard(cell_name)
+                # None of the cell's dependencies changed, so it is up to date
+                if cell_name not in self._seeds:
+                    continue
+                self._seeds.discard(cell_name)
+                cell = self._find_cell(cell_name)
+                if cell is None or (cell.get_type() != CellType.FORMULA and
+                                    not graph.in_cycle(cell_name)):
+                    schedule(graph.get_dependents(cell_name))
+                    continue
+                prev_values.setdefault(cell_name, cell.get_value())
+                outdated = lambda dep: dep in pending or dep in self._dirty
+                if self._recompute(cell_name, cell, outdated, schedule, retried):
+                    schedule(graph.get_dependents(cell_name))
+        finally:
+            self._demanding = False
+        changed_val_cells = self._changed_since(prev_values)
+        if self._batch_depth > 0:
+            self._batch_changed.update(changed_val_cells)
+        return changed_val_cells
+
+    def _next_cell(self, heap, pending) -> Optional[Tuple[str, str]]:
+        """
+        Pops the next cell to update from the heap of scheduled cells, and
+        returns it if it can be updated now. Returns None if the entry was
+        stale, or if the cell was put back to wait for its dependencies.
+        """
+        graph = self.interaction_graph
+        key, cell_name = heappop(heap)
+        if cell_name not in pending:
+            return None
+        # The cell may have moved since it was scheduled
+        if key != graph.get_order_key(cell_name):
+            heappush(heap, (graph.get_order_key(cell_name), cell_name))
+            return None
+        # Cells moved earlier by new dependencies may still be scheduled at
+        # their old positions, so any which this cell depends on go first
+        if not graph.in_cycle(cell_name):
+            waiting = [dep for dep in graph.get_dependencies(cell_name)
+                       if dep in pending]
+            if waiting:
+                for dep in waiting + [cell_name]:
+                    heappush(heap, (graph.get_order_key(dep), dep))
+                return None
+        pending.discard(cell_name)
+        return cell_name
+
+    def _find_cell(self, cell_name: Tuple[str, str]):
+        """
+        Returns the cell object at the given location, or None if the cell or
+        its sheet does not exist, or the location is a range.
+        """
+        try:
+            return self.get_sheet(cell_name[0]).get_cell(cell_name[1].upper())
+        except (KeyError, ValueError):
+            return None
 
-                found_first = (found_first or len(changed_cont_cells) == 0
-                           or cell_name in changed_cont_cells or
-                           eval_deps)
+    def _recompute(self, cell_name, cell, outdated, schedule, retried) -> bool:
+        """
+        Recomputes the value of a formula cell or a cell in a cycle, passing
+        any cells which must be updated again to schedule. The cell is updated
+        again if it read a cell for which outdated returns True. Returns
+        whether the value of the cell changed.
+        """
+        graph = self.interaction_graph
+        prev_value = cell.get_value()
+        spilled = False
+
+        # If cell is part of a cycle, set value to CIRCREF error. A cycle
+        # through dynamic dependencies may be left over from an earlier
+        # evaluation, so those are dropped and the cycle is reevaluated once
+        # before it is reported.
+        if graph.in_cycle(cell_name):
+            component = graph.get_component(cell_name)
+            if (not retried.issuperset(component) and
+                    any(graph.has_dynamic_dependencies(member)
+                        for member in component)):
+                for member in component:
+                    # Dropping the dynamic dependencies of a member may drop a
+                    # range which only it read
+                    if graph.has_dynamic_dependencies(member):
+                        graph.set_dynamic_dependencies(member, ())
+                retried.update(component)
+                schedule(component)
+                schedule(graph.pop_cycle_changes())
+                return False
+            error = CellError(CellErrorType.CIRCULAR_REFERENCE, "Cycle Detected")
+            # A formula evaluating to an array fills the block it spills into
+            # with the error, as found from the formula rather than from what
+            # it was last evaluated to, unless the block is not empty. A
+            # blocked block no longer depends on the formula, which may break
+            # the cycle.
+            if cell.get_type() == CellType.FORMULA:
+                shape = array_shape(cell.template, cell_name[1])
+                spilled = self._set_formula_value(
+                    cell_name, cell,
+                    error if shape in (None, (1, 1)) else ArrayValue.full(shape, error),
+                    schedule)
+                schedule(graph.pop_cycle_changes())
+            else:
+                # A spilled cell may already hold the error its formula filled
+                # it with, which the cells reading it have not seen
+                spilled = True
+            cell.set_value(error)
+
+        # Otherwise the cell is a formula, so evaluate it
+        else:
+            val, eval_dependencies = self._evaluate(cell)
+            spilled = self._set_formula_value(cell_name, cell, val, schedule)
+            added = graph.set_dynamic_dependencies(cell_name, eval_dependencies)
+            # A range or spilled cell read for the first time is outdated if a
+            # cell it depends on is
+            added += [member for dep in added
+                      if is_range(dep[1]) or graph.is_spilled(dep)
+                      for member in graph.get_dependencies(dep)]
+            if graph.in_cycle(cell_name) or any(outdated(dep) for dep in added):
+                schedule([cell_name])
+            schedule(graph.pop_cycle_changes())
+
+        return spilled or not _same_value(prev_value, cell.get_value())
+
+    def _set_formula_value(self, cell_name, cell, value, schedule) -> bool:
+        """
+        Sets the value of a formula cell. An array is spilled into the block of
+        cells whose top left cell is the formula cell, which holds the first
+        value of the array, unless the block goes past the edge of the sheet or
+        another of its cells is populated, in which case the value of the
+        formula cell is an error. Cells affected by a change to the block are
+        passed to schedule. Returns whether any spilled value changed.
+        """
+        area = filled = values = None
+        if isinstance(value, ArrayValue):
+            rows, cols = value.shape
+            col, row = location_coords(cell_name[1])
+            if col + cols - 1 > MAX_COLUMN or row + rows - 1 > MAX_ROW:
+                value = CellError(CellErrorType.BAD_REFERENCE,
+                                  "Spill range is out of bounds.")
+            else:
+                if rows * cols > 1:
+                    area = range_from_bounds(col, row, col + cols - 1, row + rows - 1)
+                if area is not None and self._spill_blocked(cell_name, area):
+                    value = CellError(CellErrorType.BAD_REFERENCE,
+                                      "Spill range is not empty.")
+                else:
+                    filled, values = area, value.values.tolist()
+                    value = values[0][0]
+                    if value is None:
+                        value = self.numeric.zero
+        cell.set_value(value)
+        if area is None and self.interaction_graph.get_spill(cell_name) is None:
+            return False
+        return self._spill(cell_name, area, filled, values, schedule)
 
-                # If cell indicated as head of cycle or in and scc, set value to CIRCREF error
-                if cell_name in nodes_in_cycle or cell_name in scc_nodes:
-                    cell.set_value(CellError(CellErrorType.CIRCULAR_REFERENCE,
-                                            "Cycle Detected"))
-                    found_first = True
+    def _may_spill(self, cell_name) -> bool:
+        """
+        Returns whether the cell with the given name is a formula which may
+        evaluate to an array.
+        """
+        cell = self._find_cell(cell_name)
+        return (cell is not None and cell.get_type() == CellType.FORMULA and
+                may_spill(cell.template))
 
-                # If cell is a formula, evaluate
-                else:
-                    # Only update if cells before in topo order are changed
-                    if not cell is None:
-                        if found_first:
-                            if cell.get_type() == CellType.FORMULA:
-                                evaluator = cached_evaluators(self, cell.sheet, cell)
-                                val = evaluator.visit(cached_parse(cell.get_content()))
-                                if val is None:
-                                    val = Decimal(0)
-                                cell.set_value(val)
-                                # if the evaluator has new eval time
-                                # dependencies, we need to continue
-                                if len(evaluator.get_eval_dependencies()) > 0:
-                                    eval_time_edges.update(
-                                        evaluator.get_eval_dependencies())
-                                    evaluator.reset_eval_dependencies()
-                                    continue_tarjan_and_eval = True
-
-                # If the value of the cell has changed, add to set of changed cells
-                if cell is not None and prev_value != cell.get_value():
-                    changed_val_cells.add((loc, index))
-
-        # Call all registered notification functions on the updated cells
+    def _spill_blocked(self, cell_name, area: str) -> bool:
+        """
+        Returns whether any cell in the given area other than the formula cell
+        with the given name, and the cells it spilled into, is populated.
+        """
+        sheet_key, anchor = cell_name
+        cells = self._cell_tables[sheet_key]
+        for location in self.sheets[sheet_key].locations_in(*range_bounds(area)):
+            cell = cells[location]
+            if location != anchor and (cell.get_type() != CellType.SPILL or
+                                       cell.anchor != anchor):
+                return True
+        return False
+
+    def _spill(self, cell_name, area, filled, values, schedule) -> bool:
+        """
+        Records the area a formula cell spills an array into, which is None if
+        its value is not an array, and fills the cells of the filled area other
+        than the formula cell from the given rows of values. The filled area
+        is None if nothing is spilled. The cells spilled into before which are
+        outside of the filled area are emptied. The formula cells whose spills
+        may be blocked or unblocked by the cells filled or emptied, and the
+        cells and ranges which no longer read the array, are passed to
+        schedule. Returns whether any spilled value changed.
+        """
+        graph = self.interaction_graph
+        sheet_key, anchor = cell_name
+        sheet = self.sheets[sheet_key]
+        cells = self._cell_tables[sheet_key]
+        old = graph.get_spill(cell_name)
+        emptied = set()
+        if old is not None and old[1] is not None:
+            left, top, right, bottom = range_bounds(old[1])
+            emptied = {location_from_coords(col, row)
+                       for row in range(top, bottom + 1)
+                       for col in range(left, right + 1)}
+        # Whether any cells were populated or emptied
+        moved = False
+        changed = False
+        if filled is not None:
+            left, top, _, _ = range_bounds(filled)
+            for row_offset, row_values in enumerate(values):
+                for col_offset, value in enumerate(row_values):
+                    location = location_from_coords(left + col_offset,
+                                                    top + row_offset)
+                    if location == anchor:
+                        continue
+                    if value is None:
+                        value = self.numeric.zero
+                    emptied.discard(location)
+                    spilled = cells.get(location)
+                    if spilled is None:
+                        moved = True
+                        prev_value = None
+                    elif _same_value(spilled.get_value(), value):
+                        continue
+                    else:
+                        prev_value = spilled.get_value()
+                    self._spilled_values.setdefault((sheet_key, location), prev_value)
+                    sheet.set_spill_value(location, value, anchor)
+                    changed = True
+        for location in emptied:
+            spilled = cells.get(location)
+            # Cells written over the array since it spilled are kept
+            if spilled is None or spilled.get_type() != CellType.SPILL:
+                continue
+            moved = True
+            self._spilled_values.setdefault((sheet_key, location),
+                                            spilled.get_value())
+            sheet.remove_spill(location)
+            changed = True
+        if moved:
+            # The other spills over the old or new filled area are checked again
+            for other_area in {old[1] if old is not None else None, filled} - {None}:
+                schedule([other for other in graph.spill_anchors(sheet_key, other_area)
+                          if other != cell_name])
+        schedule(graph.set_spill(cell_name, area, filled))
+        return changed
+
+    def _evaluate(self, cell) -> tuple:
+        """
+        Evaluates the given formula cell with an evaluator from the pool of
+        this workbook, returning its value and the set of cells it read. Reads
+        may evaluate other cells, which take another evaluator from the pool.
+        """
+        evaluator = self._evaluators.pop() if self._evaluators else Evaluator(self, None)
+        try:
+            evaluator.bind(cell)
+            val = compile_template(cell.template, self.numeric)(evaluator)
+            return (self.numeric.zero if val is None else val,
+                    evaluator.get_eval_dependencies())
+        finally:
+            self._evaluators.append(evaluator)
+
+    def _changed_since(self, prev_values) -> set:
+        """
+        Returns the cells whose values differ from the given previous values,
+        and the spilled cells whose values changed since this was last called.
+        Errors are compared by type and detail, since values computed on the
+        process pool are copies of the errors they propagate.
+        """
+        if self._spilled_values:
+            prev_values = {**prev_values, **self._spilled_values}
+            self._spilled_values = {}
+        changed = set()
+        for cell_name, prev_value in prev_values.items():
+            cell = self._find_cell(cell_name)
+            if not _same_value(prev_value, None if cell is None else cell.get_value()):
+                changed.add(cell_name)
+        return changed
+
+    def _notify(self, changed_val_cells) -> None:
+        """
+        Calls all registered notification functions on the changed cells.
+        """
         if len(changed_val_cells) > 0:
             for func in self._notifs:
                 try:
@@ -448,8 +1300,23 @@ class Workbook():
                 # the state of the workbook
                 except: # pylint: disable=bare-except
                     continue
-        for cell, dependency in eval_time_edges:
-            self.interaction_graph.remove_dependency(cell, dependency)
+
+    @staticmethod
+    def formula_cache_info() -> FormulaCacheInfo:
+        """
+        Returns the hits, misses and evictions of the formula cache shared by
+        every workbook in the process, along with its maximum and current size.
+        """
+        return FORMULA_CACHE.info()
+
+    @staticmethod
+    def set_formula_cache_size(maxsize: Optional[int]) -> None:
+        """
+        Sets the number of parsed formula templates kept by the formula cache
+        shared by every workbook in the process, or None for no limit. Raises a
+        ValueError if the size is negative.
+        """
+        FORMULA_CACHE.resize(maxsize)
 
     @staticmethod
     def load_workbook(fp: TextIO) -> 'Workbook':
@@ -482,7 +1349,7 @@ class Workbook():
         if not isinstance(json_data["sheets"], list):
             raise TypeError("Collection of sheets in workbook must be represented as json list")
         # Collect changed cells
-        changed_cells = set()
+        changed_cells, set_cells = set(), set()
         for sheet in json_data["sheets"]:
             # make sure its a dictionary
             if not isinstance(sheet, dict):
@@ -505,7 +1372,8 @@ class Workbook():
                 assert check_valid_location(location)
                 changed_cells.update(wb.set_content_helper(sheet["name"],
                                                            location.upper(), contents))
-        wb.update_cells(changed_cells, changed_cells)
+                set_cells.add((sheet["name"].lower(), location.upper()))
+        wb.update_cells(set_cells, changed_cells)
         return wb
 
     def save_workbook(self, fp: TextIO) -> None:
@@ -525,6 +1393,9 @@ class Workbook():
                 if not check_valid_location(location):
                     raise ValueError(f"Invalid cell location {location}")
                 cell = sheet.get_cell(location)
+                # Spilled arrays are saved as the formulas they spill from
+                if cell.get_type() == CellType.SPILL:
+                    continue
                 to_json["sheets"][-1]["cell-contents"][location.upper()] = cell.get_content()
         json.dump(to_json, fp)
 
@@ -835,6 +1706,7 @@ class Workbook():
                                                              cell_value))
 
         # Update formulas in sorted rows
+        formula_cells = set()
         for new_row_idx, sortable_row in enumerate(sorted_rows):
             original_row_idx = sortable_row.row_index
             for col_idx, cell_value in enumerate(sortable_row.row_data):
@@ -857,8 +1729,9 @@ class Workbook():
                         original_formula, row_offset, col_offset)
                     changed_cells.update(self.set_content_helper(
                         sheet_name, new_location, updated_formula))
+                    formula_cells.add((sheet_name.lower(), new_location.upper()))
 
-        self.update_cells(changed_cells, changed_cells)
+        self.update_cells(changed_cells | formula_cells, changed_cells)
 
 
 @total_ordering
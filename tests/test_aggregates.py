@@ -0,0 +1,138 @@
+"""
+Tests for the aggregate functions SUM, COUNT, AVERAGE, MIN and MAX, whose
+running state over a range is updated as the cells in the range change.
+"""
+
+import random
+from decimal import Decimal
+
+from sheets import Workbook, CellErrorType
+from sheets.aggregates import RangeAggregate
+from sheets.ranges import RangeValue
+
+
+def test_aggregate_functions():
+    """
+    Tests that the aggregate functions only read the numbers in a range, while
+    converting the arguments given directly.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    for location, contents in (("A1", "4"), ("A2", "'7"), ("A3", "TRUE"),
+                               ("A4", "-2.5"), ("B1", "=A1*3"), ("B2", "x")):
+        wb.set_cell_contents("sheet1", location, contents)
+    expected = {"SUM": Decimal("13.5"), "COUNT": Decimal(3),
+                "AVERAGE": Decimal("4.5"), "MIN": Decimal("-2.5"),
+                "MAX": Decimal(12)}
+    for func, value in expected.items():
+        wb.set_cell_contents("sheet1", "C1", f"={func}(A1:B4)")
+        assert wb.get_cell_value("sheet1", "C1") == value, func
+
+    wb.set_cell_contents("sheet1", "C1", "=COUNT(A1:B4, 1, \"2\", \"x\", D1)")
+    assert wb.get_cell_value("sheet1", "C1") == Decimal(5)
+    wb.set_cell_contents("sheet1", "C1", "=MIN(A1:B4, -10)")
+    assert wb.get_cell_value("sheet1", "C1") == Decimal(-10)
+    wb.set_cell_contents("sheet1", "C1", "=MAX(D1:D5)")
+    assert wb.get_cell_value("sheet1", "C1") == Decimal(0)
+    wb.set_cell_contents("sheet1", "C1", "=AVERAGE(D1:D5)")
+    assert wb.get_cell_value("sheet1", "C1").get_type() == \
+        CellErrorType.DIVIDE_BY_ZERO
+
+    # Errors in a range are reported, except by COUNT
+    wb.set_cell_contents("sheet1", "B2", "=1/0")
+    wb.set_cell_contents("sheet1", "C1", "=MAX(A1:B4)")
+    wb.set_cell_contents("sheet1", "C2", "=COUNT(A1:B4)")
+    assert wb.get_cell_value("sheet1", "C1").get_type() == \
+        CellErrorType.DIVIDE_BY_ZERO
+    assert wb.get_cell_value("sheet1", "C2") == Decimal(3)
+
+
+def test_aggregates_follow_changes():
+    """
+    Tests that the aggregates of a range stay equal to the aggregates of its
+    values as single cells in it change, including the smallest and largest
+    values being replaced and cells holding formulas.
+    """
+    rng = random.Random(21)
+    wb = Workbook()
+    wb.new_sheet()
+    funcs = ["SUM", "COUNT", "MIN", "MAX"]
+    for index, func in enumerate(funcs):
+        wb.set_cell_contents("sheet1", f"Z{index + 1}", f"={func}(A1:C20)")
+    values = {}
+    for _ in range(300):
+        location = f"{rng.choice('ABC')}{rng.randint(1, 20)}"
+        if rng.random() < 0.2:
+            wb.set_cell_contents("sheet1", location, None)
+            values.pop(location, None)
+        elif location != "A1" and rng.random() < 0.1:
+            wb.set_cell_contents("sheet1", location, "=A1 + 1")
+            values[location] = None
+        else:
+            value = rng.randint(-50, 50)
+            wb.set_cell_contents("sheet1", location, str(value))
+            values[location] = value
+        numbers = [wb.get_cell_value("sheet1", location) for location in values]
+        numbers = [number for number in numbers if isinstance(number, Decimal)]
+        expected = [sum(numbers), len(numbers), min(numbers, default=0),
+                    max(numbers, default=0)]
+        for index, value in enumerate(expected):
+            assert wb.get_cell_value("sheet1", f"Z{index + 1}") == value
+
+
+def test_float_sums_are_exact():
+    """
+    Tests that float sums are rounded once, so they do not depend on the order
+    in which values were added and removed.
+    """
+    wb = Workbook(numeric="float")
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "B1", "=SUM(A1:A3)")
+    for location, contents in (("A1", "0.1"), ("A2", "0.2"), ("A3", "0.3")):
+        wb.set_cell_contents("sheet1", location, contents)
+    assert wb.get_cell_value("sheet1", "B1") == 0.6
+    wb.set_cell_contents("sheet1", "A1", "100000000000000000000")
+    wb.set_cell_contents("sheet1", "A1", "0.1")
+    assert wb.get_cell_value("sheet1", "B1") == 0.6
+
+
+def test_range_aggregate_heaps():
+    """
+    Tests that the smallest and largest numbers of a range aggregate skip the
+    numbers which have been replaced.
+    """
+    aggregate = RangeAggregate(Decimal, [("A1", Decimal(1)), ("A2", Decimal(5)),
+                                         ("A3", "x"), ("A4", Decimal(5))])
+    assert (aggregate.count, aggregate.smallest(), aggregate.largest()) == \
+        (3, Decimal(1), Decimal(5))
+    aggregate.replace("A4", Decimal(5), None)
+    assert aggregate.largest() == Decimal(5)
+    aggregate.replace("A2", Decimal(5), Decimal(3))
+    aggregate.replace("A1", Decimal(1), "y")
+    assert (aggregate.count, aggregate.smallest(), aggregate.largest()) == \
+        (1, Decimal(3), Decimal(3))
+    assert aggregate.total() == Decimal(3)
+    aggregate.replace("A2", Decimal(3), None)
+    assert aggregate.smallest() is None and aggregate.total() == 0
+
+
+def test_ranges_read_once(monkeypatch):
+    """
+    Tests that a range is only read the first time it is aggregated, and that
+    changes to its cells are applied to its running aggregate afterwards.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    for row in range(1, 101):
+        wb.set_cell_contents("sheet1", f"A{row}", str(row))
+    wb.set_cell_contents("sheet1", "B1", "=SUM(A1:A100)")
+    wb.set_cell_contents("sheet1", "B2", "=MAX(A1:A100)")
+    assert wb.get_cell_value("sheet1", "B1") == Decimal(5050)
+
+    def fail(_):
+        raise AssertionError("range read again")
+    monkeypatch.setattr(RangeValue, "items", fail)
+    wb.set_cell_contents("sheet1", "A100", "1")
+    wb.set_cell_contents("sheet1", "A7", "=A1 * 1000")
+    assert wb.get_cell_value("sheet1", "B1") == Decimal(5944)
+    assert wb.get_cell_value("sheet1", "B2") == Decimal(1000)
@@ -0,0 +1,259 @@
+"""
+Tests for formulas which use ranges as values, the arrays they evaluate to,
+and the blocks of cells the arrays spill into.
+"""
+
+import io
+import json
+import random
+from decimal import Decimal
+
+from sheets import Workbook, CellErrorType
+
+
+def values(wb, locations, sheet="sheet1"):
+    """
+    Returns the values of the cells at the given locations.
+    """
+    return [wb.get_cell_value(sheet, location) for location in locations.split()]
+
+
+def test_array_operators():
+    """
+    Tests that operators apply elementwise to arrays, broadcasting them
+    against each other and against single values.
+    """
+    for numeric in ("decimal", "float"):
+        wb = Workbook(numeric=numeric)
+        wb.new_sheet()
+        for location, contents in (("A1", "1"), ("A2", "2"), ("B1", "3"),
+                                   ("B2", "'x"), ("D1", "10"), ("E1", "20")):
+            wb.set_cell_contents("sheet1", location, contents)
+        number = Decimal if numeric == "decimal" else float
+        expected = {
+            "=A1:A2 * 2": [number(2), number(4)],
+            "=A1:A2 + D1:E1": [number(11), number(21), number(12), number(22)],
+            "=-A1:A3": [number(-1), number(-2), number(0)],
+            "=A1:B1 / A1:B1": [number(1), number(1)],
+            '=A1:A2 & "!"': ["1!", "2!"],
+            "=A1:A3 >= 2": [False, True, False],
+            "=B1:B2 = \"X\"": [False, True],
+            "=(A1:A2 > 1) = TRUE": [False, True],
+        }
+        for formula, result in expected.items():
+            wb.set_cell_contents("sheet1", "G1", formula)
+            rows = [[wb.get_cell_value("sheet1", f"{col}{row}") for col in "GH"]
+                    for row in range(1, 4)]
+            found = [value for row in rows for value in row if value is not None]
+            assert found == result, formula
+            assert all(type(value) is type(expected_value)
+                       for value, expected_value in zip(found, result)), formula
+
+        wb.set_cell_contents("sheet1", "G1", "=A1:B2 * 2")
+        assert values(wb, "G1 H1 G2")[:3] == [number(2), number(6), number(4)]
+        assert wb.get_cell_value("sheet1", "H2").get_type() == CellErrorType.TYPE_ERROR
+        wb.set_cell_contents("sheet1", "G1", "=A1:A2 / (A1:A2 - 1)")
+        assert wb.get_cell_value("sheet1", "G1").get_type() == \
+            CellErrorType.DIVIDE_BY_ZERO
+        assert wb.get_cell_value("sheet1", "G2") == number(2)
+
+    for formula in ("=A1:A2 + A1:A3", "=SUM(A1:A2 * 2)", "=IF(A1:A2, 1)",
+                    "=A1:A2 < B1:D1 & C1:C3"):
+        wb.set_cell_contents("sheet1", "G1", formula)
+        assert wb.get_cell_value("sheet1", "G1").get_type() == \
+            CellErrorType.TYPE_ERROR, formula
+
+
+def test_spill_block():
+    """
+    Tests that an array spills into the block below and to the right of its
+    formula, which other formulas read, and that the block follows the array
+    as it changes size and is left empty while it is blocked.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    for row in range(1, 4):
+        wb.set_cell_contents("sheet1", f"A{row}", str(row))
+    wb.set_cell_contents("sheet1", "C1", "=A1:A3 * 10")
+    wb.set_cell_contents("sheet1", "E1", "=C3 + 1")
+    wb.set_cell_contents("sheet1", "E2", "=SUM(C2:C4)")
+    assert values(wb, "C1 C2 C3 C4 E1 E2") == [10, 20, 30, None, 31, 50]
+    assert wb.get_cell_contents("sheet1", "C2") is None
+    # The block is a single formula cell in the graph
+    assert sorted(wb.interaction_graph.get_cells()) == \
+        [("sheet1", "C1"), ("sheet1", "E1"), ("sheet1", "E2")]
+
+    wb.set_cell_contents("sheet1", "A3", "5")
+    assert values(wb, "C3 E1 E2") == [50, 51, 70]
+
+    # A populated cell blocks the spill until it is emptied
+    wb.set_cell_contents("sheet1", "C2", "x")
+    assert wb.get_cell_value("sheet1", "C1").get_type() == \
+        CellErrorType.BAD_REFERENCE
+    assert values(wb, "C2 C3 E1") == ["x", None, 1]
+    assert wb.get_cell_value("sheet1", "E2") == 0
+    wb.set_cell_contents("sheet1", "C2", None)
+    assert values(wb, "C1 C2 C3 E1 E2") == [10, 20, 50, 51, 70]
+    # Emptying a spilled cell leaves its value
+    wb.set_cell_contents("sheet1", "C3", None)
+    assert wb.get_cell_value("sheet1", "C3") == 50
+
+    wb.set_cell_contents("sheet1", "C1", "=A1:A4 * 10")
+    assert values(wb, "C4 E2") == [0, 70]
+    wb.set_cell_contents("sheet1", "C1", "=A1:A2 > 1")
+    assert values(wb, "C1 C2 C3 E1 E2") == [False, True, None, 1, 0]
+    wb.set_cell_contents("sheet1", "C1", None)
+    assert values(wb, "C1 C2 E1") == [None, None, 1]
+
+    # Spills may not leave the sheet or overlap each other
+    wb.set_cell_contents("sheet1", "C9999", "=A1:A2")
+    assert wb.get_cell_value("sheet1", "C9999").get_type() == \
+        CellErrorType.BAD_REFERENCE
+    wb.set_cell_contents("sheet1", "G1", "=A1:B2")
+    wb.set_cell_contents("sheet1", "H1", "=A1:A2")
+    assert wb.get_cell_value("sheet1", "G1").get_type() == \
+        CellErrorType.BAD_REFERENCE
+    assert values(wb, "H1 H2") == [1, 2]
+    wb.set_cell_contents("sheet1", "G5", "=A1:B2")
+    wb.set_cell_contents("sheet1", "H4", "=A1:A3")
+    assert wb.get_cell_value("sheet1", "H4").get_type() == \
+        CellErrorType.BAD_REFERENCE
+    assert values(wb, "G5 H5 H6") == [1, 0, 0]
+    wb.set_cell_contents("sheet1", "G5", "=A1")
+    assert values(wb, "G5 H4 H5 H6") == [1, 1, 2, 5]
+
+
+def test_spill_cycles():
+    """
+    Tests that a cycle through a spilled block makes the block and its formula
+    circular references, until the cycle is broken or the block is blocked.
+    """
+    for lazy in (False, True):
+        wb = Workbook(lazy=lazy)
+        wb.new_sheet()
+        wb.set_cell_contents("sheet1", "B1", "1")
+        wb.set_cell_contents("sheet1", "C1", "=A1:B2 * 2")
+        wb.set_cell_contents("sheet1", "A1", "=D2")
+        for location in ("A1", "C1", "D1", "D2"):
+            assert wb.get_cell_value("sheet1", location).get_type() == \
+                CellErrorType.CIRCULAR_REFERENCE, location
+        wb.set_cell_contents("sheet1", "A1", "5")
+        assert values(wb, "A1 C1 D1 C2 D2") == [5, 10, 2, 0, 0]
+
+        # A spill covering a range its formula reads is a cycle of its own
+        wb.set_cell_contents("sheet1", "F1", "=F2:F3 + 1")
+        assert wb.get_cell_value("sheet1", "F1").get_type() == \
+            CellErrorType.CIRCULAR_REFERENCE
+
+        # A value or formula written into a circular block blocks the spill,
+        # which breaks the cycle through the block
+        wb.set_cell_contents("sheet1", "H1", "=H2:H3 * 2")
+        wb.set_cell_contents("sheet1", "H3", "=I2")
+        wb.set_cell_contents("sheet1", "I1", "=H2:I4 + 1")
+        wb.set_cell_contents("sheet1", "H2", "5")
+        wb.set_cell_contents("sheet1", "I3", '="independent"')
+        for location in ("H1", "I1"):
+            assert wb.get_cell_value("sheet1", location).get_detail() == \
+                "Spill range is not empty.", location
+        assert values(wb, "H2 H3 I2 I3") == [5, 0, None, "independent"]
+
+        # A formula in a cycle fills the block it would spill into, whatever
+        # it was last evaluated to, so the values survive saving and loading
+        wb.set_cell_contents("sheet1", "K1", "=K4 + 1")
+        wb.set_cell_contents("sheet1", "K2", "=K1:L1 & K3")
+        wb.set_cell_contents("sheet1", "K3", "=K2")
+        wb.set_cell_contents("sheet1", "M1", "=L2")
+        saved = io.StringIO()
+        wb.save_workbook(saved)
+        saved.seek(0)
+        loaded = Workbook.load_workbook(saved)
+        assert wb.get_cell_value("sheet1", "K1") == 1
+        for location in ("K2", "L2", "K3", "M1"):
+            assert wb.get_cell_value("sheet1", location).get_type() == \
+                CellErrorType.CIRCULAR_REFERENCE, location
+        for row in range(1, 5):
+            for col in "ABCDEFGHIJKLM":
+                location = f"{col}{row}"
+                assert str(loaded.get_cell_value("sheet1", location)) == \
+                    str(wb.get_cell_value("sheet1", location)), location
+
+
+def test_spill_sheets():
+    """
+    Tests that spilled blocks follow renamed sheets, are spilled again in
+    copied sheets, and are saved as the formulas they spill from.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "1")
+    wb.set_cell_contents("sheet1", "A2", "2")
+    wb.set_cell_contents("sheet1", "B1", '=A1:A2 & "x"')
+    wb.set_cell_contents("sheet1", "C1", "=B2")
+    wb.rename_sheet("sheet1", "Main")
+    wb.set_cell_contents("main", "A2", "3")
+    assert values(wb, "B2 C1", "main") == ["3x", "3x"]
+    _, copy_name = wb.copy_sheet("main")
+    wb.set_cell_contents(copy_name, "A2", "4")
+    assert values(wb, "B2 C1", copy_name) == ["4x", "4x"]
+    assert values(wb, "B2 C1", "main") == ["3x", "3x"]
+
+    saved = io.StringIO()
+    wb.save_workbook(saved)
+    assert json.loads(saved.getvalue())["sheets"][0]["cell-contents"] == \
+        {"A1": "1", "A2": "3", "B1": '=A1:A2 & "x"', "C1": "=B2"}
+    saved.seek(0)
+    loaded = Workbook.load_workbook(saved)
+    assert values(loaded, "B2 C1", "main") == ["3x", "3x"]
+
+
+def test_spill_matches_copied_formulas():
+    """
+    Tests that a spilled formula gives the same values as the same formula
+    copied into every cell of the block, and that readers of the block see the
+    same values, in eager and lazy workbooks with notifications.
+    """
+    rng = random.Random(25)
+    for lazy in (False, True):
+        wb = Workbook(lazy=lazy)
+        wb.new_sheet()
+        notified = set()
+        wb.notify_cells_changed(lambda _, cells: notified.update(cells))
+        wb.set_cell_contents("sheet1", "E1", "=A1:B4 * C1 + 1")
+        for row in range(1, 5):
+            for col, source in zip("HI", "AB"):
+                wb.set_cell_contents("sheet1", f"{col}{row}",
+                                     f"={source}{row} * $C$1 + 1")
+        wb.set_cell_contents("sheet1", "K1", "=SUM(F1:F4) + E4")
+        wb.set_cell_contents("sheet1", "K2", "=SUM(I1:I4) + H4")
+        block = [f"{col}{row}" for col in "EF" for row in range(1, 5)]
+        for _ in range(120):
+            before = values(wb, " ".join(block))
+            notified.clear()
+            location = f"{rng.choice('ABC')}{rng.randint(1, 4)}"
+            wb.set_cell_contents("sheet1", location,
+                                 rng.choice([None, "1", "2.5", "x", "#DIV/0!"]))
+            if rng.random() < 0.2:
+                blocker = f"{rng.choice('EF')}{rng.randint(1, 4)}"
+                wb.set_cell_contents("sheet1", blocker, rng.choice([None, "7"]))
+            # Every cell of the block whose value changed was reported
+            for block_location, value in zip(block, values(wb, " ".join(block))):
+                if str(value) != str(before[block.index(block_location)]):
+                    assert ("sheet1", block_location) in notified, block_location
+            blocked = any(wb.get_cell_contents("sheet1", f"{col}{row}") is not None
+                          for col in "EF" for row in range(1, 5)
+                          if (col, row) != ("E", 1))
+            if blocked:
+                continue
+            for row in range(1, 5):
+                for col, copy in zip("EF", "HI"):
+                    spilled = wb.get_cell_value("sheet1", f"{col}{row}")
+                    expected = wb.get_cell_value("sheet1", f"{copy}{row}")
+                    if hasattr(expected, "get_type"):
+                        assert spilled.get_type() == expected.get_type()
+                    else:
+                        assert spilled == expected
+            spilled, expected = values(wb, "K1 K2")
+            if hasattr(expected, "get_type"):
+                assert spilled.get_type() == expected.get_type()
+            else:
+                assert spilled == expected
@@ -0,0 +1,342 @@
+"""
+Tests for the cell interaction graph used by the workbook to track the
+dependencies between formula cells.
+"""
+
+import random
+
+from sheets import Workbook, CellError, CellErrorType
+from sheets.ci_graph import CellInteractionGraph
+
+
+def test_reverse_index():
+    """
+    Tests that the reverse dependency index is kept in sync with the graph as
+    dependencies and cells are added and removed.
+    """
+    graph = CellInteractionGraph()
+    graph.set_cell(("sheet1", "A1"))
+    graph.add_dependency(("sheet1", "A1"), ("sheet1", "B1"))
+    graph.add_dependency(("sheet1", "A1"), ("sheet1", "B1"))
+    graph.set_cell(("sheet1", "A2"))
+    graph.add_dependency(("sheet1", "A2"), ("sheet1", "B1"))
+    assert sorted(graph.get_dependents(("sheet1", "B1"))) == [("sheet1", "A1"),
+                                                              ("sheet1", "A1"),
+                                                              ("sheet1", "A2")]
+    graph.remove_dependency(("sheet1", "A1"), ("sheet1", "B1"))
+    assert sorted(graph.get_dependents(("sheet1", "B1"))) == [("sheet1", "A1"),
+                                                              ("sheet1", "A2")]
+    graph.remove_cell(("sheet1", "A1"))
+    assert graph.get_dependents(("sheet1", "B1")) == [("sheet1", "A2")]
+    # Resetting a cell drops its previous dependencies
+    graph.set_cell(("sheet1", "A2"))
+    assert graph.get_dependents(("sheet1", "B1")) == []
+
+
+def test_affected_cells():
+    """
+    Tests that only the transitive dependents of a changed cell are reported as
+    affected.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "1")
+    wb.set_cell_contents("sheet1", "A2", "=A1+1")
+    wb.set_cell_contents("sheet1", "A3", "=A2+1")
+    wb.set_cell_contents("sheet1", "B1", "2")
+    wb.set_cell_contents("sheet1", "B2", "=B1+1")
+    graph = wb.interaction_graph
+    assert graph.get_affected({("sheet1", "A1")}) == {("sheet1", "A1"),
+                                                      ("sheet1", "A2"),
+                                                      ("sheet1", "A3")}
+    assert graph.get_affected({("sheet1", "B1")}) == {("sheet1", "B1"),
+                                                      ("sheet1", "B2")}
+    wb.set_cell_contents("sheet1", "A1", "5")
+    assert wb.get_cell_value("sheet1", "A3") == 7
+    assert wb.get_cell_value("sheet1", "B2") == 3
+
+
+def test_sheet_operations_update_dependents():
+    """
+    Tests that creating, renaming and deleting sheets updates the cells which
+    reference them.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "=Other!A1 + 1")
+    wb.new_sheet("Other")
+    wb.set_cell_contents("other", "A1", "4")
+    assert wb.get_cell_value("sheet1", "A1") == 5
+    wb.rename_sheet("Other", "Renamed")
+    assert wb.get_cell_contents("sheet1", "A1") == "=Renamed!A1 + 1"
+    assert wb.get_cell_value("sheet1", "A1") == 5
+    wb.del_sheet("Renamed")
+    assert isinstance(wb.get_cell_value("sheet1", "A1"), CellError)
+    assert wb.get_cell_value("sheet1", "A1").get_type() == CellErrorType.BAD_REFERENCE
+
+
+def check_order(graph):
+    """
+    Checks that the topological order maintained by the graph is consistent
+    with its edges, and that its cycles match those found by Tarjan.
+    """
+    cells = set(graph.get_cells())
+    for cell in graph.get_cells():
+        cells.update(graph.get_dependencies(cell))
+    position = {cell: index for index, cell in enumerate(graph.ordered(cells))}
+    for cell in graph.get_cells():
+        component = graph.get_component(cell)
+        # Cells in a cycle share a position, so they must be contiguous
+        indices = sorted(position[member] for member in component)
+        assert indices == list(range(indices[0], indices[0] + len(component)))
+        for dependency in graph.get_dependencies(cell):
+            if dependency not in component:
+                assert position[dependency] < position[cell]
+    cyclic = set()
+    for component in graph.tarjan():
+        if len(component) > 1 or component[0] in graph.get_dependencies(component[0]):
+            cyclic.update(component)
+            assert set(graph.get_component(component[0])) == set(component)
+    assert cyclic == {cell for cell in cells if graph.in_cycle(cell)}
+
+
+def test_random_order_maintenance():
+    """
+    Tests that the topological order and cycles stay correct over a random
+    sequence of edits to the graph.
+    """
+    rng = random.Random(130)
+    cells = [("sheet1", f"A{i}") for i in range(1, 16)]
+    for _ in range(20):
+        graph = CellInteractionGraph()
+        for _ in range(150):
+            cell = rng.choice(cells)
+            action = rng.random()
+            if action < 0.15 and graph.has_cell(cell):
+                graph.remove_cell(cell)
+            elif action < 0.3 and graph.get_dependencies(cell):
+                graph.remove_dependency(cell, rng.choice(graph.get_dependencies(cell)))
+            elif action < 0.4:
+                graph.set_cell(cell)
+            else:
+                if not graph.has_cell(cell):
+                    graph.set_cell(cell)
+                graph.add_dependency(cell, rng.choice(cells))
+            check_order(graph)
+
+
+def test_local_cycle_changes():
+    """
+    Tests that making and breaking a cycle only changes the components of the
+    cells on it, leaving other cycles in the workbook untouched.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    for row in range(1, 51):
+        wb.set_cell_contents("sheet1", f"A{row}", f"=B{row}")
+        wb.set_cell_contents("sheet1", f"B{row}", f"=A{row}")
+    graph = wb.interaction_graph
+    other = graph.get_component(("sheet1", "A1"))
+
+    wb.set_cell_contents("sheet1", "C1", "=D1 + 1")
+    wb.set_cell_contents("sheet1", "D1", "=E1 + 1")
+    wb.set_cell_contents("sheet1", "E1", "=C1 + 1")
+    assert set(graph.get_component(("sheet1", "C1"))) == {("sheet1", "C1"),
+                                                 ("sheet1", "D1"),
+                                                 ("sheet1", "E1")}
+    assert wb.get_cell_value("sheet1", "D1").get_type() == CellErrorType.CIRCULAR_REFERENCE
+
+    wb.set_cell_contents("sheet1", "E1", "1")
+    assert not graph.in_cycle(("sheet1", "C1"))
+    assert not graph.in_cycle(("sheet1", "D1"))
+    assert wb.get_cell_value("sheet1", "C1") == 3
+    assert graph.get_component(("sheet1", "A1")) == other
+    check_order(graph)
+
+
+def test_rename_onto_referenced_sheet():
+    """
+    Tests that renaming a sheet to a name already referenced by a formula
+    joins the references to the renamed cells.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "=Other!B1 + 1")
+    wb.new_sheet("Old")
+    wb.set_cell_contents("old", "B1", "5")
+    wb.set_cell_contents("old", "C1", "=Sheet1!A1")
+    wb.rename_sheet("Old", "Other")
+    graph = wb.interaction_graph
+    assert graph.get_dependents(("other", "B1")) == [("sheet1", "A1")]
+    assert wb.get_cell_value("other", "C1") == 6
+    wb.set_cell_contents("other", "B1", "7")
+    assert wb.get_cell_value("other", "C1") == 8
+    check_order(graph)
+
+
+def test_rename_onto_referenced_formula():
+    """
+    Tests that renaming or copying a sheet to a name already referenced by a
+    formula updates the formula when the cell it references holds a formula,
+    whose value is not changed by the rename or copy.
+    """
+    for lazy in (False, True):
+        wb = Workbook(lazy=lazy)
+        wb.new_sheet()
+        wb.set_cell_contents("sheet1", "A1", "=Other!B1 + 1")
+        wb.set_cell_contents("sheet1", "A2", "=Old_1!B1 + 1")
+        wb.new_sheet("Old")
+        wb.set_cell_contents("old", "B1", "=5")
+        wb.rename_sheet("Old", "Other")
+        assert wb.get_cell_value("sheet1", "A1") == 6
+        wb.rename_sheet("Other", "Old")
+        wb.copy_sheet("Old")
+        assert wb.get_cell_contents("sheet1", "A1") == "=Old!B1 + 1"
+        assert wb.get_cell_value("sheet1", "A2") == 6
+        check_order(wb.interaction_graph)
+
+
+def test_dynamic_dependencies():
+    """
+    Tests that the cells read while evaluating a conditional are kept as its
+    dependencies until a later evaluation reads different cells.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "TRUE")
+    wb.set_cell_contents("sheet1", "B1", "1")
+    wb.set_cell_contents("sheet1", "C1", "2")
+    wb.set_cell_contents("sheet1", "D1", "=IF(A1, B1, C1)")
+    graph = wb.interaction_graph
+    assert graph.get_dependents(("sheet1", "B1")) == [("sheet1", "D1")]
+    assert graph.get_dependents(("sheet1", "C1")) == []
+
+    # Editing a cell which was not read leaves the conditional alone
+    assert graph.get_affected({("sheet1", "C1")}) == {("sheet1", "C1")}
+    wb.set_cell_contents("sheet1", "A1", "FALSE")
+    assert wb.get_cell_value("sheet1", "D1") == 2
+    assert graph.get_dependents(("sheet1", "B1")) == []
+    assert graph.get_dependents(("sheet1", "C1")) == [("sheet1", "D1")]
+    wb.set_cell_contents("sheet1", "C1", "5")
+    assert wb.get_cell_value("sheet1", "D1") == 5
+
+
+def test_dynamic_cycle_is_reevaluated():
+    """
+    Tests that a cycle formed through a conditional is broken once the
+    conditional no longer reads the cells in the cycle.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "B1", "TRUE")
+    wb.set_cell_contents("sheet1", "A1", "=IF(B1, A2, 0)")
+    wb.set_cell_contents("sheet1", "A2", "=A1 + 1")
+    assert wb.get_cell_value("sheet1", "A1").get_type() == CellErrorType.CIRCULAR_REFERENCE
+    assert wb.get_cell_value("sheet1", "A2").get_type() == CellErrorType.CIRCULAR_REFERENCE
+    wb.set_cell_contents("sheet1", "B1", "FALSE")
+    assert wb.get_cell_value("sheet1", "A1") == 0
+    assert wb.get_cell_value("sheet1", "A2") == 1
+    assert not wb.interaction_graph.in_cycle(("sheet1", "A1"))
+
+
+def test_indirect_to_new_sheet():
+    """
+    Tests that an indirect reference to a missing sheet is updated when the
+    sheet is created.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", '=INDIRECT("Other!B2")')
+    assert wb.get_cell_value("sheet1", "A1").get_type() == CellErrorType.BAD_REFERENCE
+    wb.new_sheet("Other")
+    wb.set_cell_contents("other", "B2", "3")
+    assert wb.get_cell_value("sheet1", "A1") == 3
+
+
+def test_early_cutoff():
+    """
+    Tests that the dependents of a cell are not reevaluated when its value
+    does not change, but are when the type of the value changes.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "=1+1")
+    wb.set_cell_contents("sheet1", "B1", "=A1*2")
+    wb.set_cell_contents("sheet1", "C1", "=A1&\"\"")
+    # Mark the dependents so a reevaluation would be visible
+    wb.get_sheet("sheet1").get_cell("B1").set_value("untouched")
+    wb.set_cell_contents("sheet1", "A1", "=2")
+    assert wb.get_cell_value("sheet1", "B1") == "untouched"
+    wb.set_cell_contents("sheet1", "A1", "=1=1")
+    assert wb.get_cell_value("sheet1", "C1") == "TRUE"
+    wb.set_cell_contents("sheet1", "A1", "=1")
+    assert wb.get_cell_value("sheet1", "C1") == "1"
+
+
+def test_cutoff_after_cycle_breaks():
+    """
+    Tests that the cells of a broken cycle are reevaluated even if the cell
+    which broke it still evaluates to a circular reference error.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "Z1", "=Z2")
+    wb.set_cell_contents("sheet1", "Z2", "=Z1")
+    wb.set_cell_contents("sheet1", "A1", "=B1")
+    wb.set_cell_contents("sheet1", "B1", "=IFERROR(A1, 5)")
+    assert wb.get_cell_value("sheet1", "B1").get_type() == CellErrorType.CIRCULAR_REFERENCE
+    wb.set_cell_contents("sheet1", "A1", "=Z1")
+    assert wb.get_cell_value("sheet1", "A1").get_type() == CellErrorType.CIRCULAR_REFERENCE
+    assert wb.get_cell_value("sheet1", "B1") == 5
+
+
+def test_lazy_recalculation():
+    """
+    Tests that a lazy workbook only recomputes dirty cells when they are read,
+    and only the cells which the read cell depends on.
+    """
+    wb = Workbook(lazy=True)
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "1")
+    wb.set_cell_contents("sheet1", "A2", "=A1+1")
+    wb.set_cell_contents("sheet1", "B1", "=A1*10")
+    assert wb.get_cell_value("sheet1", "A2") == 2
+    assert wb.get_cell_value("sheet1", "B1") == 10
+
+    wb.set_cell_contents("sheet1", "A1", "5")
+    sheet = wb.get_sheet("sheet1")
+    # Nothing is recomputed until a dirty cell is read
+    assert sheet["A2"] == 2
+    assert wb.get_cell_value("sheet1", "A2") == 6
+    assert sheet["B1"] == 10
+    assert wb.get_cell_value("sheet1", "B1") == 50
+
+    # Cycles and conditionals are resolved on demand as well
+    wb.set_cell_contents("sheet1", "C1", "=IF(A1 > 3, C2, 0)")
+    wb.set_cell_contents("sheet1", "C2", "=C1")
+    assert wb.get_cell_value("sheet1", "C2").get_type() == CellErrorType.CIRCULAR_REFERENCE
+    wb.set_cell_contents("sheet1", "A1", "1")
+    assert wb.get_cell_value("sheet1", "C2") == 0
+
+
+def test_lazy_notifications():
+    """
+    Tests that a lazy workbook reports the same changed cells as an eager one
+    once a notification function is registered.
+    """
+    reported = []
+    for lazy in (False, True):
+        wb = Workbook(lazy=lazy)
+        wb.new_sheet()
+        wb.set_cell_contents("sheet1", "A1", "1")
+        wb.set_cell_contents("sheet1", "A2", "=A1+1")
+        changed = []
+        wb.notify_cells_changed(lambda _, cells, changed=changed:
+                                changed.append(set(cells)))
+        wb.set_cell_contents("sheet1", "A1", "2")
+        wb.set_cell_contents("sheet1", "A3", "=A2")
+        wb.set_cell_contents("sheet1", "A1", "=0+2")
+        reported.append(changed)
+    assert reported[0] == reported[1]
+    assert reported[1] == [{("sheet1", "A1"), ("sheet1", "A2")},
+                           {("sheet1", "A3")}]
@@ -0,0 +1,156 @@
+"""
+Tests that compiled formulas evaluate to the same values as the interpreter.
+"""
+
+from sheets.workbook import Workbook
+from sheets.cell import cached_parse, FORMULA_CACHE, FORMULA_CACHE_SIZE
+from sheets.compiler import compile_tree
+from sheets.evaluator import Evaluator
+from sheets.error_types import CellError, CellErrorType
+
+FORMULAS = [
+    "=A1+B1*2", "=-(A1-B1)/4", "=A1/0", "=B2&\"x\"&A1", "=A1 < B1",
+    "=\"abc\" = B3", "=A9 = 0", "=C1 + 1", "=#REF! + 1", "=Sheet2!A1 * 3",
+    "='Sheet2'!$A$1", "=Missing!A1", "=ZZZZZ1", "=IF(A1 > 1, B1, C1)",
+    "=IF(A1)", "=IF(FALSE, 1)", "=IFERROR(1/0)", "=IFERROR(1/0, B1)",
+    "=CHOOSE(2, A1, B1, C1)", "=CHOOSE(1.5, A1)", "=IFERROR()",
+    "=AND(TRUE, A1)", "=ISBLANK(A9)", "=ISERROR(C1)", "=NOSUCH(1)",
+    "=INDIRECT(\"Sheet2!A1\")", "=VERSION()", "=(1.50)", "=AND(B2, B3)",
+    "=AND(FALSE, C1)", "=OR(A1, C1)", "=OR(B3 = \"x\", A9, ZZZZZ1)", "=OR()",
+    "=SUM(A1:B2, 1)", "=SUM(Sheet2!A1:A2)", "=SUM(B1:A1, C1:C1)",
+    "=NOT(A1:B2)", "=SUM(Missing!A1:B2)",
+]
+
+
+def test_compiled_matches_interpreter():
+    """
+    Tests that compiled formulas give the same values, and read the same
+    cells, as the interpreter for each kind of node in the parse tree.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "3")
+    wb.set_cell_contents("sheet1", "B1", "4.5")
+    wb.set_cell_contents("sheet1", "B2", "TRUE")
+    wb.set_cell_contents("sheet1", "B3", "ABC")
+    wb.set_cell_contents("sheet1", "C1", "#DIV/0!")
+    wb.set_cell_contents("sheet2", "A1", "'7")
+    sheet = wb.get_sheet("sheet1")
+    for formula in FORMULAS:
+        interpreter = Evaluator(wb, sheet)
+        expected = interpreter.visit(cached_parse(formula))
+        evaluator = Evaluator(wb, sheet)
+        actual = compile_tree(cached_parse(formula))(evaluator)
+        if isinstance(expected, CellError):
+            assert isinstance(actual, CellError), formula
+            assert actual.get_type() == expected.get_type(), formula
+            assert actual.get_detail() == expected.get_detail(), formula
+        else:
+            assert type(actual) is type(expected), formula
+            assert actual == expected, formula
+        assert (evaluator.get_eval_dependencies() ==
+                interpreter.get_eval_dependencies()), formula
+
+
+def test_shared_templates():
+    """
+    Tests that formulas filled down a column share one template, and that each
+    cell resolves the relative references of the template from its location.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "1")
+    wb.set_cell_contents("sheet1", "B1", "=A1+$A$1*2")
+    wb.copy_cells("sheet1", "B1", "B1", "C1")
+    for row in range(2, 6):
+        wb.set_cell_contents("sheet1", f"A{row}", f"=A{row - 1}+1")
+        wb.set_cell_contents("sheet1", f"B{row}", f"=A{row}+$A$1*2")
+    wb.copy_cells("sheet1", "B2", "B5", "C2")
+    sheet = wb.get_sheet("sheet1")
+    assert len({id(sheet.get_cell(f"A{row}").template) for row in range(2, 6)}) == 1
+    assert len({id(sheet.get_cell(f"{col}{row}").template)
+                for col in "BC" for row in range(1, 6)}) == 1
+    assert [wb.get_cell_value("sheet1", f"B{row}") for row in range(1, 6)] == [3, 4, 5, 6, 7]
+    assert [wb.get_cell_value("sheet1", f"C{row}") for row in range(1, 6)] == [5, 6, 7, 8, 9]
+    wb.set_cell_contents("sheet1", "A1", "2")
+    assert wb.get_cell_value("sheet1", "C5") == 14
+
+
+def test_float_numeric_mode():
+    """
+    Tests that a workbook in float mode holds numbers as floats, normalizing
+    them the same way as Decimal numbers, and rejects unknown numeric modes.
+    """
+    wb = Workbook(numeric="float")
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "5.50")
+    wb.set_cell_contents("sheet1", "A2", "=0.1+0.2")
+    wb.set_cell_contents("sheet1", "A3", "=A1&\"x\"")
+    wb.set_cell_contents("sheet1", "A4", "=-0*1")
+    wb.set_cell_contents("sheet1", "A5", "=A1/0")
+    wb.set_cell_contents("sheet1", "A6", "=A9+\"2\"")
+    assert wb.get_cell_value("sheet1", "A1") == 5.5
+    assert type(wb.get_cell_value("sheet1", "A1")) is float
+    assert wb.get_cell_value("sheet1", "A2") == 0.1 + 0.2
+    assert wb.get_cell_value("sheet1", "A3") == "5.5x"
+    assert str(wb.get_cell_value("sheet1", "A4")) == "0.0"
+    assert wb.get_cell_value("sheet1", "A5").get_type() == CellErrorType.DIVIDE_BY_ZERO
+    assert wb.get_cell_value("sheet1", "A6") == 2.0
+    try:
+        Workbook(numeric="int")
+        assert False
+    except ValueError:
+        pass
+
+
+def test_formula_cache_eviction():
+    """
+    Tests that the formula cache counts hits and misses, evicts the least
+    recently used templates once full, and that cells keep evicted templates.
+    """
+    FORMULA_CACHE.clear()
+    Workbook.set_formula_cache_size(2)
+    try:
+        wb = Workbook()
+        wb.new_sheet()
+        wb.set_cell_contents("sheet1", "A1", "=1+1")
+        wb.set_cell_contents("sheet1", "A2", "=2+2")
+        wb.set_cell_contents("sheet1", "B1", "=A1*3")
+        wb.set_cell_contents("sheet1", "B2", "=A2*3")
+        info = Workbook.formula_cache_info()
+        assert (info.hits, info.misses, info.currsize, info.maxsize) == (1, 3, 2, 2)
+        assert info.evictions == 1
+        wb.set_cell_contents("sheet1", "C1", "=1+1")
+        assert Workbook.formula_cache_info().evictions == 2
+        wb.set_cell_contents("sheet1", "A2", "5")
+        assert [wb.get_cell_value("sheet1", loc) for loc in ["A1", "B1", "B2", "C1"]] == [2, 6, 15, 2]
+    finally:
+        Workbook.set_formula_cache_size(FORMULA_CACHE_SIZE)
+
+
+def test_cell_tables_follow_sheets():
+    """
+    Tests that compiled references read from the right cells as sheets are
+    renamed, deleted, created again and copied.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.new_sheet("Data")
+    wb.set_cell_contents("data", "A1", "2")
+    wb.set_cell_contents("sheet1", "A1", "=Data!A1 * 3")
+    wb.set_cell_contents("sheet1", "B1", "=Other!A1 + A1")
+    assert wb.get_cell_value("sheet1", "B1").get_type() == CellErrorType.BAD_REFERENCE
+    wb.rename_sheet("Data", "Other")
+    assert wb.get_cell_contents("sheet1", "A1") == "=Other!A1 * 3"
+    assert wb.get_cell_value("sheet1", "B1") == 8
+    wb.del_sheet("Other")
+    assert wb.get_cell_value("sheet1", "A1").get_type() == CellErrorType.BAD_REFERENCE
+    wb.new_sheet("Other")
+    wb.set_cell_contents("other", "A1", "5")
+    assert wb.get_cell_value("sheet1", "B1") == 20
+    _, copy_name = wb.copy_sheet("Sheet1")
+    wb.set_cell_contents(copy_name, "A1", "=B2 + 1")
+    assert wb.get_cell_value(copy_name, "A1") == 1
+    assert wb.get_cell_value(copy_name, "B1") == 6
+    assert wb.get_cell_value("sheet1", "B1") == 20
@@ -126,11 +126,91 @@ def test_or_err_prop():
     wb.set_cell_contents("sheet1", "A2", "=OR(A1, 5, 4)")
     wb.set_cell_contents("sheet1", "A3", "=OR(5, A1, 4)")
     wb.set_cell_contents("sheet1", "A4", "=OR(5, #REF!, A1)")
+    wb.set_cell_contents("sheet1", "A5", "=OR(0, A1, 4)")
     assert isinstance(wb.get_cell_value("sheet1", "A2"), CellError)
     assert wb.get_cell_value("sheet1", "A2").get_type() == CellErrorType.DIVIDE_BY_ZERO
-    assert wb.get_cell_value("sheet1", "A3").get_type() == CellErrorType.DIVIDE_BY_ZERO
-    assert (wb.get_cell_value("sheet1", "A4").get_type() == CellErrorType.BAD_REFERENCE
-            or wb.get_cell_value("sheet1", "A4").get_type() == CellErrorType.DIVIDE_BY_ZERO)
+    # OR stops at the first true argument, so later errors are not reached
+    assert wb.get_cell_value("sheet1", "A3") is True
+    assert wb.get_cell_value("sheet1", "A4") is True
+    assert wb.get_cell_value("sheet1", "A5").get_type() == CellErrorType.DIVIDE_BY_ZERO
+
+
+def test_and_or_short_circuit():
+    """
+    Tests that AND and OR stop at the first decisive argument, and that the
+    cells read by the arguments they skip are not dependencies.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "FALSE")
+    wb.set_cell_contents("sheet1", "C1", "=1/0")
+    wb.set_cell_contents("sheet1", "B1", "=AND(A1, INDIRECT(\"C1\"))")
+    wb.set_cell_contents("sheet1", "B2", "=OR(NOT(A1), C1)")
+    assert wb.get_cell_value("sheet1", "B1") is False
+    assert wb.get_cell_value("sheet1", "B2") is True
+    assert not wb.interaction_graph.has_dynamic_dependencies(("sheet1", "B1"))
+    assert not wb.interaction_graph.has_dynamic_dependencies(("sheet1", "B2"))
+    wb.set_cell_contents("sheet1", "A1", "TRUE")
+    assert wb.get_cell_value("sheet1", "B1").get_type() == CellErrorType.DIVIDE_BY_ZERO
+    assert wb.get_cell_value("sheet1", "B2").get_type() == CellErrorType.DIVIDE_BY_ZERO
+    wb.set_cell_contents("sheet1", "C1", "1")
+    assert wb.get_cell_value("sheet1", "B1") is True
+    assert wb.get_cell_value("sheet1", "B2") is True
+    wb.set_cell_contents("sheet1", "B3", "=AND()")
+    assert wb.get_cell_value("sheet1", "B3").get_type() == CellErrorType.TYPE_ERROR
+
+
+def test_and_or_blank_arguments():
+    """
+    Tests that AND and OR read an empty cell as FALSE wherever it is among
+    their arguments, as NOT does.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    expected = {
+        "=AND(1, C2)": False,
+        "=AND(C2, 1)": False,
+        "=AND(C2)": False,
+        "=OR(0, C2)": False,
+        "=OR(C2, 1)": True,
+        "=OR(1, C2)": True,
+        "=NOT(C2)": True,
+    }
+    for formula, value in expected.items():
+        wb.set_cell_contents("sheet1", "A1", formula)
+        assert wb.get_cell_value("sheet1", "A1") is value, formula
+
+
+def test_nested_short_circuit_dependencies():
+    """
+    Tests that the cells read by skipped arguments are not dependencies when
+    the lazy or conditional function is nested in the formula.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "FALSE")
+    wb.set_cell_contents("sheet1", "C1", "=1/0")
+    wb.set_cell_contents("sheet1", "B1", "=NOT(AND(A1, C1))")
+    wb.set_cell_contents("sheet1", "B2", "=AND (A1, C1)")
+    wb.set_cell_contents("sheet1", "B3", "=1 + IF(A1, C1, E1) + D1")
+    wb.set_cell_contents("sheet1", "B4", '=IF(A1 & ",(" = "TRUE,(", C1)')
+    graph = wb.interaction_graph
+    for location in ("B1", "B2", "B4"):
+        assert graph.get_dependencies(("sheet1", location)) == [("sheet1", "A1")]
+    # The branch taken is only read as the formula is evaluated
+    assert sorted(graph.get_dependencies(("sheet1", "B3"))) == \
+        [("sheet1", "A1"), ("sheet1", "D1"), ("sheet1", "E1")]
+    assert not graph.has_dynamic_dependencies(("sheet1", "B1"))
+    cells = ("B1", "B2", "B3", "B4")
+    assert [wb.get_cell_value("sheet1", cell) for cell in cells] == \
+        [True, False, 1, False]
+    wb.set_cell_contents("sheet1", "A1", "TRUE")
+    for cell in ("B1", "B3", "B4"):
+        assert wb.get_cell_value("sheet1", cell).get_type() == \
+            CellErrorType.DIVIDE_BY_ZERO, cell
+    wb.set_cell_contents("sheet1", "C1", "=2")
+    assert [wb.get_cell_value("sheet1", cell) for cell in cells] == \
+        [False, True, 3, 2]
 
 
 def test_xor_err_prop():
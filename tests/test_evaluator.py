@@ -4,6 +4,8 @@ Tests for correct behavior when evaluating formula expressions independent of an
 
 # import testing packages
 from decimal import Decimal
+import gc
+import weakref
 import test_utils as utils
 
 # import modules to be tested
@@ -840,4 +842,42 @@ def test_num_bool_conv():
         assert Evaluator.check_bool(n) is True
 
 
+def test_overlapping_names():
+    """
+    Tests that names which could be cell references, sheet names, function
+    names or booleans are told apart by what follows them.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.new_sheet("True")
+    wb.set_cell_contents("true", "A1", "4")
+    wb.set_cell_contents("sheet1", "TRUE1", "3")
+    formulas = {"=TRUE1 + 1": 4, "=TRUE": True, "=TRUE!A1": 4, "=True!A1 * 2": 8,
+                "=TRUE1!=Sheet1!TRUE1": False, "=NOT (TRUE)": False, "=-TRUE1": -3}
+    for formula, value in formulas.items():
+        wb.set_cell_contents("sheet1", "C1", formula)
+        assert wb.get_cell_value("sheet1", "C1") == value, formula
+    wb.set_cell_contents("sheet1", "C1", "=A1(1)")
+    assert wb.get_cell_value("sheet1", "C1").get_type() == CellErrorType.BAD_NAME
+    wb.set_cell_contents("sheet1", "C1", "=Sheets")
+    assert wb.get_cell_value("sheet1", "C1").get_type() == CellErrorType.PARSE_ERROR
+
+
+def test_dropped_workbook_freed():
+    """
+    Tests that evaluating formulas keeps no references to the workbook outside
+    of it, so a dropped workbook is freed.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "5")
+    wb.set_cell_contents("sheet1", "A2", "=(A1*2) & \"x\"")
+    wb.set_cell_contents("sheet1", "A3", "=IF(A1 > 1, INDIRECT(\"A2\"), 0)")
+    assert wb.get_cell_value("sheet1", "A3") == "10x"
+    ref = weakref.ref(wb)
+    del wb
+    gc.collect()
+    assert ref() is None
+
+
 utils.run_all(__name__)
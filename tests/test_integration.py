@@ -589,13 +589,13 @@ def test_abs_ref_graph():
     wb = sheets.Workbook()
     wb.new_sheet()
     wb.set_cell_contents("sheet1", "a1", "=sheet1!$a2")
-    assert wb.interaction_graph.graph[("sheet1", "A1")] == [("sheet1", "A2")]
+    assert wb.interaction_graph.get_dependencies(("sheet1", "A1")) == [("sheet1", "A2")]
     wb.set_cell_contents("ShEeT1", "b1", "=sHeET1!$a$5")
-    assert wb.interaction_graph.graph[("sheet1", "B1")] == [("sheet1", "A5")]
+    assert wb.interaction_graph.get_dependencies(("sheet1", "B1")) == [("sheet1", "A5")]
     wb.set_cell_contents("shEEt1", "C1", "=$z$1 + 'Sheet1'!$z$2 + \"$Z3\" - ShEEt1!z$4")
-    assert wb.interaction_graph.graph[("sheet1", "C1")] == [("sheet1", "Z1"),
-                                                              ("sheet1", "Z2"),
-                                                              ("sheet1", "Z4")]
+    assert wb.interaction_graph.get_dependencies(("sheet1", "C1")) == [("sheet1", "Z1"),
+                                                                         ("sheet1", "Z2"),
+                                                                         ("sheet1", "Z4")]
 
 
 utils.run_all(__name__)
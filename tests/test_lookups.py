@@ -0,0 +1,178 @@
+"""
+Tests for the lookup functions VLOOKUP, HLOOKUP, MATCH and XLOOKUP, the
+conditional aggregates COUNTIF, SUMIF and AVERAGEIF, and the indexes of the
+ranges which they search.
+"""
+
+import random
+from decimal import Decimal
+
+from sheets import Workbook, CellErrorType
+from sheets.lookups import ValueIndex, lookup_key
+from sheets.ranges import RangeValue
+
+
+def make_table(wb):
+    """
+    Fills sheet1 with a table of fruit in A1:C4.
+    """
+    rows = [("apple", "1", "10"), ("Banana", "2", "20"), ("cherry", "3", "30"),
+            ("banana", "4", "40")]
+    for row, values in enumerate(rows, 1):
+        for col, value in zip("ABC", values):
+            wb.set_cell_contents("sheet1", f"{col}{row}", value)
+
+
+def test_lookup_functions():
+    """
+    Tests exact and nearest matches of each of the lookup functions.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    make_table(wb)
+    expected = {
+        '=VLOOKUP("BANANA", A1:C4, 2, FALSE)': Decimal(2),
+        "=VLOOKUP(25, C1:C4, 1)": Decimal(20),
+        '=HLOOKUP("cherry", A3:C4, 2, FALSE)': "banana",
+        "=MATCH(30, C1:C4, 0)": Decimal(3),
+        "=MATCH(35, C1:C4)": Decimal(3),
+        "=MATCH(35, B1:B4, -1)": None,
+        '=XLOOKUP("cherry", A1:A4, C1:C4)': Decimal(30),
+        '=XLOOKUP("kiwi", A1:A4, C1:C4, "none")': "none",
+        "=XLOOKUP(33, C1:C4, A1:A4, 0, 1)": "banana",
+        "=XLOOKUP(33, C1:C4, A1:A4, 0, -1)": "cherry",
+    }
+    for formula, value in expected.items():
+        wb.set_cell_contents("sheet1", "E1", formula)
+        result = wb.get_cell_value("sheet1", "E1")
+        if value is None:
+            assert result.get_type() == CellErrorType.TYPE_ERROR, formula
+        else:
+            assert result == value, formula
+
+    for formula in ("=VLOOKUP(5, C1:C4, 1)", "=VLOOKUP(A1:A2, A1:C4, 2)",
+                    '=VLOOKUP("apple", A1:C4, 4)', "=MATCH(1, A1:C4)",
+                    "=XLOOKUP(1, A1:A4, B1:B3)"):
+        wb.set_cell_contents("sheet1", "E1", formula)
+        assert wb.get_cell_value("sheet1", "E1").get_type() == \
+            CellErrorType.TYPE_ERROR, formula
+
+
+def test_lookups_follow_changes(monkeypatch):
+    """
+    Tests that the index of a column is built once, and then follows changes
+    to the values in the column, including cells holding formulas.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    make_table(wb)
+    wb.set_cell_contents("sheet1", "E1", '=VLOOKUP("banana", A1:C4, 3, FALSE)')
+    assert wb.get_cell_value("sheet1", "E1") == Decimal(20)
+
+    def fail(_):
+        raise AssertionError("column read again")
+    monkeypatch.setattr(RangeValue, "items", fail)
+    wb.set_cell_contents("sheet1", "A2", "pear")
+    assert wb.get_cell_value("sheet1", "E1") == Decimal(40)
+    wb.set_cell_contents("sheet1", "A4", None)
+    assert wb.get_cell_value("sheet1", "E1").get_type() == \
+        CellErrorType.TYPE_ERROR
+    wb.set_cell_contents("sheet1", "A3", '="BAN" & "ANA"')
+    assert wb.get_cell_value("sheet1", "E1") == Decimal(30)
+    wb.set_cell_contents("sheet1", "C3", "=B3 * 100")
+    assert wb.get_cell_value("sheet1", "E1") == Decimal(300)
+
+
+def test_value_index():
+    """
+    Tests that the index of a column finds the same positions as searching
+    its values one by one, as its values change.
+    """
+    rng = random.Random(22)
+    choices = [Decimal(1), Decimal(2), Decimal(3), "a", "B", True, None]
+    values = {}
+    index = ValueIndex("A1:A12", [])
+    for _ in range(200):
+        location = f"A{rng.randint(1, 12)}"
+        value = rng.choice(choices)
+        index.replace(location, values.get(location), value)
+        values[location] = value
+        key = lookup_key(rng.choice(choices[:-1]))
+        found = sorted((int(location[1:]) - 1, lookup_key(value))
+                       for location, value in values.items()
+                       if lookup_key(value) is not None and
+                       lookup_key(value)[0] == key[0])
+        exact = [position for position, found_key in found if found_key == key]
+        below = [found_key for _, found_key in found if found_key <= key]
+        above = [found_key for _, found_key in found if found_key >= key]
+        assert index.find(key[1], 0) == (exact[0] if exact else None)
+        assert index.find(key[1], -1, True) == (
+            max(position for position, found_key in found
+                if found_key == max(below)) if below else None)
+        assert index.find(key[1], 1) == (
+            min(position for position, found_key in found
+                if found_key == min(above)) if above else None)
+
+
+def test_conditional_aggregates():
+    """
+    Tests that COUNTIF, SUMIF and AVERAGEIF find the cells matching each kind
+    of criterion.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    make_table(wb)
+    wb.set_cell_contents("sheet1", "A5", "=1/0")
+    wb.set_cell_contents("sheet1", "B6", "6")
+    expected = {
+        '=COUNTIF(A1:A6, "banana")': Decimal(2),
+        '=COUNTIF(A1:A6, "<>banana")': Decimal(4),
+        '=COUNTIF(A1:A6, "")': Decimal(1),
+        '=COUNTIF(B1:C6, ">=4")': Decimal(6),
+        '=COUNTIF(A1:A6, ">b")': Decimal(3),
+        "=COUNTIF(B1:B6, 2)": Decimal(1),
+        '=SUMIF(C1:C6, "<25")': Decimal(30),
+        '=SUMIF(A1:A6, "banana", C1:C6)': Decimal(60),
+        '=SUMIF(A1:A6, "", B1:B6)': Decimal(6),
+        '=SUMIF(B1:B6, "<>2")': Decimal(14),
+        '=AVERAGEIF(A1:A6, "<>apple", B1:B6)': Decimal(3.75),
+    }
+    for formula, value in expected.items():
+        wb.set_cell_contents("sheet1", "E1", formula)
+        assert wb.get_cell_value("sheet1", "E1") == value, formula
+
+    for formula, error_type in (
+            ('=AVERAGEIF(A1:A6, "kiwi", B1:B6)', CellErrorType.DIVIDE_BY_ZERO),
+            ('=SUMIF(A1:A6, "banana", B1:B5)', CellErrorType.TYPE_ERROR),
+            ('=SUMIF(B1:B6, "<>1", A1:A6)', CellErrorType.DIVIDE_BY_ZERO)):
+        wb.set_cell_contents("sheet1", "E1", formula)
+        assert wb.get_cell_value("sheet1", "E1").get_type() == error_type, formula
+
+
+def test_criteria_follow_changes():
+    """
+    Tests that COUNTIF over a changing range counts the same cells as testing
+    each cell against the criterion.
+    """
+    rng = random.Random(23)
+    wb = Workbook()
+    wb.new_sheet()
+    criteria = ['"b"', '">2"', '"<=2"', '"<>1"', '""', '"<>"', '">a"']
+    for row, criterion in enumerate(criteria, 1):
+        wb.set_cell_contents("sheet1", f"Z{row}", f"=COUNTIF(A1:B5, {criterion})")
+    tests = [lambda v: isinstance(v, str) and v.lower() == "b",
+             lambda v: isinstance(v, Decimal) and v > 2,
+             lambda v: isinstance(v, Decimal) and v <= 2,
+             lambda v: isinstance(v, bool) or v != 1,
+             lambda v: v is None,
+             lambda v: v is not None,
+             lambda v: isinstance(v, str) and v.lower() > "a"]
+    for _ in range(150):
+        location = f"{rng.choice('AB')}{rng.randint(1, 5)}"
+        wb.set_cell_contents("sheet1", location,
+                             rng.choice([None, "1", "2", "3", "a", "B", "TRUE"]))
+        values = [wb.get_cell_value("sheet1", f"{col}{row}")
+                  for col in "AB" for row in range(1, 6)]
+        for row, test in enumerate(tests, 1):
+            assert wb.get_cell_value("sheet1", f"Z{row}") == \
+                sum(1 for value in values if test(value)), criteria[row - 1]
@@ -352,3 +352,38 @@ def test_copy_notifs():
     # which are updated
     wb.copy_sheet("Sheet1")
     assert OUT[0] == set([("sheet1_1", "A1"), ("sheet1_1", "B1"), ("sheet1_1", "C1")])
+
+
+def test_batch_notifs():
+    """
+    Ensures that edits made in a batch are recalculated and reported once, when
+    the outermost batch ends, and that values read inside the batch are up to
+    date.
+    """
+    global OUT # pylint: disable=global-statement
+    # Define the subscriber function
+    OUT = []
+    def on_cells_changed(workbook, changed_cells): # pylint: disable=unused-argument
+        OUT.append(set(changed_cells))
+
+    wb = sheets.Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("Sheet1", "A1", "1")
+    wb.set_cell_contents("Sheet1", "B1", "=A1+1")
+    wb.notify_cells_changed(on_cells_changed)
+
+    with wb.batch():
+        wb.set_cell_contents("Sheet1", "A1", "2")
+        with wb.batch():
+            wb.set_cell_contents("Sheet1", "C1", "=B1*10")
+        assert wb.get_cell_value("Sheet1", "C1") == decimal.Decimal(30)
+        wb.set_cell_contents("Sheet1", "A1", "3")
+        assert not OUT
+    assert OUT == [set([("sheet1", "A1"), ("sheet1", "B1"), ("sheet1", "C1")])]
+    assert wb.get_cell_value("Sheet1", "C1") == decimal.Decimal(40)
+
+    # The explicit form behaves the same way
+    wb.begin()
+    wb.set_cell_contents("Sheet1", "A1", "0")
+    wb.commit()
+    assert OUT[1] == set([("sheet1", "A1"), ("sheet1", "B1"), ("sheet1", "C1")])
@@ -0,0 +1,77 @@
+"""
+Tests for recalculating wide workbooks on a process pool.
+"""
+
+import gc
+
+import sheets.workbook
+from sheets import Workbook, CellErrorType
+from sheets.cell import get_template
+from sheets.parallel import is_parallel_safe
+
+
+def test_parallel_safe_formulas():
+    """
+    Tests that only formulas which read nothing but their static references
+    are evaluated on the pool.
+    """
+    assert is_parallel_safe(get_template("=A1+1", "A1"))
+    assert is_parallel_safe(get_template("=XOR(A1, NOT(Sheet2!B1))", "A1"))
+    assert not is_parallel_safe(get_template("=AND(A1, NOT(Sheet2!B1))", "A1"))
+    assert not is_parallel_safe(get_template("=IF(A1, B1, C1)", "A1"))
+    assert not is_parallel_safe(get_template("=1+INDIRECT(\"A1\")", "A1"))
+    assert not is_parallel_safe(get_template("=NOSUCHFUNC(A1)", "A1"))
+
+
+def test_parallel_mesh(monkeypatch):
+    """
+    Tests that a mesh of chains evaluated on the pool gives the same values as
+    a serial workbook, and falls back to the serial pass for cycles.
+    """
+    monkeypatch.setattr(sheets.workbook, "MIN_PARALLEL_LEVEL", 4)
+    workbooks = [Workbook(), Workbook(workers=2)]
+    for wb in workbooks:
+        wb.new_sheet()
+        for row in range(1, 11):
+            wb.set_cell_contents("Sheet1", f"B{row}", "=A1")
+            wb.set_cell_contents("Sheet1", f"C{row}", f"=B{row}+{row}")
+            wb.set_cell_contents("Sheet1", f"D{row}", f"=C{row}&\"!\"")
+        wb.set_cell_contents("Sheet1", "A1", "3")
+        wb.set_cell_contents("Sheet1", "A1", "=1/0")
+        wb.set_cell_contents("Sheet1", "A1", "5")
+        assert wb.get_cell_value("Sheet1", "D10") == "15!"
+        wb.set_cell_contents("Sheet1", "A1", "=D1")
+        assert (wb.get_cell_value("Sheet1", "D10").get_type() ==
+                CellErrorType.CIRCULAR_REFERENCE)
+        wb.set_cell_contents("Sheet1", "A1", "1")
+    values = [[wb.get_cell_value("Sheet1", f"{col}{row}")
+               for col in "BCD" for row in range(1, 11)] for wb in workbooks]
+    assert values[0] == values[1]
+
+
+
+def test_pool_shutdown(monkeypatch):
+    """
+    Tests that the workers of the pool exit when the workbook is closed, that
+    a closed workbook starts a new pool if needed, and that the workers of a
+    dropped workbook exit once it is collected.
+    """
+    monkeypatch.setattr(sheets.workbook, "MIN_PARALLEL_LEVEL", 4)
+    wb = Workbook(workers=2)
+    wb.new_sheet()
+    for row in range(1, 9):
+        wb.set_cell_contents("Sheet1", f"B{row}", f"=A1+{row}")
+    wb.set_cell_contents("Sheet1", "A1", "1")
+    processes = list(wb._pool._processes.values())
+    assert processes and all(process.is_alive() for process in processes)
+    wb.close()
+    assert not any(process.is_alive() for process in processes)
+    wb.close()
+
+    wb.set_cell_contents("Sheet1", "A1", "2")
+    assert wb.get_cell_value("Sheet1", "B8") == 10
+    processes = list(wb._pool._processes.values())
+    assert processes and all(process.is_alive() for process in processes)
+    del wb
+    gc.collect()
+    assert not any(process.is_alive() for process in processes)
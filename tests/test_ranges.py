@@ -0,0 +1,205 @@
+"""
+Tests for ranges of cells, which formulas read as a single dependency however
+many cells they cover.
+"""
+
+import random
+from decimal import Decimal
+
+from sheets import Workbook, CellError, CellErrorType
+from sheets.ranges import RangeIndex, range_from_bounds, range_name
+from sheets.spreadsheet import location_from_coords
+
+
+def test_range_name():
+    """
+    Tests that ranges are named by their top left and bottom right corners,
+    whichever corners they are written with.
+    """
+    assert range_name("A1", "B10") == "A1:B10"
+    assert range_name("b10", "$A$1") == "A1:B10"
+    assert range_name("B1", "A10") == "A1:B10"
+    assert range_name("C3", "C3") == "C3:C3"
+
+
+def test_sum_range():
+    """
+    Tests that SUM adds the numbers in a range, skipping empty cells, strings
+    and booleans in it, while converting the arguments given directly.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "1")
+    wb.set_cell_contents("sheet1", "A2", "'2")
+    wb.set_cell_contents("sheet1", "A3", "TRUE")
+    wb.set_cell_contents("sheet1", "B1", "4.5")
+    wb.set_cell_contents("sheet1", "B3", "=A1*10")
+    wb.set_cell_contents("sheet1", "C1", "=SUM(A1:B3)")
+    wb.set_cell_contents("sheet1", "C2", "=SUM(B3:A1, A2, A3)")
+    wb.set_cell_contents("sheet1", "C3", "=SUM(A1:B3, \"x\")")
+    assert wb.get_cell_value("sheet1", "C1") == Decimal("15.5")
+    assert wb.get_cell_value("sheet1", "C2") == Decimal("18.5")
+    assert wb.get_cell_value("sheet1", "C3").get_type() == CellErrorType.TYPE_ERROR
+
+    wb.set_cell_contents("sheet1", "A2", "=1/0")
+    assert wb.get_cell_value("sheet1", "C1").get_type() == CellErrorType.DIVIDE_BY_ZERO
+
+
+def test_range_errors():
+    """
+    Tests that ranges are only passed to functions which take them, that the
+    arrays of ranges used as values are not passed to functions, and that
+    ranges on missing sheets are bad references.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "1")
+    for formula in ("=NOT(A1:A2)", "=SUM(A1:A2 + 1)", "=IF(A1:A2, 1)"):
+        wb.set_cell_contents("sheet1", "B1", formula)
+        value = wb.get_cell_value("sheet1", "B1")
+        assert isinstance(value, CellError), formula
+        assert value.get_type() == CellErrorType.TYPE_ERROR, formula
+    wb.set_cell_contents("sheet1", "B1", "=SUM(Sheet2!A1:A2)")
+    assert wb.get_cell_value("sheet1", "B1").get_type() == CellErrorType.BAD_REFERENCE
+
+    wb.new_sheet()
+    wb.set_cell_contents("sheet2", "A2", "5")
+    assert wb.get_cell_value("sheet1", "B1") == 5
+
+
+def test_range_is_one_node():
+    """
+    Tests that a formula reading a large range adds a single node to the
+    graph, and is still updated when any cell in the range changes.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    for row in range(1, 10000):
+        wb.set_cell_contents("sheet1", f"A{row}", "1")
+    wb.set_cell_contents("sheet1", "B1", "=SUM(A1:A9999)")
+    graph = wb.interaction_graph
+    assert graph.get_cells() == [("sheet1", "B1")]
+    assert graph.get_dependencies(("sheet1", "B1")) == [("sheet1", "A1:A9999")]
+    assert graph.get_dependencies(("sheet1", "A1:A9999")) == []
+    assert wb.get_cell_value("sheet1", "B1") == 9999
+
+    wb.set_cell_contents("sheet1", "A5000", "2")
+    assert wb.get_cell_value("sheet1", "B1") == 10000
+    wb.set_cell_contents("sheet1", "A9999", None)
+    assert wb.get_cell_value("sheet1", "B1") == 9999
+    wb.set_cell_contents("sheet1", "A10", "=A1*11")
+    assert wb.get_cell_value("sheet1", "B1") == 10009
+    assert graph.get_dependencies(("sheet1", "A1:A9999")) == [("sheet1", "A10")]
+    wb.set_cell_contents("sheet1", "B1", None)
+    assert not graph.cells_in_sheet("sheet1") & {("sheet1", "A1:A9999")}
+
+
+def test_range_cycle():
+    """
+    Tests that a formula reading a range which covers the formula itself is a
+    circular reference, which is broken when the range no longer covers it.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "1")
+    wb.set_cell_contents("sheet1", "A3", "=SUM(A1:A3)")
+    wb.set_cell_contents("sheet1", "B1", "=A3+1")
+    assert wb.get_cell_value("sheet1", "A3").get_type() == \
+        CellErrorType.CIRCULAR_REFERENCE
+    assert wb.get_cell_value("sheet1", "B1").get_type() == \
+        CellErrorType.CIRCULAR_REFERENCE
+
+    wb.set_cell_contents("sheet1", "A3", "=SUM(A1:A2)")
+    assert wb.get_cell_value("sheet1", "A3") == 1
+    assert wb.get_cell_value("sheet1", "B1") == 2
+
+
+def test_range_sheet_changes():
+    """
+    Tests that ranges follow renamed sheets, and become bad references when
+    their sheet is deleted.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.new_sheet("Data")
+    wb.set_cell_contents("data", "A1", "2")
+    wb.set_cell_contents("data", "B2", "3")
+    wb.set_cell_contents("sheet1", "A1", "=SUM(Data!A1:B2)")
+    assert wb.get_cell_value("sheet1", "A1") == 5
+
+    wb.rename_sheet("Data", "Other")
+    assert wb.get_cell_contents("sheet1", "A1") == "=SUM(Other!A1:B2)"
+    wb.set_cell_contents("other", "A2", "4")
+    assert wb.get_cell_value("sheet1", "A1") == 9
+
+    wb.del_sheet("Other")
+    assert wb.get_cell_value("sheet1", "A1").get_type() == CellErrorType.BAD_REFERENCE
+
+    # A sheet renamed to the missing sheet moves its formulas into the range
+    wb.new_sheet("Copy")
+    wb.set_cell_contents("copy", "B1", "=A1 + 1")
+    wb.set_cell_contents("copy", "A1", "1")
+    wb.rename_sheet("Copy", "Other")
+    assert wb.get_cell_value("sheet1", "A1") == 3
+    wb.set_cell_contents("other", "A1", "5")
+    assert wb.get_cell_value("sheet1", "A1") == 11
+    wb.del_sheet("Other")
+    assert wb.get_cell_value("sheet1", "A1").get_type() == CellErrorType.BAD_REFERENCE
+
+
+def test_lazy_ranges():
+    """
+    Tests that reading a range in lazy mode brings the dirty cells inside it
+    up to date, including ranges first read by a branch of an IF.
+    """
+    wb = Workbook(lazy=True)
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "1")
+    wb.set_cell_contents("sheet1", "A2", "=A1*2")
+    wb.set_cell_contents("sheet1", "B1", "=IF(A1 > 1, SUM(A1:A2), 0)")
+    assert wb.get_cell_value("sheet1", "B1") == 0
+    wb.set_cell_contents("sheet1", "A1", "5")
+    assert wb.get_cell_value("sheet1", "B1") == 15
+    wb.set_cell_contents("sheet1", "A1", "6")
+    assert wb.get_cell_value("sheet1", "B1") == 18
+
+    # Cells set before a range is first read become formulas inside it
+    wb.set_cell_contents("sheet1", "C1", "1")
+    wb.set_cell_contents("sheet1", "C2", "2")
+    wb.set_cell_contents("sheet1", "D1", "=SUM(C1:C2)")
+    assert wb.get_cell_value("sheet1", "D1") == 3
+    wb.set_cell_contents("sheet1", "C2", "=A1")
+    assert wb.get_cell_value("sheet1", "D1") == 7
+
+
+def test_range_index():
+    """
+    Tests that the range index finds exactly the ranges covering each cell,
+    and the ranges overlapping each range.
+    """
+    rng = random.Random(7)
+    index = RangeIndex()
+    ranges = {}
+    for item in range(200):
+        left, right = sorted(rng.randint(1, 40) for _ in range(2))
+        top, bottom = sorted(rng.randint(1, 300) for _ in range(2))
+        ranges[item] = (left, top, right, bottom)
+        index.add("sheet1", range_from_bounds(left, top, right, bottom), item)
+    for item in range(0, 200, 3):
+        index.remove("sheet1", range_from_bounds(*ranges.pop(item)), item)
+    for _ in range(500):
+        col, row = rng.randint(1, 45), rng.randint(1, 310)
+        expected = {item for item, (left, top, right, bottom) in ranges.items()
+                    if left <= col <= right and top <= row <= bottom}
+        assert index.covering("sheet1", location_from_coords(col, row)) == expected
+    assert index.covering("sheet2", "A1") == set()
+    for _ in range(300):
+        left, right = sorted(rng.randint(1, 45) for _ in range(2))
+        top, bottom = sorted(rng.randint(1, rng.choice([5, 310])) for _ in range(2))
+        expected = {item for item, bounds in ranges.items()
+                    if bounds[0] <= right and left <= bounds[2] and
+                    bounds[1] <= bottom and top <= bounds[3]}
+        assert index.overlapping(
+            "sheet1", range_from_bounds(left, top, right, bottom)) == expected
+    assert index.overlapping("sheet2", "A1:B2") == set()
+
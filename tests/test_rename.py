@@ -226,3 +226,33 @@ def test_bad_ref_rename():
     wb.rename_sheet("Sheet1", "NOTASHEET")
     assert not isinstance(wb.get_cell_value("Sheet2", "A1"), CellError)
     assert wb.get_cell_value("Sheet2", "A1") == 5
+
+
+def test_rename_dynamic_references():
+    """
+    Ensures that references which are only read as the formula is evaluated,
+    such as the arguments AND and OR skip and the branches of IF, are renamed
+    wherever they are nested in the formula.
+    """
+    for lazy in (False, True):
+        wb = Workbook(lazy=lazy)
+        _, _ = wb.new_sheet(), wb.new_sheet()
+        wb.set_cell_contents("Sheet1", "A1", "5")
+        formulas = {
+            "A1": ("=OR(TRUE, Sheet1!A1)", "=OR(TRUE, Foo!A1)", True),
+            "A2": ("=1+IF(TRUE, Sheet1!A1, 0)", "=1+IF(TRUE, Foo!A1, 0)", 6),
+            "A3": ("=IF(TRUE, Sheet1!A1, 0)", "=IF(TRUE, Foo!A1, 0)", 5),
+            "A4": ("=NOT(AND(FALSE, SUM(Sheet1!A1:A2)))",
+                   "=NOT(AND(FALSE, SUM(Foo!A1:A2)))", True),
+            "A5": ('=IF(FALSE, "Sheet1!A1", Sheet1!A1)',
+                   '=IF(FALSE, "Sheet1!A1", Foo!A1)', 5),
+        }
+        for location, (formula, _, _) in formulas.items():
+            wb.set_cell_contents("Sheet2", location, formula)
+        wb.rename_sheet("Sheet1", "Foo")
+        for location, (_, renamed, value) in formulas.items():
+            assert wb.get_cell_contents("Sheet2", location) == renamed, location
+            assert wb.get_cell_value("Sheet2", location) == value, location
+        wb.set_cell_contents("Foo", "A1", "7")
+        assert wb.get_cell_value("Sheet2", "A2") == 8
+        assert wb.get_cell_value("Sheet2", "A3") == 7
@@ -0,0 +1,121 @@
+"""
+Tests for Python functions registered with a workbook, and the memos which
+keep the results of pure functions.
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from sheets import Workbook, CellErrorType
+
+
+def test_register_function():
+    """
+    Tests that registered functions convert their arguments and results, and
+    that cells calling a function before it was registered are updated.
+    """
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("sheet1", "A1", "=Scale(B1, 2)")
+    assert wb.get_cell_value("sheet1", "A1").get_type() == CellErrorType.BAD_NAME
+
+    wb.register_function("scale", lambda x, k: x * k, min_args=2, max_args=2,
+                         arg_types=[Decimal, Decimal])
+    assert wb.get_cell_value("sheet1", "A1") == Decimal(0)
+    wb.set_cell_contents("sheet1", "B1", "'2.5")
+    assert wb.get_cell_value("sheet1", "A1") == Decimal(5)
+
+    wb.register_function("half", lambda x: x / 2, arg_types={0: float})
+    wb.register_function("greet", lambda name="": f"hi {name}".strip())
+    expected = {
+        "=HALF(3)": Decimal("1.5"),
+        '=greet("bob")': "hi bob",
+        "=greet()": "hi",
+    }
+    for formula, value in expected.items():
+        wb.set_cell_contents("sheet1", "C1", formula)
+        assert wb.get_cell_value("sheet1", "C1") == value, formula
+
+    # Results which are not finite numbers are errors which can be compared
+    wb.register_function("nan", lambda: float("nan"))
+    wb.register_function("inf", lambda: Decimal("-Infinity"))
+    wb.set_cell_contents("sheet1", "D1", "=A1 > 1")
+    for formula in ("=NAN()", "=INF()"):
+        wb.set_cell_contents("sheet1", "A1", formula)
+        assert wb.get_cell_value("sheet1", "A1").get_type() == \
+            CellErrorType.TYPE_ERROR, formula
+        assert wb.get_cell_value("sheet1", "D1").get_type() == \
+            CellErrorType.TYPE_ERROR, formula
+    for numeric in ("decimal", "float"):
+        other = Workbook(numeric=numeric)
+        other.new_sheet()
+        other.register_function("big", lambda: float("inf"))
+        other.set_cell_contents("sheet1", "A1", "=BIG()")
+        assert other.get_cell_value("sheet1", "A1").get_type() == \
+            CellErrorType.TYPE_ERROR, numeric
+
+    wb.register_function("fail", lambda: 1 / 0)
+    wb.register_function("thing", lambda: object())
+    for formula, error_type in (("=SCALE(1)", CellErrorType.TYPE_ERROR),
+                                ('=SCALE("x", 1)', CellErrorType.TYPE_ERROR),
+                                ("=SCALE(1/0, 1)", CellErrorType.DIVIDE_BY_ZERO),
+                                ("=FAIL()", CellErrorType.TYPE_ERROR),
+                                ("=THING()", CellErrorType.TYPE_ERROR)):
+        wb.set_cell_contents("sheet1", "C1", formula)
+        assert wb.get_cell_value("sheet1", "C1").get_type() == error_type, formula
+    wb.set_cell_contents("sheet1", "C1", "=FAIL()")
+    assert isinstance(wb.get_cell_value("sheet1", "C1").get_exception(),
+                      ZeroDivisionError)
+
+    for args in (("SUM", sum), ("2X", abs), ("f", 3), ("f", abs, True, 2, 1),
+                 ("f", abs, True, 0, None, [int])):
+        with pytest.raises((ValueError, TypeError)):
+            wb.register_function(*args)
+
+
+def test_pure_function_memo():
+    """
+    Tests that a pure function is called once for each distinct set of
+    arguments while they stay in its memo, and impure functions every time.
+    """
+    calls = []
+
+    def price(spot, strike):
+        calls.append((spot, strike))
+        return max(spot - strike, 0)
+
+    wb = Workbook(numeric="float")
+    wb.new_sheet()
+    wb.register_function("PRICE", price, min_args=2, max_args=2,
+                         arg_types=[float, float], memo_size=2)
+    wb.register_function("NOW_PRICE", price, pure=False)
+    wb.set_cell_contents("sheet1", "A1", "10")
+    for row in range(1, 21):
+        wb.set_cell_contents("sheet1", f"B{row}", "=PRICE(A1, 4)")
+    assert wb.get_cell_value("sheet1", "B20") == 6.0
+    assert calls == [(10.0, 4.0)]
+    wb.set_cell_contents("sheet1", "A1", "12")
+    assert wb.get_cell_value("sheet1", "B20") == 8.0
+    assert len(calls) == 2
+
+    wb.set_cell_contents("sheet1", "C1", "=PRICE(TRUE, 0)")
+    wb.set_cell_contents("sheet1", "C2", "=PRICE(1, 0)")
+    assert wb.get_cell_value("sheet1", "C2") == 1.0
+    assert len(calls) == 3
+    info = wb.function_cache_info("price")
+    assert (info.hits, info.evictions, info.maxsize, info.currsize) == \
+        (39, 1, 2, 2)
+
+    # Equal arguments of different types are kept apart
+    wb.register_function("KIND", lambda value: type(value).__name__)
+    wb.set_cell_contents("sheet1", "C1", "=KIND(TRUE)")
+    wb.set_cell_contents("sheet1", "C2", "=KIND(1)")
+    assert wb.get_cell_value("sheet1", "C1") == "bool"
+    assert wb.get_cell_value("sheet1", "C2") == "float"
+
+    calls.clear()
+    wb.set_cell_contents("sheet1", "D1", "=NOW_PRICE(3, 1) + NOW_PRICE(3, 1)")
+    assert wb.get_cell_value("sheet1", "D1") == 4.0
+    assert len(calls) == 2
+    assert wb.function_cache_info("now_price") is None
@@ -0,0 +1,57 @@
+"""
+Tests for evaluating columns of cells sharing a formula template as arrays.
+"""
+
+import sheets.workbook
+from sheets import Workbook, CellErrorType
+
+
+def fill_column(wb, col, formula_at):
+    """
+    Fills rows 1 to 20 of the given column with the formula for each row.
+    """
+    for row in range(1, 21):
+        wb.set_cell_contents("Sheet1", f"{col}{row}", formula_at(row))
+
+
+def test_vectorized_column(monkeypatch):
+    """
+    Tests that a column of arithmetic and comparisons evaluated as arrays
+    gives the same values as evaluating each cell, including errors.
+    """
+    calls = []
+    evaluate_run = sheets.workbook.evaluate_run
+    monkeypatch.setattr(sheets.workbook, "evaluate_run",
+                        lambda *args: calls.append(args) or evaluate_run(*args))
+    values = []
+    for min_run in (1000, 4):
+        monkeypatch.setattr(sheets.workbook, "MIN_VECTOR_RUN", min_run)
+        wb = Workbook()
+        wb.new_sheet()
+        fill_column(wb, "A", lambda row: str(row % 5) if row % 7 else "text")
+        fill_column(wb, "B", lambda row: f"=-$D$1 * 10 / A{row} + (A{row} > 2)")
+        fill_column(wb, "C", lambda row: f"=A{row} & \"!\" & (B{row} <= 0)")
+        wb.set_cell_contents("Sheet1", "D1", "2")
+        values.append([wb.get_cell_value("Sheet1", f"{col}{row}")
+                       for col in "BC" for row in range(1, 21)])
+    assert len(calls) == 2
+    assert [str(value) for value in values[0]] == [str(value) for value in values[1]]
+    assert wb.get_cell_value("Sheet1", "B1") == -20
+    assert wb.get_cell_value("Sheet1", "B5").get_type() == CellErrorType.DIVIDE_BY_ZERO
+    assert wb.get_cell_value("Sheet1", "B7").get_type() == CellErrorType.TYPE_ERROR
+    assert wb.get_cell_value("Sheet1", "C1") == "1!TRUE"
+
+
+def test_sequential_column(monkeypatch):
+    """
+    Tests that a column where each cell reads the one before it is evaluated
+    one cell at a time.
+    """
+    monkeypatch.setattr(sheets.workbook, "MIN_VECTOR_RUN", 4)
+    monkeypatch.setattr(sheets.workbook, "evaluate_run", None)
+    wb = Workbook()
+    wb.new_sheet()
+    wb.set_cell_contents("Sheet1", "A1", "1")
+    fill_column(wb, "B", lambda row: f"=B{row - 1}+A1" if row > 1 else "0")
+    wb.set_cell_contents("Sheet1", "A1", "2")
+    assert wb.get_cell_value("Sheet1", "B20") == 38